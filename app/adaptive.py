@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from app.admission import AdmissionQueue
+
+logger = logging.getLogger("calculator")
+
+
+def read_pressure(path: str) -> float | None:
+    # "some avg10=1.23 avg60=..." from /proc/pressure/*: share of the last
+    # 10 seconds in which some task was stalled on the resource
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith("some "):
+                    fields = dict(field.split("=") for field in line.split()[1:])
+                    return float(fields["avg10"])
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def read_mem_available(path: str = "/proc/meminfo") -> int | None:
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class AdaptiveLimiter:
+    # AIMD control of the admission queue's total concurrency: the limit
+    # grows by one while slots are in demand and the host is healthy, and is
+    # cut by a quarter when CPU or memory pressure, low available memory or
+    # jobs running slower than predicted show that they are slowing each
+    # other down.
+    #
+    # Latency is judged per job, as its run time over the time predicted
+    # from earlier runs of the same code (see app.predictor), so a change in
+    # the job mix does not read as contention. The signal is the geometric
+    # mean over the runs of the last _LATENCY_WINDOW seconds; times under
+    # _LATENCY_MIN_SEC are rounded up, since start-up noise dominates them.
+
+    _DECREASE = 0.75
+    _LATENCY_RATIO = 2.0
+    _LATENCY_WINDOW = 60
+    _LATENCY_MIN_SEC = 0.5
+
+    def __init__(
+        self,
+        queue: AdmissionQueue,
+        min_limit: int,
+        max_limit: int,
+        cpu_pressure: float,
+        memory_pressure: float,
+        memory_reserve: int,
+        interval: float = 5,
+        pressure_dir: str = "/proc/pressure",
+        meminfo: str = "/proc/meminfo",
+    ):
+        self.queue = queue
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.cpu_pressure = cpu_pressure
+        self.memory_pressure = memory_pressure
+        self.memory_reserve = memory_reserve
+        self.interval = interval
+        self.pressure_dir = pressure_dir
+        self.meminfo = meminfo
+
+        self.limit = max_limit
+        self.signals: dict = {}
+        self.history: deque[dict] = deque(maxlen=100)
+        # (time observed, log of actual over predicted run time)
+        self._slowdowns: deque[tuple[float, float]] = deque()
+        self._last_decrease = 0.0
+        self._task: asyncio.Task | None = None
+        queue.set_limit(self.limit)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.tick()
+
+    def observe(self, actual_sec: float, predicted_sec: float) -> None:
+        # A finished run against the run time predicted for it
+        actual = max(actual_sec, self._LATENCY_MIN_SEC)
+        predicted = max(predicted_sec, self._LATENCY_MIN_SEC)
+        self._slowdowns.append((time.monotonic(), math.log(actual / predicted)))
+
+    def _latency_ratio(self) -> float | None:
+        cutoff = time.monotonic() - self._LATENCY_WINDOW
+        while self._slowdowns and self._slowdowns[0][0] < cutoff:
+            self._slowdowns.popleft()
+        if not self._slowdowns:
+            return None
+        return math.exp(sum(s for _, s in self._slowdowns) / len(self._slowdowns))
+
+    def _congestion(self) -> str | None:
+        cpu = read_pressure(f"{self.pressure_dir}/cpu")
+        memory = read_pressure(f"{self.pressure_dir}/memory")
+        available = read_mem_available(self.meminfo)
+        ratio = self._latency_ratio()
+        self.signals = {
+            "cpu_pressure": cpu,
+            "memory_pressure": memory,
+            "mem_available_mb": available // (1024 * 1024) if available is not None else None,
+            "latency_ratio": round(ratio, 2) if ratio is not None else None,
+        }
+
+        if cpu is not None and cpu > self.cpu_pressure:
+            return "cpu pressure"
+        if memory is not None and memory > self.memory_pressure:
+            return "memory pressure"
+        if available is not None and available < self.memory_reserve:
+            return "low memory"
+        if ratio is not None and ratio > self._LATENCY_RATIO:
+            return "latency"
+        return None
+
+    def tick(self) -> None:
+        reason = self._congestion()
+        now = time.monotonic()
+        stats = self.queue.stats()
+        if reason is not None:
+            # PSI averages over 10 seconds; let a cut take effect before the next
+            if now - self._last_decrease >= 10 and self.limit > self.min_limit:
+                self._last_decrease = now
+                self._set(max(self.min_limit, int(self.limit * self._DECREASE)), reason)
+        elif self.limit < self.max_limit and (
+            stats["queued"] or stats["active"] >= self.limit
+        ):
+            self._set(self.limit + 1, "demand")
+
+    def _set(self, limit: int, reason: str) -> None:
+        if limit == self.limit:
+            return
+        logger.info("Concurrency limit %d -> %d (%s)", self.limit, limit, reason)
+        self.limit = limit
+        self.queue.set_limit(limit)
+        self.history.append({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "limit": limit,
+            "reason": reason,
+        })
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "signals": self.signals,
+            "history": list(self.history),
+        }
@@ -0,0 +1,322 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+DEFAULT_POOL = "default"
+
+
+class AdmissionError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class MemoryBudgetError(AdmissionError):
+    # The memory limit is larger than the whole budget; retrying cannot help
+    pass
+
+
+@dataclass
+class _Waiter:
+    client: str
+    tier: str
+    future: asyncio.Future
+    memory_mb: int = 0
+    # Declared run time, for shortest-job-first
+    expected_sec: float = 0
+    queued_at: float = field(default_factory=time.monotonic)
+    pool: str | None = None
+
+    @property
+    def granted(self) -> bool:
+        return self.pool is not None
+
+
+@dataclass
+class Ticket:
+    queue: "AdmissionQueue"
+    tier: str
+    # Slot pool the ticket was granted from; differs from `tier` when borrowed
+    pool: str
+    memory_mb: int = 0
+    started: float = field(default_factory=time.monotonic)
+    released: bool = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.queue._release(self.pool, time.monotonic() - self.started, self.memory_mb)
+
+
+class AdmissionQueue:
+    # Execution slots with a bounded wait queue. Waiting clients are served
+    # round-robin by client, so one client cannot hold every queued position
+    # or starve the others.
+    #
+    # Slots are grouped into named pools, one per execution tier. A tier may
+    # borrow an idle slot from the pools listed in `borrow` when nobody is
+    # waiting for that pool's own tier.
+    #
+    # With a memory budget, each execution also commits its memory limit and
+    # is only admitted while the total fits. Smaller jobs may overtake a large
+    # one that does not fit yet, but only for _BACKFILL_SEC; after that the
+    # large job is served next.
+    #
+    # Among waiters that fit, the one with the shortest declared run time goes
+    # first. Each whole second of waiting counts as _AGING_RATE seconds less,
+    # so long jobs are not starved. Waiters with equal declared times are
+    # served in the round-robin order, however long each has waited.
+
+    _EWMA_ALPHA = 0.2
+    _BACKFILL_SEC = 5
+    _AGING_RATE = 4
+
+    def __init__(
+        self,
+        slots: int | dict[str, int],
+        max_queue: int,
+        max_per_client: int,
+        max_wait: float,
+        borrow: dict[str, tuple[str, ...]] | None = None,
+        memory_budget: int = 0,
+    ):
+        self.slots = slots if isinstance(slots, dict) else {DEFAULT_POOL: slots}
+        self.borrow = borrow or {}
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.max_wait = max_wait
+        self.active = {pool: 0 for pool in self.slots}
+        # Cap on active executions across all pools (see app.adaptive)
+        self.limit: int | None = None
+        # MB; 0 disables memory accounting
+        self.memory_budget = memory_budget
+        self.memory_committed = 0
+
+        self.admitted = 0
+        self.borrowed = 0
+        self.rejected = 0
+        self.expired = 0
+
+        # client -> its waiters, in round-robin order
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self._queued = 0
+        self._queued_by_tier = {pool: 0 for pool in self.slots}
+        self._service_sec: float | None = None
+
+    async def acquire(
+        self,
+        client: str,
+        tier: str = DEFAULT_POOL,
+        wait_forever: bool = False,
+        memory_mb: int = 0,
+        expected_sec: float = 0,
+    ) -> Ticket:
+        if not self.fits_budget(memory_mb):
+            self.rejected += 1
+            raise MemoryBudgetError("Memory limit exceeds the memory budget", 0)
+
+        pool = self._free_pool(tier, memory_mb)
+        if pool is not None and not self._queued_by_tier[tier] and self._starving() is None:
+            return self._grant(tier, pool, memory_mb)
+
+        if (
+            self._queued >= self.max_queue
+            or len(self._queues.get(client, ())) >= self.max_per_client
+        ):
+            self.rejected += 1
+            raise AdmissionError("All execution slots busy", self.retry_after(tier))
+
+        waiter = _Waiter(
+            client, tier, asyncio.get_running_loop().create_future(), memory_mb, expected_sec
+        )
+        self._queues.setdefault(client, deque()).append(waiter)
+        self._queued += 1
+        self._queued_by_tier[tier] += 1
+        if self.memory_budget:
+            # Waiters ahead may be held back by memory only; backfill around them
+            self._dispatch()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter.future),
+                timeout=None if wait_forever else self.max_wait,
+            )
+        except asyncio.TimeoutError:
+            if not waiter.granted:
+                self._remove(waiter)
+                self.expired += 1
+                raise AdmissionError(
+                    "Timed out waiting for an execution slot", self.retry_after(tier)
+                ) from None
+        except asyncio.CancelledError:
+            if waiter.granted:
+                self._release(waiter.pool, None, memory_mb)
+            else:
+                self._remove(waiter)
+            raise
+        return Ticket(self, tier, waiter.pool, memory_mb)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        client: str,
+        tier: str = DEFAULT_POOL,
+        memory_mb: int = 0,
+        expected_sec: float = 0,
+    ):
+        ticket = await self.acquire(client, tier, memory_mb=memory_mb, expected_sec=expected_sec)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def try_acquire(self, tier: str = DEFAULT_POOL, memory_mb: int = 0) -> Ticket | None:
+        # An idle slot right now, or None; never queues and never takes a slot
+        # somebody is waiting for
+        if self._queued or not self.fits_budget(memory_mb):
+            return None
+        pool = self._free_pool(tier, memory_mb)
+        if pool is None:
+            return None
+        return self._grant(tier, pool, memory_mb)
+
+    def fits_budget(self, memory_mb: int) -> bool:
+        # Whether the memory limit could ever be admitted
+        return not self.memory_budget or memory_mb <= self.memory_budget
+
+    def set_limit(self, limit: int | None) -> None:
+        self.limit = limit
+        self._dispatch()
+
+    @property
+    def avg_service_sec(self) -> float | None:
+        return self._service_sec
+
+    def _free_pool(self, tier: str, memory_mb: int = 0) -> str | None:
+        if self.limit is not None and sum(self.active.values()) >= self.limit:
+            return None
+        if self.memory_budget and self.memory_committed + memory_mb > self.memory_budget:
+            return None
+        if self.active[tier] < self.slots[tier]:
+            return tier
+        for lender in self.borrow.get(tier, ()):
+            if self.active[lender] < self.slots[lender] and not self._queued_by_tier[lender]:
+                return lender
+        return None
+
+    def _grant(self, tier: str, pool: str, memory_mb: int = 0) -> Ticket:
+        self.active[pool] += 1
+        self.memory_committed += memory_mb
+        self.admitted += 1
+        if pool != tier:
+            self.borrowed += 1
+        return Ticket(self, tier, pool, memory_mb)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.client)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        self._queued_by_tier[waiter.tier] -= 1
+        if not queue:
+            del self._queues[waiter.client]
+
+    def _release(self, pool: str, service_sec: float | None, memory_mb: int = 0) -> None:
+        self.active[pool] -= 1
+        self.memory_committed -= memory_mb
+        if service_sec is not None:
+            if self._service_sec is None:
+                self._service_sec = service_sec
+            else:
+                self._service_sec += self._EWMA_ALPHA * (service_sec - self._service_sec)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # Grant the best waiter that fits a free slot, until none fits
+        while self._queued:
+            starving = self._starving()
+            now = time.monotonic()
+            best = None
+            for client, queue in self._queues.items():
+                for waiter in queue:
+                    if starving is not None and waiter is not starving:
+                        continue
+                    if self._free_pool(waiter.tier, waiter.memory_mb) is None:
+                        continue
+                    if best is None or self._before(waiter, best, now):
+                        best = waiter
+            if best is None:
+                return
+            pool = self._free_pool(best.tier, best.memory_mb)
+            self._remove(best)
+            if best.client in self._queues:
+                self._queues.move_to_end(best.client)
+            self._grant(best.tier, pool, best.memory_mb)
+            best.pool = pool
+            best.future.set_result(None)
+
+    def _before(self, waiter: _Waiter, other: _Waiter, now: float) -> bool:
+        # Whether `waiter` goes before `other`, which comes earlier in the
+        # round-robin order. Aging only weighs a shorter declared time against
+        # a longer one; equal declared times keep the round-robin order.
+        if waiter.expected_sec == other.expected_sec:
+            return False
+        return self._priority(waiter, now) < self._priority(other, now)
+
+    def _priority(self, waiter: _Waiter, now: float) -> float:
+        # Lower goes first
+        return waiter.expected_sec - self._AGING_RATE * int(now - waiter.queued_at)
+
+    def _starving(self) -> _Waiter | None:
+        # The oldest waiter, once it has been held back by memory for too long
+        if not self.memory_budget:
+            return None
+        oldest = min(
+            (queue[0] for queue in self._queues.values()),
+            key=lambda w: w.queued_at,
+            default=None,
+        )
+        if oldest is None or time.monotonic() - oldest.queued_at < self._BACKFILL_SEC:
+            return None
+        if self.memory_committed + oldest.memory_mb <= self.memory_budget:
+            return None
+        return oldest
+
+    def retry_after(self, tier: str = DEFAULT_POOL) -> int:
+        # Expected time until a newly queued request would be served
+        if self._service_sec is None:
+            return 1
+        slots = self.slots[tier] + sum(self.slots[p] for p in self.borrow.get(tier, ()))
+        if self.limit is not None:
+            slots = min(slots, self.limit)
+        wait = self._service_sec * (self._queued_by_tier[tier] + 1) / max(slots, 1)
+        return max(1, math.ceil(wait))
+
+    def stats(self) -> dict:
+        return {
+            "slots": sum(self.slots.values()),
+            "limit": self.limit if self.limit is not None else sum(self.slots.values()),
+            "active": sum(self.active.values()),
+            "queued": self._queued,
+            "queue_size": self.max_queue,
+            "admitted": self.admitted,
+            "borrowed": self.borrowed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "memory_budget_mb": self.memory_budget,
+            "memory_committed_mb": self.memory_committed,
+            "avg_service_sec": (
+                round(self._service_sec, 3) if self._service_sec is not None else None
+            ),
+            "tiers": {
+                pool: {
+                    "slots": self.slots[pool],
+                    "active": self.active[pool],
+                    "queued": self._queued_by_tier[pool],
+                }
+                for pool in self.slots
+            },
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import re
+import time
+from collections.abc import Awaitable, Callable
+
+from app.executor import ExecutionResult
+from app.parser import has_banner
+
+logger = logging.getLogger("calculator")
+
+# nsjail's own error and fatal log lines, e.g. "[E][2024-01-01T00:00:00+0000] ..."
+_RE_NSJAIL_ERROR = re.compile(r"^\[[EF]\]", re.MULTILINE)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def startup_failed(result: ExecutionResult) -> bool:
+    # Magma never got going: nsjail could not build the jail, or the process
+    # ended without a banner for a reason other than one of its limits
+    if _RE_NSJAIL_ERROR.search(result.stderr):
+        return True
+    if has_banner(result.stdout):
+        return False
+    timed_out = result.exit_code == -1 and result.stderr == "Killed"
+    oom_killed = result.usage is not None and result.usage.oom_killed
+    return not (timed_out or oom_killed or result.truncated)
+
+
+class CircuitBreaker:
+    # Opens after `threshold` executions in a row fail to start Magma, so that
+    # requests fail fast instead of each spawning a jail that cannot work.
+    # While open, a probe execution runs every `probe_interval` seconds and the
+    # first one that starts Magma closes the breaker again.
+
+    def __init__(
+        self,
+        threshold: int,
+        probe_interval: int,
+        probe: Callable[[], Awaitable[ExecutionResult]],
+    ):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trips = 0
+        self.probes = 0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self) -> None:
+        if self.is_open:
+            raise CircuitOpenError(
+                "Magma is currently unavailable, try again later", self.probe_interval
+            )
+
+    def record(self, result: ExecutionResult) -> None:
+        if startup_failed(result):
+            self.record_failure()
+        else:
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        if self.threshold <= 0:
+            return
+        self.failures += 1
+        if self.failures >= self.threshold and not self.is_open:
+            logger.error(
+                "Magma failed to start %d times in a row, rejecting executions", self.failures
+            )
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            self._task = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            self.probes += 1
+            try:
+                result = await self.probe()
+            except OSError as e:
+                logger.warning("Magma probe failed: %s", e)
+                continue
+            if not startup_failed(result):
+                break
+        logger.info(
+            "Magma is available again after %.0f seconds", time.monotonic() - self.opened_at
+        )
+        self.opened_at = None
+        self.failures = 0
+        self._task = None
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "open": self.is_open,
+            "open_sec": (
+                round(time.monotonic() - self.opened_at) if self.opened_at is not None else None
+            ),
+            "failures": self.failures,
+            "threshold": self.threshold,
+            "trips": self.trips,
+            "probes": self.probes,
+        }
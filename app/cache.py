@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger("calculator")
+
+# Code calling these, or using the random{...} / random(...) constructors,
+# may print different results for different seeds
+_RE_SEED_DEPENDENT = re.compile(r"\b(Random\w*|random|SetSeed|GetSeed)\b")
+
+
+def is_cacheable(code: str, seed: int | None) -> bool:
+    return seed is not None or not _RE_SEED_DEPENDENT.search(code)
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, ttl: int, directory: str = ""):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._dir = Path(directory) if directory else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.skipped = 0
+
+        # key -> (stored_at, serialized response), least recently used first
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._bytes = 0
+
+        # Magma version seen in the most recent execution; part of every key
+        # so that upgrading Magma invalidates old results.
+        self.version: str | None = None
+
+        if self._dir is not None:
+            try:
+                self._dir.mkdir(parents=True, exist_ok=True)
+                version_file = self._dir / "version"
+                if version_file.exists():
+                    self.version = version_file.read_text().strip() or None
+            except OSError:
+                logger.warning("Cannot use result cache directory: %s", self._dir)
+                self._dir = None
+
+    def _key(self, code: str, seed: int | None, limits: tuple) -> str:
+        material = json.dumps([self.version, seed, list(limits), code])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, code: str, seed: int | None, limits: tuple) -> dict | None:
+        if not is_cacheable(code, seed):
+            self.skipped += 1
+            return None
+
+        key = self._key(code, seed, limits)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(entry[1])
+
+        if entry is not None:
+            self._remove(key)
+
+        entry = self._read_disk(key, now)
+        if entry is not None:
+            self._insert(key, *entry)
+            self.disk_hits += 1
+            return json.loads(entry[1])
+
+        self.misses += 1
+        return None
+
+    def put(self, code: str, seed: int | None, limits: tuple, response: dict) -> None:
+        if not response["success"] or not is_cacheable(code, seed):
+            return
+
+        version = response["magma"]["version"]
+        if version != self.version:
+            self.version = version
+            self._write_file("version", version or "")
+
+        key = self._key(code, seed, limits)
+        data = json.dumps(response)
+        now = time.time()
+        if len(data) > self.max_bytes:
+            return
+        self._insert(key, now, data)
+        self._write_file(
+            f"{key}.json", json.dumps({"stored_at": now, "response": data})
+        )
+        self.stores += 1
+
+    def _insert(self, key: str, stored_at: float, data: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (stored_at, data)
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, data = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    def _read_disk(self, key: str, now: float) -> tuple[float, str] | None:
+        if self._dir is None:
+            return None
+        path = self._dir / f"{key}.json"
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if now - entry["stored_at"] >= self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+        return entry["stored_at"], entry["response"]
+
+    def _write_file(self, name: str, text: str) -> None:
+        if self._dir is None:
+            return
+        try:
+            (self._dir / name).write_text(text)
+        except OSError:
+            logger.warning("Cannot write to result cache directory: %s", self._dir)
+
+    def prune(self) -> None:
+        cutoff = time.time() - self.ttl
+        for key in [k for k, (ts, _) in self._entries.items() if ts < cutoff]:
+            self._remove(key)
+        if self._dir is None:
+            return
+        for path in self._dir.glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "skipped": self.skipped,
+        }
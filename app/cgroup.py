@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger("calculator")
+
+
+class JobCgroup:
+    # A cgroup v2 leaf holding one jail (nsjail and everything it starts).
+    # The memory limit is enforced here rather than by nsjail so that CPU time,
+    # peak memory and OOM kills can be read back after the jail has exited.
+
+    def __init__(
+        self,
+        root: str,
+        memory_bytes: int,
+        cpu_weight: int = 100,
+        cpus: "CpuAllocator | None" = None,
+        pin: bool = True,
+    ):
+        self.path = Path(root) / f"job-{uuid.uuid4().hex[:16]}"
+        self.path.mkdir()
+        try:
+            self._write("memory.max", str(memory_bytes))
+            self._write("memory.swap.max", "0")
+            # Kill the whole jail, not just the largest process, on OOM
+            self._write("memory.oom.group", "1")
+        except OSError:
+            self.path.rmdir()
+            raise
+
+        # CPU placement is best effort: without the cpu or cpuset controller
+        # the job still runs, competing for every core
+        if cpu_weight != 100:
+            self._write_optional("cpu.weight", str(cpu_weight))
+        self.cpus = cpus
+        self.cpu: int | None = None
+        self.started = time.monotonic()
+        if pin:
+            self.pin()
+
+    def pin(self) -> None:
+        # Warm-pool jails are pinned when they are handed to an execution, so
+        # idle ones do not count against a CPU
+        if self.cpus is None or self.cpu is not None:
+            return
+        self.cpu = self.cpus.acquire()
+        self.started = time.monotonic()
+        self._write_optional("cpuset.cpus", str(self.cpu))
+
+    @property
+    def procs_file(self) -> str:
+        return str(self.path / "cgroup.procs")
+
+    def _write(self, name: str, value: str) -> None:
+        (self.path / name).write_text(value)
+
+    def _write_optional(self, name: str, value: str) -> None:
+        try:
+            self._write(name, value)
+        except OSError as e:
+            logger.warning("Cannot set %s in cgroup %s: %s", name, self.path, e)
+
+    def _read_keyed(self, name: str) -> dict[str, int]:
+        values = {}
+        try:
+            for line in (self.path / name).read_text().splitlines():
+                key, _, value = line.partition(" ")
+                values[key] = int(value)
+        except (OSError, ValueError):
+            pass
+        return values
+
+    def cpu_sec(self) -> float | None:
+        usage = self._read_keyed("cpu.stat").get("usage_usec")
+        return usage / 1e6 if usage is not None else None
+
+    def memory_bytes(self) -> int | None:
+        try:
+            return int((self.path / "memory.current").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def peak_memory_bytes(self) -> int | None:
+        # memory.peak needs Linux 5.19+
+        try:
+            return int((self.path / "memory.peak").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def oom_killed(self) -> bool:
+        return self._read_keyed("memory.events").get("oom_kill", 0) > 0
+
+    def kill(self) -> None:
+        # cgroup.kill needs Linux 5.14+
+        try:
+            self._write("cgroup.kill", "1")
+        except OSError:
+            pass
+
+    async def remove(self) -> None:
+        # The cgroup can only be removed once the kernel has finished tearing
+        # down every process in it.
+        if self.cpu is not None:
+            self.cpus.release(self.cpu, self.cpu_sec() or 0.0, time.monotonic() - self.started)
+            self.cpu = None
+        for _ in range(20):
+            try:
+                self.path.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                await asyncio.sleep(0.05)
+        logger.warning("Cannot remove cgroup %s", self.path)
+
+
+class CpuAllocator:
+    # Pins each job cgroup to the CPU with the fewest jobs on it, so that with
+    # no more slots than CPUs every execution has a core to itself. Keeps the
+    # CPU time each core delivered to jobs for per-slot utilization.
+
+    def __init__(self, cpus: list[int]):
+        self.cpus = cpus
+        self.active = dict.fromkeys(cpus, 0)
+        self.jobs = dict.fromkeys(cpus, 0)
+        self.cpu_sec = dict.fromkeys(cpus, 0.0)
+        self.busy_sec = dict.fromkeys(cpus, 0.0)
+        self.started = time.monotonic()
+
+    def acquire(self) -> int:
+        cpu = min(self.cpus, key=lambda c: self.active[c])
+        self.active[cpu] += 1
+        self.jobs[cpu] += 1
+        return cpu
+
+    def release(self, cpu: int, cpu_sec: float, wall_sec: float) -> None:
+        self.active[cpu] -= 1
+        self.cpu_sec[cpu] += cpu_sec
+        self.busy_sec[cpu] += wall_sec
+
+    def stats(self) -> list[dict]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return [
+            {
+                "cpu": cpu,
+                "active": self.active[cpu],
+                "jobs": self.jobs[cpu],
+                "cpu_sec": round(self.cpu_sec[cpu], 3),
+                # Share of the core's time spent running jobs since startup
+                "utilization": round(min(self.cpu_sec[cpu] / elapsed, 1.0), 3),
+                # CPU time per second of wall time while jobs were pinned to it
+                "efficiency": (
+                    round(self.cpu_sec[cpu] / self.busy_sec[cpu], 3)
+                    if self.busy_sec[cpu] else None
+                ),
+            }
+            for cpu in self.cpus
+        ]
+
+
+def parse_cpus(spec: str) -> list[int]:
+    # cpuset list format, e.g. "0-3,6"
+    cpus = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    if not cpus:
+        raise ValueError(f"Invalid CPU list: {spec!r}")
+    return cpus
+
+
+def enable_controllers(root: str, cpuset: bool = False) -> None:
+    controllers = ["+cpu +memory"] + (["+cpuset"] if cpuset else [])
+    for controller in controllers:
+        try:
+            (Path(root) / "cgroup.subtree_control").write_text(controller)
+        except OSError as e:
+            logger.warning("Cannot enable cgroup controllers %s in %s: %s", controller, root, e)
@@ -1,6 +1,26 @@
+from dataclasses import dataclass
+
 from pydantic_settings import BaseSettings
 
 
+@dataclass(frozen=True)
+class Limits:
+    timeout: int
+    cpu_timeout: int
+    memory_mb: int
+    # cgroup cpu.weight (1-10000); only applied with CGROUP_ROOT
+    cpu_weight: int = 100
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    limits: Limits
+    slots: int
+    # Tiers whose idle slots this tier may use
+    borrow: tuple[str, ...] = ()
+
+
 class Settings(BaseSettings):
     # Magma execution
     magma_timeout: int = 120
@@ -13,6 +33,90 @@ class Settings(BaseSettings):
     max_concurrent: int = 4
     port: int = 8080
 
+    # Named execution tiers, e.g.
+    # "short:timeout=30,slots=3,borrow=long;long:timeout=600,memory=2000,slots=1"
+    # Empty means a single "default" tier built from the settings above.
+    execution_tiers: str = ""
+
+    # POST /batch
+    batch_max_items: int = 100
+    batch_item_timeout: int = 10
+
+    # POST /map: inputs per chunk, and the time after which unfinished
+    # chunks are abandoned (seconds)
+    map_max_inputs: int = 1000
+    map_chunk_size: int = 10
+    map_timeout: int = 300
+
+    # Persistent sessions (0 disables); each open session holds a slot
+    session_max: int = 0
+    session_idle_timeout: int = 600
+    session_max_age: int = 3600
+    session_cpu_timeout: int = 600
+    session_memory_ceiling_mb: int = 2000
+
+    # Adaptive concurrency: the total slot count moves between
+    # adaptive_min_concurrent and the configured slots based on host load
+    adaptive_concurrency: bool = False
+    adaptive_min_concurrent: int = 1
+    adaptive_interval: int = 5
+    # PSI "some avg10" thresholds (percent)
+    adaptive_cpu_pressure: int = 40
+    adaptive_memory_pressure: int = 10
+    adaptive_memory_reserve_mb: int = 1024
+
+    # Admission queue for requests waiting on a slot
+    queue_size: int = 16
+    queue_per_client: int = 2
+    queue_max_wait: int = 30
+    # Memory all running executions may commit together (MB, 0 disables)
+    memory_budget_mb: int = 0
+
+    # Warm pool of pre-started jails (0 disables)
+    warm_pool_size: int = 0
+    warm_pool_max_age: int = 300
+
+    # Result cache for repeated submissions (0 disables)
+    result_cache_mb: int = 0
+    result_cache_ttl: int = 3600
+    result_cache_dir: str = ""
+
+    # Run-time prediction from earlier runs of similar code
+    runtime_history_file: str = "/data/runtimes.json"
+    runtime_history_size: int = 10000
+    # Tier for requests that name none and are predicted to run for at least
+    # long_tier_after_sec (empty disables routing)
+    long_tier: str = ""
+    long_tier_after_sec: int = 30
+
+    # Warm-up at startup and every warmup_interval seconds (0: startup only):
+    # preload warmup_paths into the page cache and run a probe execution.
+    # /health reports not ready until the first warm-up has finished.
+    warmup: bool = False
+    warmup_paths: str = "/opt/magma"
+    warmup_max_mb: int = 4096
+    warmup_interval: int = 900
+
+    # Circuit breaker: after this many executions in a row fail to start Magma,
+    # reject executions and probe every breaker_probe_interval seconds (0 disables)
+    breaker_threshold: int = 5
+    breaker_probe_interval: int = 30
+
+    # Delegated cgroup v2 directory for per-execution accounting (empty disables)
+    cgroup_root: str = ""
+    # CPUs execution slots are pinned to, e.g. "2-7" (empty disables pinning)
+    cgroup_cpus: str = ""
+    # cpu.weight of executions in the default tier
+    cgroup_cpu_weight: int = 100
+
+    # Worker nodes executions are dispatched to, comma-separated:
+    # "local", "http://host:port" or "unix:/path/to/socket" (empty runs locally)
+    workers: str = ""
+    worker_token: str = ""
+    worker_health_interval: int = 10
+    # Unix socket a worker node (app.worker) listens on instead of PORT
+    worker_socket: str = ""
+
     # Rate limiting
     rate_limit_per_minute: int = 30
     rate_limit_per_hour: int = 200
@@ -23,6 +127,12 @@ class Settings(BaseSettings):
     # Usage logging
     usage_log_file: str = "/data/usage.jsonl"
 
+    # Asynchronous jobs
+    jobs_db_file: str = "/data/jobs.sqlite3"
+    job_ttl: int = 86400
+    job_workers: int = 2
+    job_max_wait: int = 60
+
     # Optional Turnstile
     turnstile_enabled: bool = False
     turnstile_secret_key: str = ""
@@ -38,3 +148,55 @@ class Settings(BaseSettings):
     @property
     def magma_output_bytes(self) -> int:
         return self.magma_output_kb * 1024
+
+    @property
+    def warmup_paths_list(self) -> list[str]:
+        return [p.strip() for p in self.warmup_paths.split(",") if p.strip()]
+
+    @property
+    def workers_list(self) -> list[str]:
+        return [w.strip() for w in self.workers.split(",") if w.strip()]
+
+    @property
+    def default_limits(self) -> Limits:
+        return Limits(
+            timeout=self.magma_timeout,
+            cpu_timeout=self.magma_cpu_timeout,
+            memory_mb=self.magma_memory_mb,
+            cpu_weight=self.cgroup_cpu_weight,
+        )
+
+    @property
+    def tiers(self) -> dict[str, Tier]:
+        # The first tier is used when a request does not name one
+        if not self.execution_tiers.strip():
+            return {"default": Tier("default", self.default_limits, self.max_concurrent)}
+
+        tiers = {}
+        for spec in self.execution_tiers.split(";"):
+            name, _, options = spec.strip().partition(":")
+            values = {}
+            for option in filter(None, options.split(",")):
+                key, _, value = option.partition("=")
+                values[key.strip()] = value.strip()
+            unknown = set(values) - {
+                "timeout", "cpu_timeout", "memory", "cpu_weight", "slots", "borrow"
+            }
+            if not name or unknown:
+                raise ValueError(f"Invalid execution tier: {spec!r}")
+            timeout = int(values.get("timeout", self.magma_timeout))
+            tiers[name] = Tier(
+                name=name,
+                limits=Limits(
+                    timeout=timeout,
+                    cpu_timeout=int(values.get("cpu_timeout", timeout)),
+                    memory_mb=int(values.get("memory", self.magma_memory_mb)),
+                    cpu_weight=int(values.get("cpu_weight", self.cgroup_cpu_weight)),
+                ),
+                slots=int(values.get("slots", 1)),
+                borrow=tuple(filter(None, values.get("borrow", "").split("|"))),
+            )
+        for tier in tiers.values():
+            if set(tier.borrow) - set(tiers):
+                raise ValueError(f"Tier {tier.name!r} borrows from an unknown tier")
+        return tiers
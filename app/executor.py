@@ -1,7 +1,27 @@
 import asyncio
-from dataclasses import dataclass
+import math
+import time
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING
 
-from app.config import Settings
+from app.cgroup import CpuAllocator, JobCgroup, parse_cpus
+from app.config import Limits, Settings
+from app.launcher import JailProcess, launch
+from app.parser import split_batch_output
+
+if TYPE_CHECKING:
+    from app.pool import WarmPool
+
+
+@dataclass
+class ResourceUsage:
+    wall_sec: float
+    # Only known when the jail ran in its own cgroup
+    cpu_sec: float | None = None
+    peak_memory_bytes: int | None = None
+    oom_killed: bool = False
 
 
 @dataclass
@@ -9,43 +29,198 @@ class ExecutionResult:
     stdout: str
     stderr: str
     exit_code: int
+    truncated: bool = False
+    usage: ResourceUsage | None = None
+
+
+@dataclass
+class BatchResult:
+    # Shorter than the batch when its time ran out before the last items
+    items: list[ExecutionResult]
+    # One per Magma process used; more than one when an item had to be killed
+    runs: list[ExecutionResult]
+
+
+READ_CHUNK = 4096
+STDERR_LIMIT = 16 * 1024
+# Room for the banner, the "quit." echo and the footer on top of the body
+_OUTPUT_SLACK = 4096
 
 
-def wrap_magma_code(code: str, timeout: int) -> str:
-    alarm_timeout = timeout - 1
+def wrap_magma_code(code: str, timeout: int, seed: int | None = None) -> str:
+    # Alarm(0) would cancel the alarm instead of firing at once
+    alarm_timeout = max(timeout - 1, 1)
+    set_seed = f"SetSeed({seed});\n" if seed is not None else ""
     return (
         f"Alarm({alarm_timeout});\n"
         f"SetIgnorePrompt(true);\n"
+        f"{set_seed}"
         f"{code}\n"
         f";\n"
         f"quit;\n"
     )
 
 
-async def execute_magma(code: str, settings: Settings) -> ExecutionResult:
-    wrapped = wrap_magma_code(code, settings.magma_timeout)
+def wrap_batch_code(
+    codes: list[str],
+    marker: str,
+    item_timeout: int,
+    seed: int | None = None,
+    preamble: str = "",
+) -> str:
+    # Each item is preceded by a marker line so the output can be split, and
+    # gets a fresh Alarm and seed so it behaves as if it ran on its own.
+    # Items share the Magma session, so names defined by one stay visible.
+    # The preamble runs first, under its own Alarm; its output is discarded.
+    set_seed = f"SetSeed({seed});\n" if seed is not None else ""
+    parts = ["SetIgnorePrompt(true);\n"]
+    if preamble:
+        parts.append(f"Alarm({item_timeout});\n{set_seed}{preamble}\n;\n")
+    for i, code in enumerate(codes):
+        parts.append(
+            f'print "{marker} {i}";\n'
+            f"Alarm({item_timeout});\n"
+            f"{set_seed}"
+            f"{code}\n"
+            f";\n"
+        )
+    parts.append(f'print "{marker} end";\nquit;\n')
+    return "".join(parts)
+
 
+def build_nsjail_command(
+    settings: Settings, idle_timeout: int = 0, limits: Limits | None = None
+) -> list[str]:
+    # idle_timeout extends the jail's wall-clock limit for processes that are
+    # started ahead of time and wait for their code (see app.pool).
+    limits = limits or settings.default_limits
     cmd = [
         "nsjail",
         "--config", "/app/nsjail.cfg",
-        "--time_limit", str(settings.magma_timeout + 1),
-        "--cgroup_mem_max", str(settings.magma_memory_mb * 1024 * 1024),
-        "--rlimit_cpu", str(settings.magma_cpu_timeout),
+        "--time_limit", str(limits.timeout + idle_timeout + 1),
+    ]
+    # With cgroup accounting the memory limit is set on the job cgroup instead
+    if not settings.cgroup_root:
+        cmd += ["--cgroup_mem_max", str(limits.memory_mb * 1024 * 1024)]
+    return cmd + [
+        "--rlimit_cpu", str(limits.cpu_timeout),
         "--", "magma", "-w", "-n",
     ]
 
-    proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
+
+_cpu_allocators: dict[str, CpuAllocator] = {}
+
+
+def cpu_allocator(settings: Settings) -> CpuAllocator | None:
+    # One allocator per CPU list, shared by every execution path
+    if not settings.cgroup_root or not settings.cgroup_cpus:
+        return None
+    if settings.cgroup_cpus not in _cpu_allocators:
+        _cpu_allocators[settings.cgroup_cpus] = CpuAllocator(parse_cpus(settings.cgroup_cpus))
+    return _cpu_allocators[settings.cgroup_cpus]
+
+
+def new_cgroup(settings: Settings, limits: Limits, pin: bool = True) -> JobCgroup | None:
+    if not settings.cgroup_root:
+        return None
+    return JobCgroup(
+        settings.cgroup_root,
+        limits.memory_mb * 1024 * 1024,
+        cpu_weight=limits.cpu_weight,
+        cpus=cpu_allocator(settings),
+        pin=pin,
     )
 
+
+async def spawn_process(cmd: list[str], cgroup: JobCgroup | None = None) -> JailProcess:
+    try:
+        return await launch(cmd, cgroup.procs_file if cgroup is not None else None)
+    except BaseException:
+        if cgroup is not None:
+            await cgroup.remove()
+        raise
+
+
+async def collect_usage(wall_sec: float, cgroup: JobCgroup | None) -> ResourceUsage:
+    usage = ResourceUsage(wall_sec=round(wall_sec, 3))
+    if cgroup is not None:
+        # Stray processes would keep the cgroup busy
+        cgroup.kill()
+        usage.cpu_sec = cgroup.cpu_sec()
+        usage.peak_memory_bytes = cgroup.peak_memory_bytes()
+        usage.oom_killed = cgroup.oom_killed()
+        await cgroup.remove()
+    return usage
+
+
+async def _feed_stdin(proc: JailProcess, data: bytes) -> None:
+    try:
+        proc.stdin.write(data)
+        await proc.stdin.drain()
+        proc.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+async def read_capped(
+    stream: asyncio.StreamReader, limit: int, on_overflow=None, on_chunk=None
+) -> tuple[bytes, bool]:
+    # Keep at most `limit` bytes, but keep draining so the writer never blocks
+    buf = bytearray()
+    overflow = False
+    while chunk := await stream.read(READ_CHUNK):
+        if overflow:
+            continue
+        room = limit - len(buf)
+        buf += chunk[:room]
+        if on_chunk is not None:
+            on_chunk(chunk[:room])
+        if len(chunk) > room:
+            overflow = True
+            if on_overflow is not None:
+                on_overflow()
+    return bytes(buf), overflow
+
+
+async def run_process(
+    proc: JailProcess,
+    wrapped: str,
+    settings: Settings,
+    on_stdout: Callable[[bytes], None] | None = None,
+    limits: Limits | None = None,
+    cgroup: JobCgroup | None = None,
+    max_output_bytes: int | None = None,
+) -> ExecutionResult:
+    limits = limits or settings.default_limits
+    max_output_bytes = max_output_bytes or settings.magma_output_bytes
+    started = time.monotonic()
+
+    def stop():
+        # Output budget exhausted: free the slot instead of waiting for the timeout
+        if proc.returncode is None:
+            proc.kill()
+
+    async def communicate():
+        _, stdout, stderr = await asyncio.gather(
+            _feed_stdin(proc, wrapped.encode("utf-8")),
+            read_capped(
+                proc.stdout, max_output_bytes + _OUTPUT_SLACK, stop, on_stdout
+            ),
+            read_capped(proc.stderr, STDERR_LIMIT),
+        )
+        await proc.wait()
+        return stdout, stderr
+
     try:
-        stdout_bytes, stderr_bytes = await asyncio.wait_for(
-            proc.communicate(input=wrapped.encode("utf-8")),
-            timeout=settings.magma_timeout + 2,
+        (stdout_bytes, truncated), (stderr_bytes, _) = await asyncio.wait_for(
+            communicate(),
+            timeout=limits.timeout + 2,
         )
+    except asyncio.CancelledError:
+        # Nobody wants the result any more: free the jail right away
+        proc.kill()
+        await collect_usage(time.monotonic() - started, cgroup)
+        raise
     except asyncio.TimeoutError:
         proc.kill()
         await proc.wait()
@@ -53,10 +228,110 @@ async def execute_magma(code: str, settings: Settings) -> ExecutionResult:
             stdout="",
             stderr="Killed",
             exit_code=-1,
+            usage=await collect_usage(time.monotonic() - started, cgroup),
         )
 
     return ExecutionResult(
         stdout=stdout_bytes.decode("utf-8", errors="replace"),
         stderr=stderr_bytes.decode("utf-8", errors="replace"),
         exit_code=proc.returncode or 0,
+        truncated=truncated,
+        usage=await collect_usage(time.monotonic() - started, cgroup),
+    )
+
+
+def _fits_pool(limits: Limits, pool_limits: Limits | None) -> bool:
+    # Requests that only ask for a shorter timeout can use a pre-started jail
+    if pool_limits is None or limits.timeout > pool_limits.timeout:
+        return False
+    return limits == replace(
+        pool_limits, timeout=limits.timeout, cpu_timeout=limits.cpu_timeout
     )
+
+
+async def execute_magma(
+    code: str,
+    settings: Settings,
+    pool: "WarmPool | None" = None,
+    on_stdout: Callable[[bytes], None] | None = None,
+    seed: int | None = None,
+    limits: Limits | None = None,
+) -> ExecutionResult:
+    limits = limits or settings.default_limits
+    wrapped = wrap_magma_code(code, limits.timeout, seed)
+
+    # Pre-started jails were created with the pool's limits. A shorter
+    # timeout is still enforced by Alarm() and run_process.
+    jail = pool.take() if pool is not None and _fits_pool(limits, pool.limits) else None
+    if jail is not None:
+        proc, cgroup = jail
+        if cgroup is not None:
+            cgroup.pin()
+    else:
+        cgroup = new_cgroup(settings, limits)
+        proc = await spawn_process(build_nsjail_command(settings, limits=limits), cgroup)
+
+    return await run_process(proc, wrapped, settings, on_stdout, limits, cgroup)
+
+
+async def execute_batch(
+    codes: list[str],
+    settings: Settings,
+    item_timeout: int,
+    limits: Limits | None = None,
+    seed: int | None = None,
+    cmd: list[str] | None = None,
+    preamble: str = "",
+) -> BatchResult:
+    # Runs all items in one Magma process. When an item is killed (Alarm,
+    # memory limit, runaway output) the remaining items continue in a new one,
+    # which runs the preamble again. All runs together stay within the
+    # tier's time limits; items left when those run out are not run.
+    limits = limits or settings.default_limits
+    items: list[ExecutionResult] = []
+    runs: list[ExecutionResult] = []
+    deadline = time.monotonic() + limits.timeout
+    while len(items) < len(codes):
+        # The first run always goes ahead, with the whole time limit
+        remaining = math.ceil(deadline - time.monotonic())
+        if runs and remaining < 1:
+            break
+        pending = codes[len(items):]
+        marker = uuid.uuid4().hex
+        # Slack for Magma's startup on top of the items' own Alarms
+        run_timeout = min(item_timeout * (len(pending) + bool(preamble)) + 2, remaining)
+        run_limits = replace(
+            limits, timeout=run_timeout, cpu_timeout=min(run_timeout, limits.cpu_timeout)
+        )
+        cgroup = new_cgroup(settings, run_limits)
+        proc = await spawn_process(
+            cmd or build_nsjail_command(settings, limits=run_limits), cgroup
+        )
+        run = await run_process(
+            proc,
+            wrap_batch_code(pending, marker, item_timeout, seed, preamble),
+            settings,
+            limits=run_limits,
+            cgroup=cgroup,
+            max_output_bytes=settings.magma_output_bytes * len(pending),
+        )
+        runs.append(run)
+
+        outputs, finished = split_batch_output(run.stdout, marker)
+        if finished and len(outputs) == len(pending):
+            items += [ExecutionResult(output, "", 0) for output in outputs]
+            break
+        # The last item that started is the one Magma stopped in; with no
+        # markers at all, blame the first one so every run makes progress.
+        outputs = outputs or [""]
+        items += [ExecutionResult(output, "", 0) for output in outputs[:-1]]
+        items.append(
+            ExecutionResult(
+                outputs[-1],
+                run.stderr,
+                run.exit_code or -1,
+                truncated=run.truncated,
+                usage=run.usage,
+            )
+        )
+    return BatchResult(items, runs)
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+logger = logging.getLogger("calculator")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    client_ip TEXT NOT NULL,
+    code TEXT NOT NULL,
+    seed INTEGER,
+    tier TEXT NOT NULL DEFAULT 'default',
+    memory_mb INTEGER,
+    time_limit INTEGER,
+    profile INTEGER NOT NULL DEFAULT 0,
+    segments INTEGER NOT NULL DEFAULT 0,
+    queued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT
+)
+"""
+
+
+# Columns added after the first release, in order; databases created before
+# them get them on open
+_ADDED_COLUMNS = [
+    ("tier", "TEXT NOT NULL DEFAULT 'default'"),
+    ("memory_mb", "INTEGER"),
+    ("time_limit", "INTEGER"),
+    ("profile", "INTEGER NOT NULL DEFAULT 0"),
+    ("segments", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+class JobStore:
+    def __init__(self, path: str, ttl: int):
+        self.ttl = ttl
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(_SCHEMA)
+        except (OSError, sqlite3.Error):
+            logger.warning("Cannot open job store %s, jobs will not survive a restart", path)
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+            self._db.execute(_SCHEMA)
+        self._db.row_factory = sqlite3.Row
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        with self._db:
+            for name, definition in _ADDED_COLUMNS:
+                if name not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+        # Jobs interrupted by a restart are run again
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            )
+
+    def create(
+        self,
+        code: str,
+        seed: int | None,
+        client_ip: str,
+        tier: str = "default",
+        memory_mb: int | None = None,
+        time_limit: int | None = None,
+        profile: bool = False,
+        segments: bool = False,
+    ) -> dict:
+        job_id = uuid.uuid4().hex
+        with self._db:
+            self._db.execute(
+                "INSERT INTO jobs "
+                "(id, status, client_ip, code, seed, tier, memory_mb, time_limit, profile, "
+                "segments, queued_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, client_ip, code, seed, tier, memory_mb, time_limit, profile,
+                    segments, time.time(),
+                ),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def queued(self) -> list[str]:
+        rows = self._db.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY queued_at"
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    def mark_running(self, job_id: str) -> None:
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                (time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, result: dict) -> None:
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = 'finished', finished_at = ?, result = ? WHERE id = ?",
+                (time.time(), json.dumps(result), job_id),
+            )
+
+    def cleanup(self) -> int:
+        cutoff = time.time() - self.ttl
+        with self._db:
+            cur = self._db.execute(
+                "DELETE FROM jobs WHERE status = 'finished' AND finished_at < ?", (cutoff,)
+            )
+        return cur.rowcount
+
+    def counts(self) -> dict:
+        rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {"queued": 0, "running": 0, "finished": 0}
+        counts.update({status: n for status, n in rows})
+        return counts
+
+
+class JobRunner:
+    def __init__(
+        self,
+        store: JobStore,
+        run: Callable[[dict, Callable[[], None]], Awaitable[dict]],
+        workers: int,
+        error_result: Callable[[str, int | None], dict] | None = None,
+    ):
+        self.store = store
+        self._run = run
+        # Builds the result of a job whose run failed, shaped like a run's
+        self._error_result = error_result or (lambda error, seed: {
+            "success": False, "error": error,
+        })
+        self._workers = workers
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._done: dict[str, asyncio.Event] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        for job_id in self.store.queued():
+            self._enqueue(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def submit(
+        self,
+        code: str,
+        seed: int | None,
+        client_ip: str,
+        tier: str = "default",
+        memory_mb: int | None = None,
+        time_limit: int | None = None,
+        profile: bool = False,
+        segments: bool = False,
+    ) -> dict:
+        job = self.store.create(
+            code, seed, client_ip, tier, memory_mb, time_limit, profile, segments
+        )
+        self._enqueue(job["id"])
+        return job
+
+    def _enqueue(self, job_id: str) -> None:
+        self._done[job_id] = asyncio.Event()
+        self._queue.put_nowait(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> dict | None:
+        event = self._done.get(job_id)
+        if event is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.store.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.store.get(job_id)
+            if job is None:
+                continue
+            try:
+                # The run callback marks the job running once it has a slot
+                result = await self._run(job, lambda: self.store.mark_running(job_id))
+            except Exception:
+                logger.exception("Job %s failed", job_id)
+                result = self._error_result("Internal error", job["seed"])
+            self.store.finish(job_id, result)
+            event = self._done.pop(job_id, None)
+            if event is not None:
+                event.set()
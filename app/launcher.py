@@ -0,0 +1,155 @@
+import asyncio
+import os
+import signal
+import time
+
+from app.metrics import Histogram
+
+# Time to start a jail, and from asking for its exit (kill or wait) until the
+# exit status is collected
+spawn_ms = Histogram()
+reap_ms = Histogram()
+
+# Joins the cgroup named by $0, then becomes the jail: the jail is accounted
+# from its first instruction without a preexec_fn, which would force a fork
+_JOIN_CGROUP = 'printf 0 > "$0" && exec "$@"'
+
+
+class JailProcess:
+    # A child started with posix_spawn in its own process group, with the
+    # same stdin/stdout/stderr streams as asyncio.subprocess.Process. Its exit
+    # is noticed through a pidfd registered with the event loop, so no thread
+    # or SIGCHLD handler is involved in reaping it.
+
+    def __init__(
+        self,
+        pid: int,
+        stdin: asyncio.StreamWriter,
+        stdout: asyncio.StreamReader,
+        stderr: asyncio.StreamReader,
+    ):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode: int | None = None
+        self._loop = asyncio.get_running_loop()
+        self._exited = asyncio.Event()
+        self._exit_requested: float | None = None
+        self._pidfd: int | None = None
+        try:
+            self._pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            # No pidfd (Linux < 5.3): block a thread in waitpid instead
+            waiter = self._loop.run_in_executor(None, self._waitpid, 0)
+            waiter.add_done_callback(lambda f: self._reaped(f.result()))
+        else:
+            self._loop.add_reader(self._pidfd, self._on_pidfd)
+
+    def _on_pidfd(self) -> None:
+        self._loop.remove_reader(self._pidfd)
+        os.close(self._pidfd)
+        self._pidfd = None
+        self._reaped(self._waitpid(os.WNOHANG))
+
+    def _waitpid(self, flags: int) -> int:
+        try:
+            return os.waitpid(self.pid, flags)[1]
+        except ChildProcessError:
+            # Already reaped elsewhere; the status is lost
+            return 255 << 8
+
+    def _reaped(self, status: int) -> None:
+        self.returncode = os.waitstatus_to_exitcode(status)
+        if self._exit_requested is not None:
+            reap_ms.observe((time.monotonic() - self._exit_requested) * 1000)
+        self.stdin.close()
+        self._exited.set()
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is not None:
+            return
+        if self._exit_requested is None:
+            self._exit_requested = time.monotonic()
+        # The whole group, so helpers the jail started do not outlive it
+        try:
+            os.killpg(self.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    async def wait(self) -> int:
+        if self._exit_requested is None and self.returncode is None:
+            self._exit_requested = time.monotonic()
+        await self._exited.wait()
+        return self.returncode
+
+    async def communicate(self, data: bytes = b"") -> tuple[bytes, bytes]:
+        if data:
+            self.stdin.write(data)
+            await self.stdin.drain()
+        self.stdin.close()
+        stdout, stderr = await asyncio.gather(self.stdout.read(), self.stderr.read())
+        await self.wait()
+        return stdout, stderr
+
+
+async def launch(cmd: list[str], cgroup_procs: str | None = None) -> JailProcess:
+    # With cgroup_procs the child moves itself into that cgroup before exec
+    if cgroup_procs is not None:
+        cmd = ["/bin/sh", "-c", _JOIN_CGROUP, cgroup_procs, *cmd]
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+
+    stdin_r, stdin_w = os.pipe()
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    try:
+        pid = os.posix_spawnp(
+            cmd[0],
+            cmd,
+            os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, stdin_r, 0),
+                (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+                (os.POSIX_SPAWN_DUP2, stderr_w, 2),
+            ],
+            setpgroup=0,
+            # Python ignores SIGPIPE; the jail should not inherit that
+            setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+        )
+    except BaseException:
+        for fd in (stdin_w, stdout_r, stderr_r):
+            os.close(fd)
+        raise
+    finally:
+        # The child has its own copies
+        for fd in (stdin_r, stdout_w, stderr_w):
+            os.close(fd)
+
+    stdout = asyncio.StreamReader()
+    stderr = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(stdout), os.fdopen(stdout_r, "rb", 0)
+    )
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(stderr), os.fdopen(stderr_r, "rb", 0)
+    )
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+        os.fdopen(stdin_w, "wb", 0),
+    )
+    stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    proc = JailProcess(pid, stdin, stdout, stderr)
+    spawn_ms.observe((time.monotonic() - started) * 1000)
+    return proc
+
+
+def stats() -> dict:
+    return {"spawn": spawn_ms.stats(), "reap": reap_ms.stats()}
@@ -1,28 +1,142 @@
 import asyncio
+import hashlib
 import logging
 import json
 import re
 import time
 
+from collections import deque
+from collections.abc import Awaitable
 from contextlib import asynccontextmanager
+from dataclasses import asdict, replace
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from app.config import Settings
-from app.executor import execute_magma, ExecutionResult
-from app.parser import parse_magma_output, parse_stderr_warnings
+from app import launcher
+from app.adaptive import AdaptiveLimiter
+from app.admission import AdmissionError, AdmissionQueue, MemoryBudgetError, Ticket
+from app.breaker import CircuitBreaker, CircuitOpenError
+from app.cache import ResultCache
+from app.cgroup import enable_controllers
+from app.config import Limits, Settings, Tier
+from app.disconnect import ClientDisconnected, cancel_on_disconnect
+from app.executor import (
+    build_nsjail_command, cpu_allocator, execute_batch, execute_magma, new_cgroup,
+    spawn_process, wrap_magma_code, BatchResult, ExecutionResult,
+)
+from app.jobs import JobRunner, JobStore
+from app.parser import (
+    ParseResult, StreamParser, parse_body, parse_magma_output, parse_stderr_warnings,
+)
+from app.pool import WarmPool
+from app.predictor import RuntimePredictor, fingerprint
+from app.profiler import StatementProfiler
 from app.ratelimit import RateLimiter
+from app.sessions import Session, SessionManager
+from app.singleflight import SingleFlight
 from app.usage_logger import UsageLogger
+from app.warmup import Warmup
+from app.workers import LocalWorker, RemoteWorker, WorkerError, WorkerPool
 
 settings = Settings()
 rate_limiter = RateLimiter(
     per_minute=settings.rate_limit_per_minute,
     per_hour=settings.rate_limit_per_hour,
 )
-semaphore = asyncio.Semaphore(settings.max_concurrent)
+tiers = settings.tiers
+default_tier = next(iter(tiers.values()))
+if settings.long_tier and settings.long_tier not in tiers:
+    raise ValueError(f"LONG_TIER {settings.long_tier!r} is not an execution tier")
+admission = AdmissionQueue(
+    slots={tier.name: tier.slots for tier in tiers.values()},
+    max_queue=settings.queue_size,
+    max_per_client=settings.queue_per_client,
+    max_wait=settings.queue_max_wait,
+    borrow={tier.name: tier.borrow for tier in tiers.values()},
+    memory_budget=settings.memory_budget_mb,
+)
+adaptive_limiter = (
+    AdaptiveLimiter(
+        admission,
+        min_limit=settings.adaptive_min_concurrent,
+        max_limit=sum(tier.slots for tier in tiers.values()),
+        cpu_pressure=settings.adaptive_cpu_pressure,
+        memory_pressure=settings.adaptive_memory_pressure,
+        memory_reserve=settings.adaptive_memory_reserve_mb * 1024 * 1024,
+        interval=settings.adaptive_interval,
+    )
+    if settings.adaptive_concurrency else None
+)
 usage_logger = UsageLogger(settings.usage_log_file)
+predictor = RuntimePredictor(settings.runtime_history_size, settings.runtime_history_file)
+in_flight = SingleFlight()
+warm_pool = (
+    WarmPool(
+        build_nsjail_command(
+            settings, idle_timeout=settings.warm_pool_max_age, limits=default_tier.limits
+        ),
+        size=settings.warm_pool_size,
+        max_age=settings.warm_pool_max_age,
+        limits=default_tier.limits,
+        new_cgroup=lambda: new_cgroup(settings, default_tier.limits, pin=False),
+    )
+    if settings.warm_pool_size > 0 else None
+)
+result_cache = (
+    ResultCache(
+        settings.result_cache_mb * 1024 * 1024,
+        ttl=settings.result_cache_ttl,
+        directory=settings.result_cache_dir,
+    )
+    if settings.result_cache_mb > 0 else None
+)
+worker_pool = (
+    WorkerPool(
+        [
+            LocalWorker(settings, sum(admission.slots.values()), warm_pool)
+            if address == "local"
+            else RemoteWorker(address, settings.worker_token)
+            for address in settings.workers_list
+        ],
+        health_interval=settings.worker_health_interval,
+    )
+    if settings.workers_list else None
+)
+
+
+def _probe() -> Awaitable[ExecutionResult]:
+    # A trivial execution in a fresh jail
+    return execute_magma("print 1;", settings, limits=default_tier.limits)
+
+
+def _warmup_probe() -> Awaitable[ExecutionResult]:
+    # With only remote workers, executions never start a jail on this node
+    if worker_pool is not None and "local" not in settings.workers_list:
+        return worker_pool.execute("print 1;", default_tier.limits)
+    return _probe()
+
+
+breaker = CircuitBreaker(
+    settings.breaker_threshold,
+    settings.breaker_probe_interval,
+    probe=_probe,
+)
+warmup = (
+    Warmup(
+        settings.warmup_paths_list,
+        settings.warmup_max_mb * 1024 * 1024,
+        settings.warmup_interval,
+        probe=_warmup_probe,
+    )
+    if settings.warmup else None
+)
+session_manager = SessionManager(
+    max_sessions=settings.session_max,
+    idle_timeout=settings.session_idle_timeout,
+    memory_ceiling=settings.session_memory_ceiling_mb * 1024 * 1024,
+)
 
 logger = logging.getLogger("calculator")
 logging.basicConfig(level=logging.INFO, format="%(message)s")
@@ -30,9 +144,34 @@ logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if settings.cgroup_root:
+        enable_controllers(settings.cgroup_root, cpuset=bool(settings.cgroup_cpus))
     task = asyncio.create_task(_periodic_cleanup())
+    if warmup is not None:
+        warmup.start()
+    if warm_pool is not None:
+        warm_pool.start()
+    job_runner.start()
+    if settings.session_max > 0:
+        session_manager.start()
+    if worker_pool is not None:
+        worker_pool.start()
+    if adaptive_limiter is not None:
+        adaptive_limiter.start()
     yield
     task.cancel()
+    if warmup is not None:
+        warmup.stop()
+    job_runner.stop()
+    if worker_pool is not None:
+        worker_pool.stop()
+    if adaptive_limiter is not None:
+        adaptive_limiter.stop()
+    breaker.stop()
+    predictor.save()
+    await session_manager.stop()
+    if warm_pool is not None:
+        await warm_pool.stop()
 
 
 async def _periodic_cleanup():
@@ -40,6 +179,10 @@ async def _periodic_cleanup():
         await asyncio.sleep(300)
         rate_limiter.cleanup()
         usage_logger.prune_24h()
+        if result_cache is not None:
+            result_cache.prune()
+        job_runner.store.cleanup()
+        predictor.save()
 
 
 app = FastAPI(docs_url=None, redoc_url=None, lifespan=lifespan)
@@ -95,22 +238,145 @@ async def cors_middleware(request: Request, call_next):
 
 class ExecuteRequest(BaseModel):
     code: str
+    seed: int | None = None
+    tier: str | None = None
+    # Smaller memory limit than the tier's, to be admitted sooner
+    memory_mb: int | None = None
+    # Shorter wall-clock limit than the tier's, to be scheduled sooner
+    time_limit: int | None = None
+    # Time each top-level statement (see app.profiler)
+    profile: bool = False
+    # Split the output into typed segments (see app.parser.Segment)
+    segments: bool = False
+
+    @property
+    def limits(self) -> Limits:
+        return _request_limits(
+            tiers[self.tier or default_tier.name].limits, self.memory_mb, self.time_limit
+        )
+
+
+def _request_limits(limits: Limits, memory_mb: int | None, time_limit: int | None) -> Limits:
+    if memory_mb is not None:
+        limits = replace(limits, memory_mb=memory_mb)
+    if time_limit is not None:
+        limits = replace(
+            limits, timeout=time_limit, cpu_timeout=min(limits.cpu_timeout, time_limit)
+        )
+    return limits
+
+
+class SessionRequest(BaseModel):
+    tier: str | None = None
+
+
+class SessionExecuteRequest(BaseModel):
+    code: str
+
+
+class BatchRequest(BaseModel):
+    items: list[str]
+    seed: int | None = None
+    tier: str | None = None
+
+    @property
+    def code(self) -> str:
+        return "\n".join(self.items)
+
+    @property
+    def limits(self) -> Limits:
+        return tiers[self.tier or default_tier.name].limits
+
+
+class MapRequest(BaseModel):
+    # `function` is the body of a Magma function of `x`, applied to each input
+    preamble: str = ""
+    function: str
+    inputs: list[str]
+    seed: int | None = None
+    tier: str | None = None
+
+    @property
+    def code(self) -> str:
+        return "\n".join([self.preamble, self.function, *self.inputs])
+
+    @property
+    def limits(self) -> Limits:
+        return tiers[self.tier or default_tier.name].limits
 
 
 @app.get("/health")
 async def health():
+    if warmup is not None and not warmup.ready:
+        return JSONResponse(status_code=503, content={"status": "warming up"})
     return {"status": "ok"}
 
 
 @app.get("/stats")
 async def stats():
-    return usage_logger.stats()
+    data = usage_logger.stats()
+    if warm_pool is not None:
+        data["warm_pool"] = warm_pool.stats()
+    if result_cache is not None:
+        data["cache"] = result_cache.stats()
+    data["coalescing"] = in_flight.stats()
+    data["admission"] = admission.stats()
+    data["launcher"] = launcher.stats()
+    data["breaker"] = breaker.stats()
+    data["predictor"] = predictor.stats()
+    if warmup is not None:
+        data["warmup"] = warmup.stats()
+    if adaptive_limiter is not None:
+        data["adaptive"] = adaptive_limiter.stats()
+    if worker_pool is not None:
+        data["workers"] = worker_pool.stats()
+    if (cpus := cpu_allocator(settings)) is not None:
+        data["cpus"] = cpus.stats()
+    data["jobs"] = job_runner.store.counts()
+    if settings.session_max > 0:
+        data["sessions"] = session_manager.stats()
+    return data
 
 
-@app.post("/execute")
-async def execute(req: ExecuteRequest, request: Request):
-    start_time = time.time()
-    client_ip = request.client.host if request.client else "unknown"
+def _check_request(
+    req: ExecuteRequest | BatchRequest | MapRequest | SessionExecuteRequest, client_ip: str
+) -> JSONResponse | None:
+    # Fail fast while Magma cannot start, before taking a slot
+    if worker_pool is None:
+        try:
+            breaker.check()
+        except CircuitOpenError as e:
+            return _busy_response(e)
+
+    # Session calls use the tier the session was opened with
+    tier = getattr(req, "tier", None)
+    if tier is not None and tier not in tiers:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Unknown tier"},
+        )
+
+    memory_mb = getattr(req, "memory_mb", None)
+    max_memory_mb = tiers[tier or default_tier.name].limits.memory_mb
+    if memory_mb is not None and not 0 < memory_mb <= max_memory_mb:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "memory_mb must be between 1 and the tier's memory limit"},
+        )
+
+    if not admission.fits_budget(memory_mb or max_memory_mb):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "The memory limit exceeds the memory budget"},
+        )
+
+    time_limit = getattr(req, "time_limit", None)
+    max_time_limit = tiers[tier or default_tier.name].limits.timeout
+    if time_limit is not None and not 0 < time_limit <= max_time_limit:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "time_limit must be between 1 and the tier's timeout"},
+        )
 
     # Check input size
     if len(req.code.encode("utf-8")) > settings.magma_input_bytes:
@@ -127,21 +393,153 @@ async def execute(req: ExecuteRequest, request: Request):
             headers={"Retry-After": "60"},
         )
 
-    # Try to acquire concurrency slot without blocking
-    acquired = semaphore.locked() is False or semaphore._value > 0
-    if not acquired:
-        return JSONResponse(
-            status_code=503,
-            content={"error": "All execution slots busy"},
+    return None
+
+
+def _busy_response(e: AdmissionError | CircuitOpenError) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _effective_limits(req: ExecuteRequest) -> tuple:
+    limits = req.limits
+    return (limits.timeout, limits.cpu_timeout, limits.memory_mb, settings.magma_output_kb)
+
+
+def _cache_limits(req: ExecuteRequest) -> tuple:
+    # The response also depends on whether segments were asked for
+    return (*_effective_limits(req), req.segments)
+
+
+def _cache_get(req: ExecuteRequest) -> dict | None:
+    # Timings are not worth replaying
+    if result_cache is None or req.profile:
+        return None
+    cached = result_cache.get(req.code, req.seed, _cache_limits(req))
+    if cached is None:
+        return None
+    return {**cached, "cached": True}
+
+
+def _cache_put(req: ExecuteRequest, response_data: dict) -> None:
+    # What one run measured would be replayed as if it were fresh
+    if result_cache is not None and not req.profile:
+        result_cache.put(
+            req.code,
+            req.seed,
+            _cache_limits(req),
+            {**response_data, "resources": None, "runtime": None},
+        )
+
+
+def _flight_key(req: ExecuteRequest) -> str:
+    wrapped = wrap_magma_code(req.code, req.limits.timeout, req.seed)
+    material = json.dumps([_effective_limits(req), req.profile, req.segments, wrapped])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+async def _run_magma(
+    code: str, seed: int | None, limits: Limits, on_stdout=None
+) -> ExecutionResult:
+    if worker_pool is not None:
+        return await worker_pool.execute(code, limits, seed, on_stdout)
+    breaker.check()
+    try:
+        result = await execute_magma(
+            code, settings, pool=warm_pool, on_stdout=on_stdout, seed=seed, limits=limits
         )
+    except OSError:
+        breaker.record_failure()
+        raise
+    breaker.record(result)
+    return result
+
+
+def _predict(req: ExecuteRequest) -> tuple[ExecuteRequest, str, float | None]:
+    key = fingerprint(req.code)
+    predicted = predictor.predict(key)
+    # Likely long runs go to the long tier unless the client chose limits
+    if (
+        settings.long_tier
+        and req.tier is None
+        and req.time_limit is None
+        and predicted is not None
+        and predicted >= settings.long_tier_after_sec
+    ):
+        req = req.model_copy(update={"tier": settings.long_tier})
+    return req, key, predicted
+
+
+def _expected_sec(limits: Limits, predicted: float | None) -> float:
+    # What the scheduler assumes a run will take
+    return limits.timeout if predicted is None else min(predicted, limits.timeout)
+
+
+def _record_runtime(key: str, predicted: float | None, result: ExecutionResult) -> dict:
+    actual = result.usage.wall_sec if result.usage is not None else None
+    if actual is not None:
+        predictor.record(key, actual, predicted)
+        if predicted is not None and adaptive_limiter is not None:
+            adaptive_limiter.observe(actual, predicted)
+    return {"predicted_sec": predicted, "actual_sec": actual}
+
 
-    async with semaphore:
-        result: ExecutionResult = await execute_magma(req.code, settings)
+async def _run_profiled(
+    code: str, seed: int | None, limits: Limits
+) -> tuple[ExecutionResult, dict]:
+    profiler = StatementProfiler(code)
+    result = await _run_magma(profiler.code, seed, limits)
+    stdout, profile = profiler.collect(result.stdout)
+    return replace(result, stdout=stdout), profile
 
-    # Parse output
-    parsed = parse_magma_output(result.stdout, settings.magma_output_bytes)
+
+async def _execute_in_slot(
+    req: ExecuteRequest, client_ip: str, key: str, predicted: float | None
+) -> tuple[ExecutionResult, dict, dict | None]:
+    limits = req.limits
+    expected_sec = _expected_sec(limits, predicted)
+    profile = None
+    async with admission.slot(
+        client_ip, req.tier or default_tier.name, limits.memory_mb, expected_sec
+    ):
+        if req.profile:
+            result, profile = await _run_profiled(req.code, req.seed, limits)
+        else:
+            result = await _run_magma(req.code, req.seed, limits)
+    return result, _record_runtime(key, predicted, result), profile
+
+
+_MEMORY_WARNING = "The computation exceeded the memory limit and so was terminated prematurely."
+_STOPPED_WARNING = "Magma stopped before the code finished."
+_BATCH_NOT_RUN = "The batch reached its time limit before this item ran."
+
+
+def _warnings(parsed: ParseResult, result: ExecutionResult) -> tuple[list[str], str | None]:
+    # All warnings, and the one reported as `error`
     stderr_warnings = parse_stderr_warnings(result.stderr)
-    all_warnings = parsed.warnings + stderr_warnings
+    oom_killed = result.usage is not None and result.usage.oom_killed
+    if oom_killed and _MEMORY_WARNING not in parsed.warnings:
+        # Killed by the kernel before Magma could report it
+        stderr_warnings.insert(0, _MEMORY_WARNING)
+    error = next(iter(stderr_warnings or parsed.warnings), None)
+    return parsed.warnings + stderr_warnings, error
+
+
+def _build_response(
+    result: ExecutionResult,
+    seed: int | None = None,
+    parsed: ParseResult | None = None,
+    segments: bool = False,
+) -> dict:
+    # `parsed` is passed when the output was already parsed as it arrived
+    if parsed is None:
+        parsed = parse_magma_output(
+            result.stdout, settings.magma_output_bytes, truncated=result.truncated
+        )
+    all_warnings, error = _warnings(parsed, result)
 
     success = result.exit_code == 0 and not all_warnings
 
@@ -152,35 +550,684 @@ async def execute(req: ExecuteRequest, request: Request):
         "truncated": parsed.truncated,
         "magma": {
             "version": parsed.version,
-            "seed": parsed.seed,
+            "seed": seed if seed is not None else parsed.seed,
             "time_sec": parsed.time_sec,
             "memory": parsed.memory,
         },
+        "resources": asdict(result.usage) if result.usage is not None else None,
         "warnings": all_warnings,
     }
 
-    if not success:
-        if stderr_warnings:
-            response_data["error"] = stderr_warnings[0]
-        elif parsed.warnings:
-            response_data["error"] = parsed.warnings[0]
+    if segments:
+        response_data["segments"] = [asdict(segment) for segment in parsed.segments]
+
+    if not success and error is not None:
+        response_data["error"] = error
+
+    return response_data
+
+
+def _error_result(error: str, seed: int | None = None) -> dict:
+    # /execute-shaped result for code that never ran
+    return {
+        "success": False,
+        "stdout": "",
+        "exit_code": None,
+        "truncated": False,
+        "magma": {"version": None, "seed": seed, "time_sec": None, "memory": None},
+        "resources": None,
+        "warnings": [error],
+        "error": error,
+    }
+
+
+def _build_item_response(item: ExecutionResult) -> dict:
+    # For output without banner and footer: batch items and session calls
+    parsed = parse_body(item.stdout, settings.magma_output_bytes, truncated=item.truncated)
+    warnings, error = _warnings(parsed, item)
+    if item.exit_code != 0 and not warnings:
+        error = _STOPPED_WARNING
+        warnings = [error]
+    item_data = {
+        "success": not warnings,
+        "stdout": parsed.stdout,
+        "truncated": parsed.truncated,
+        "warnings": warnings,
+    }
+    if error is not None:
+        item_data["error"] = error
+    return item_data
+
+
+def _not_run_response(error: str) -> dict:
+    return {"success": False, "stdout": "", "truncated": False, "warnings": [error], "error": error}
+
 
+def _build_batch_response(
+    batch: BatchResult, seed: int | None = None, size: int | None = None
+) -> dict:
+    # `size` is the number of items sent; those missing from the batch ran
+    # out of time
+    items = [_build_item_response(item) for item in batch.items]
+    items += [_not_run_response(_BATCH_NOT_RUN) for _ in range(len(items), size or 0)]
+    banner = parse_magma_output(
+        batch.runs[0].stdout if batch.runs else "", settings.magma_output_bytes
+    )
+    return {
+        "success": all(item["success"] for item in items),
+        "items": items,
+        "runs": len(batch.runs),
+        "magma": {
+            "version": banner.version,
+            "seed": seed if seed is not None else banner.seed,
+        },
+    }
+
+
+def _log_usage(
+    client_ip: str, code: str, start_time: float, response_data: dict, **extra
+) -> None:
     elapsed = time.time() - start_time
     log_entry = {
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "client_ip": client_ip,
-        "input_size": len(req.code),
+        "input_size": len(code),
         "elapsed_sec": round(elapsed, 3),
-        "memory_used": parsed.memory,
-        "success": success,
-        "warnings": all_warnings,
+        "memory_used": response_data.get("magma", {}).get("memory"),
+        "resources": response_data.get("resources"),
+        "success": response_data["success"],
+        "warnings": response_data["warnings"],
+        **extra,
     }
     logger.info(json.dumps(log_entry))
     usage_logger.log(log_entry)
 
+
+def _cancelled_response(client_ip: str, code: str, start_time: float) -> Response:
+    # The client is gone; the run was killed and only needs recording
+    _log_usage(client_ip, code, start_time, {"success": False, "warnings": []}, cancelled=True)
+    return Response(status_code=499)
+
+
+@app.post("/execute")
+async def execute(req: ExecuteRequest, request: Request):
+    start_time = time.time()
+    client_ip = request.client.host if request.client else "unknown"
+
+    req, key, predicted = _predict(req)
+    rejected = _check_request(req, client_ip)
+    if rejected is not None:
+        return rejected
+
+    cached = _cache_get(req)
+    if cached is not None:
+        _log_usage(client_ip, req.code, start_time, cached, cached=True)
+        return cached
+
+    # Identical submissions already running are joined without taking a slot
+    try:
+        result, runtime, profile = await cancel_on_disconnect(
+            request,
+            in_flight.do(
+                _flight_key(req), lambda: _execute_in_slot(req, client_ip, key, predicted)
+            ),
+        )
+    except (AdmissionError, CircuitOpenError) as e:
+        return _busy_response(e)
+    except WorkerError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except ClientDisconnected:
+        return _cancelled_response(client_ip, req.code, start_time)
+
+    response_data = _build_response(result, req.seed, segments=req.segments)
+    response_data["runtime"] = runtime
+    if profile is not None:
+        response_data["profile"] = profile
+    _cache_put(req, response_data)
+    _log_usage(client_ip, req.code, start_time, response_data, fingerprint=key)
     return response_data
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class _TicketStreamingResponse(StreamingResponse):
+    # Releases the slot even if the client is gone before streaming starts
+    def __init__(self, ticket: Ticket, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release()
+
+
+@app.post("/execute/stream")
+async def execute_stream(req: ExecuteRequest, request: Request):
+    start_time = time.time()
+    client_ip = request.client.host if request.client else "unknown"
+
+    if req.profile:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "profile is not supported when streaming"},
+        )
+
+    req, key, predicted = _predict(req)
+    rejected = _check_request(req, client_ip)
+    if rejected is not None:
+        return rejected
+
+    cached = _cache_get(req)
+    if cached is not None:
+        _log_usage(client_ip, req.code, start_time, cached, cached=True)
+
+        async def replay():
+            if cached["stdout"]:
+                yield _sse("stdout", {"text": cached["stdout"]})
+            yield _sse("result", cached)
+
+        return StreamingResponse(
+            replay(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        ticket = await admission.acquire(
+            client_ip,
+            req.tier or default_tier.name,
+            memory_mb=req.limits.memory_mb,
+            expected_sec=_expected_sec(req.limits, predicted),
+        )
+    except AdmissionError as e:
+        return _busy_response(e)
+
+    parser = StreamParser(settings.magma_output_bytes)
+    streamed = False
+    chunks: asyncio.Queue[str | None] = asyncio.Queue()
+
+    def on_stdout(chunk: bytes) -> None:
+        nonlocal streamed
+        streamed = True
+        text = parser.feed(chunk)
+        if text:
+            chunks.put_nowait(text)
+
+    async def events():
+        task = asyncio.create_task(
+            _run_magma(req.code, req.seed, req.limits, on_stdout=on_stdout)
+        )
+        task.add_done_callback(lambda _: chunks.put_nowait(None))
+        try:
+            while (text := await chunks.get()) is not None:
+                yield _sse("stdout", {"text": text})
+            result: ExecutionResult = task.result()
+        except (WorkerError, CircuitOpenError) as e:
+            yield _sse("error", {"error": str(e)})
+            return
+        finally:
+            if not task.done():
+                # The client went away mid-run
+                task.cancel()
+                _log_usage(
+                    client_ip, req.code, start_time,
+                    {"success": False, "warnings": []}, cancelled=True,
+                )
+            ticket.release()
+
+        tail = parser.close()
+        if tail:
+            yield _sse("stdout", {"text": tail})
+
+        # A run that timed out reports no output, whatever was streamed
+        parsed = parser.result(result.truncated) if streamed and result.stdout else None
+        response_data = _build_response(result, req.seed, parsed, req.segments)
+        response_data["runtime"] = _record_runtime(key, predicted, result)
+        _cache_put(req, response_data)
+        _log_usage(client_ip, req.code, start_time, response_data, fingerprint=key)
+        yield _sse("result", response_data)
+
+    return _TicketStreamingResponse(
+        ticket,
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/batch")
+async def batch(req: BatchRequest, request: Request):
+    start_time = time.time()
+    client_ip = request.client.host if request.client else "unknown"
+
+    if not 1 <= len(req.items) <= settings.batch_max_items:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"A batch must have 1 to {settings.batch_max_items} items"},
+        )
+
+    # The whole batch counts as one request against the rate limit
+    rejected = _check_request(req, client_ip)
+    if rejected is not None:
+        return rejected
+
+    limits = req.limits
+    try:
+        async with admission.slot(
+            client_ip, req.tier or default_tier.name, limits.memory_mb, limits.timeout
+        ):
+            result = await cancel_on_disconnect(request, execute_batch(
+                req.items,
+                settings,
+                item_timeout=min(settings.batch_item_timeout, limits.timeout),
+                limits=limits,
+                seed=req.seed,
+            ))
+    except AdmissionError as e:
+        return _busy_response(e)
+    except OSError as e:
+        logger.warning("Batch failed: %s", e)
+        breaker.record_failure()
+        return JSONResponse(status_code=503, content={"error": "Magma could not be started"})
+    except ClientDisconnected:
+        return _cancelled_response(client_ip, req.code, start_time)
+    if result.runs:
+        breaker.record(result.runs[0])
+
+    response_data = _build_batch_response(result, req.seed, len(req.items))
+    warnings = sorted({w for item in response_data["items"] for w in item["warnings"]})
+    _log_usage(
+        client_ip,
+        req.code,
+        start_time,
+        {**response_data, "warnings": warnings},
+        batch_items=len(req.items),
+        batch_runs=response_data["runs"],
+    )
+    return response_data
+
+
+_MAP_NOT_RUN = "The map ran out of time before this input ran."
+_MAP_FAILED = "Magma could not be started for this input."
+# How often idle map helpers look for a free slot
+_MAP_RETRY_SEC = 0.2
+
+
+async def _map_chunks(req: MapRequest, chunks: list[list[str]], ticket: Ticket) -> list:
+    # Runs the chunks on the request's own slot and, in parallel, on any other
+    # slot that is idle or frees up while chunks remain. Extra slots are given
+    # back after every chunk so that waiting requests get them first. Chunks still unfinished after
+    # MAP_TIMEOUT seconds are cancelled and left as None; chunks whose
+    # process could not be started hold the error.
+    limits = req.limits
+    tier = req.tier or default_tier.name
+    preamble = f"{req.preamble}\nmap_function := function(x)\n{req.function}\nend function;"
+    results: list[BatchResult | OSError | None] = [None] * len(chunks)
+    pending = deque(range(len(chunks)))
+
+    async def run_chunks(own: Ticket | None) -> None:
+        while pending:
+            held = own or admission.try_acquire(tier, limits.memory_mb)
+            if held is None:
+                await asyncio.sleep(_MAP_RETRY_SEC)
+                continue
+            try:
+                if not pending:
+                    return
+                i = pending.popleft()
+                try:
+                    result = await execute_batch(
+                        [f"print map_function({x});" for x in chunks[i]],
+                        settings,
+                        item_timeout=min(settings.batch_item_timeout, limits.timeout),
+                        limits=limits,
+                        seed=req.seed,
+                        preamble=preamble,
+                    )
+                except OSError as e:
+                    logger.warning("Map chunk failed: %s", e)
+                    breaker.record_failure()
+                    results[i] = e
+                    continue
+                if result.runs:
+                    breaker.record(result.runs[0])
+                results[i] = result
+            finally:
+                if held is not own:
+                    held.release()
+
+    workers = [asyncio.create_task(run_chunks(ticket))]
+    helpers = min(len(chunks), sum(admission.slots.values())) - 1
+    workers += [asyncio.create_task(run_chunks(None)) for _ in range(helpers)]
+    try:
+        await asyncio.wait(workers, timeout=settings.map_timeout)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return results
+
+
+def _build_map_response(
+    chunks: list[list[str]],
+    results: list[BatchResult | OSError | None],
+    seed: int | None = None,
+) -> dict:
+    items = []
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, BatchResult):
+            items += [_build_item_response(item) for item in result.items]
+            items += [
+                _not_run_response(_BATCH_NOT_RUN) for _ in chunk[len(result.items):]
+            ]
+        elif result is not None:
+            items += [_not_run_response(_MAP_FAILED) for _ in chunk]
+        else:
+            items += [_not_run_response(_MAP_NOT_RUN) for _ in chunk]
+    done = [result for result in results if isinstance(result, BatchResult)]
+    magma = {"version": None, "seed": seed}
+    if done:
+        banner = parse_magma_output(done[0].runs[0].stdout, settings.magma_output_bytes)
+        magma = {
+            "version": banner.version,
+            "seed": seed if seed is not None else banner.seed,
+        }
+    return {
+        "success": all(item["success"] for item in items),
+        "complete": len(done) == len(chunks),
+        "items": items,
+        "chunks": len(chunks),
+        "runs": sum(len(result.runs) for result in done),
+        "magma": magma,
+    }
+
+
+@app.post("/map")
+async def map_inputs(req: MapRequest, request: Request):
+    start_time = time.time()
+    client_ip = request.client.host if request.client else "unknown"
+
+    if not 1 <= len(req.inputs) <= settings.map_max_inputs:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"A map must have 1 to {settings.map_max_inputs} inputs"},
+        )
+
+    # The whole map counts as one request against the rate limit
+    rejected = _check_request(req, client_ip)
+    if rejected is not None:
+        return rejected
+
+    size = settings.map_chunk_size
+    chunks = [req.inputs[i:i + size] for i in range(0, len(req.inputs), size)]
+    limits = req.limits
+    # The request's own slot may run every chunk, each up to the tier's timeout
+    expected_sec = min(settings.map_timeout, len(chunks) * limits.timeout)
+    try:
+        async with admission.slot(
+            client_ip, req.tier or default_tier.name, limits.memory_mb, expected_sec
+        ) as ticket:
+            results = await cancel_on_disconnect(request, _map_chunks(req, chunks, ticket))
+    except AdmissionError as e:
+        return _busy_response(e)
+    except ClientDisconnected:
+        return _cancelled_response(client_ip, req.code, start_time)
+
+    response_data = _build_map_response(chunks, results, req.seed)
+    warnings = sorted({w for item in response_data["items"] for w in item["warnings"]})
+    _log_usage(
+        client_ip,
+        req.code,
+        start_time,
+        {**response_data, "warnings": warnings},
+        map_inputs=len(req.inputs),
+        map_chunks=len(chunks),
+        batch_runs=response_data["runs"],
+    )
+    return response_data
+
+
+def _session_limits(tier: Tier) -> Limits:
+    # The jail lives as long as the session; the tier's timeout applies per call
+    return Limits(
+        timeout=settings.session_max_age,
+        cpu_timeout=settings.session_cpu_timeout,
+        memory_mb=tier.limits.memory_mb,
+        cpu_weight=tier.limits.cpu_weight,
+    )
+
+
+@app.post("/sessions")
+async def open_session(req: SessionRequest, request: Request):
+    client_ip = request.client.host if request.client else "unknown"
+
+    if settings.session_max <= 0:
+        return JSONResponse(status_code=404, content={"error": "Sessions are disabled"})
+    if req.tier is not None and req.tier not in tiers:
+        return JSONResponse(status_code=400, content={"error": "Unknown tier"})
+    if not admission.fits_budget(tiers[req.tier or default_tier.name].limits.memory_mb):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "The memory limit exceeds the memory budget"},
+        )
+    if not rate_limiter.is_allowed(client_ip):
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Rate limit exceeded"},
+            headers={"Retry-After": "60"},
+        )
+    # Holds a place while the session starts, so concurrent opens cannot all
+    # pass the check and exceed SESSION_MAX
+    if not session_manager.reserve():
+        return JSONResponse(status_code=503, content={"error": "Too many open sessions"})
+    try:
+        return await _start_session(tiers[req.tier or default_tier.name], client_ip)
+    finally:
+        session_manager.unreserve()
+
+
+async def _start_session(tier: Tier, client_ip: str) -> JSONResponse:
+    try:
+        breaker.check()
+    except CircuitOpenError as e:
+        return _busy_response(e)
+
+    try:
+        ticket = await admission.acquire(
+            client_ip,
+            tier.name,
+            memory_mb=tier.limits.memory_mb,
+            expected_sec=settings.session_max_age,
+        )
+    except AdmissionError as e:
+        return _busy_response(e)
+
+    limits = _session_limits(tier)
+    try:
+        cgroup = new_cgroup(settings, limits)
+        proc = await spawn_process(build_nsjail_command(settings, limits=limits), cgroup)
+    except BaseException:
+        ticket.release()
+        raise
+    session = Session(
+        client_ip, tier.name, proc, ticket, limits.memory_mb * 1024 * 1024, cgroup
+    )
+    try:
+        await session.start(timeout=tier.limits.timeout)
+    except OSError:
+        logger.warning("Magma session failed to start")
+        return JSONResponse(status_code=500, content={"error": "Cannot start Magma session"})
+    await session_manager.add(session)
+
+    banner = parse_magma_output(session.banner, settings.magma_output_bytes)
+    return JSONResponse(
+        status_code=201,
+        content={
+            "session_id": session.id,
+            "tier": tier.name,
+            "magma": {"version": banner.version, "seed": banner.seed},
+        },
+    )
+
+
+@app.post("/sessions/{session_id}/execute")
+async def session_execute(session_id: str, req: SessionExecuteRequest, request: Request):
+    start_time = time.time()
+    client_ip = request.client.host if request.client else "unknown"
+
+    session = session_manager.get(session_id)
+    if session is None:
+        return JSONResponse(status_code=404, content={"error": "Session not found"})
+
+    rejected = _check_request(req, client_ip)
+    if rejected is not None:
+        return rejected
+
+    tier = tiers.get(session.tier, default_tier)
+    result = await session.execute(req.code, tier.limits.timeout, settings.magma_output_bytes)
+
+    response_data = _build_item_response(result)
+    response_data["resources"] = asdict(result.usage) if result.usage is not None else None
+    # A timeout or a crash ends the session and its state
+    response_data["session_open"] = not session.closed
+    if session.closed:
+        await session_manager.close(session.id)
+    _log_usage(client_ip, req.code, start_time, response_data, session_id=session.id)
+    return response_data
+
+
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    if not await session_manager.close(session_id):
+        return JSONResponse(status_code=404, content={"error": "Session not found"})
+    return Response(status_code=204)
+
+
+async def _run_job(job: dict, on_start) -> dict:
+    # The tier may have been removed from the configuration since submission
+    tier = tiers.get(job["tier"], default_tier)
+    limits = _request_limits(tier.limits, job["memory_mb"], job["time_limit"])
+    key = fingerprint(job["code"])
+    predicted = predictor.predict(key)
+
+    # Jobs wait for a slot as long as it takes instead of failing with 503,
+    # unless they can never get one
+    while True:
+        try:
+            ticket = await admission.acquire(
+                job["client_ip"],
+                tier.name,
+                wait_forever=True,
+                memory_mb=limits.memory_mb,
+                expected_sec=_expected_sec(limits, predicted),
+            )
+            break
+        except MemoryBudgetError as e:
+            return _error_result(str(e), job["seed"])
+        except AdmissionError as e:
+            await asyncio.sleep(e.retry_after)
+
+    on_start()
+    start_time = time.time()
+    profile = None
+    try:
+        while True:
+            try:
+                if job["profile"]:
+                    result, profile = await _run_profiled(job["code"], job["seed"], limits)
+                else:
+                    result = await _run_magma(job["code"], job["seed"], limits)
+                break
+            except WorkerError:
+                await asyncio.sleep(settings.worker_health_interval)
+            except CircuitOpenError as e:
+                await asyncio.sleep(e.retry_after)
+    finally:
+        ticket.release()
+
+    response_data = _build_response(result, job["seed"], segments=bool(job["segments"]))
+    response_data["runtime"] = _record_runtime(key, predicted, result)
+    if profile is not None:
+        response_data["profile"] = profile
+    _log_usage(
+        job["client_ip"], job["code"], start_time, response_data,
+        job_id=job["id"], fingerprint=key,
+    )
+    return response_data
+
+
+job_runner = JobRunner(
+    JobStore(settings.jobs_db_file, ttl=settings.job_ttl),
+    _run_job,
+    workers=settings.job_workers,
+    error_result=_error_result,
+)
+
+
+def _format_time(ts: float | None) -> str | None:
+    if ts is None:
+        return None
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def _job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "queued_at": _format_time(job["queued_at"]),
+        "started_at": _format_time(job["started_at"]),
+        "finished_at": _format_time(job["finished_at"]),
+    }
+
+
+@app.post("/jobs")
+async def submit_job(req: ExecuteRequest, request: Request):
+    client_ip = request.client.host if request.client else "unknown"
+
+    req, _, _ = _predict(req)
+    rejected = _check_request(req, client_ip)
+    if rejected is not None:
+        return rejected
+
+    job = job_runner.submit(
+        req.code,
+        req.seed,
+        client_ip,
+        req.tier or default_tier.name,
+        req.memory_mb,
+        req.time_limit,
+        req.profile,
+        req.segments,
+    )
+    return JSONResponse(status_code=202, content=_job_status(job))
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = 0):
+    # Long-poll: hold the request until the job finishes or `wait` seconds pass
+    job = await job_runner.wait(job_id, min(max(wait, 0), settings.job_max_wait))
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return _job_status(job)
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = job_runner.store.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    if job["status"] != "finished":
+        return JSONResponse(
+            status_code=409,
+            content={"error": "Job not finished", **_job_status(job)},
+        )
+    return job["result"]
+
+
 if __name__ == "__main__":
     import uvicorn
 
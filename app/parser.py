@@ -1,5 +1,18 @@
+import codecs
 import re
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+
+
+@dataclass
+class Segment:
+    # A run of body output of one type: "output", "user_error",
+    # "runtime_error" or "memory_limit"
+    type: str
+    # UTF-8 byte offsets into the body
+    start: int
+    end: int
+    # Source line, when Magma reports one
+    line: int | None = None
 
 
 @dataclass
@@ -11,6 +24,7 @@ class ParseResult:
     memory: str | None = None
     truncated: bool = False
     warnings: list[str] = field(default_factory=list)
+    segments: list[Segment] = field(default_factory=list)
 
 
 _RE_VERSION = re.compile(r"Magma V(\d+\.\d+(-[A-Z]*\d+)?)")
@@ -18,7 +32,6 @@ _RE_SEED = re.compile(r"\[Seed = (\d+)\]")
 _RE_FOOTER_START = re.compile(r"Total time:\s+\d+\.\d+ seconds, Total memory usage: ")
 _RE_TIME = re.compile(r"Total time:\s+(\d+\.\d+)")
 _RE_MEMORY = re.compile(r"Total memory usage: (\d+\.\d+[A-Z]+)")
-_RE_MACHINE_TYPE = re.compile(r"Machine type: .*\n")
 
 _ERROR_PATTERNS = [
     "User error: ",
@@ -26,75 +39,270 @@ _ERROR_PATTERNS = [
     "(internal error)",
     "Illegal system call",
 ]
+_RE_LINE_NUMBER = re.compile(r"\bline (\d+)")
+# Lines Magma prints right before an error message: the location, the
+# echoed statement and the caret under it
+_RE_ERROR_CONTEXT = re.compile(r'>> |\s*\^\s*$|In file ".*", line \d+')
 
 
-def parse_magma_output(stdout: str, max_output_bytes: int) -> ParseResult:
-    result = ParseResult()
+def parse_magma_output(
+    stdout: str, max_output_bytes: int, truncated: bool = False
+) -> ParseResult:
+    parser = StreamParser(max_output_bytes)
+    parser.feed_text(stdout)
+    parser.close()
+    return parser.result(truncated)
 
-    if not stdout:
-        return result
 
-    quit_idx = stdout.find("quit.\n")
-    if quit_idx == -1:
-        _extract_banner(stdout, result)
+def parse_body(body: str, max_output_bytes: int, truncated: bool = False) -> ParseResult:
+    # Classifies output with the banner and footer already removed
+    parser = StreamParser(max_output_bytes, header=False)
+    parser.feed_text(body)
+    parser.close()
+    return parser.result(truncated)
+
+
+class StreamParser:
+    # Parses raw Magma stdout in a single pass, fed in chunks as it arrives:
+    # the banner up to the "quit." echo, the body up to the footer, then the
+    # footer. The body is classified line by line and only its first
+    # max_output_bytes are kept, so cost and memory stay bounded however much
+    # Magma prints. `feed` returns the body text that became visible, for
+    # forwarding output live.
+    #
+    # The body follows parse_magma_output's rules: trailing blank lines are
+    # dropped, the last line always ends in a newline, and "Machine type:"
+    # through the end of its line is removed. With header=False the input is
+    # a body only (batch items and session calls), with no footer to look for.
+    #
+    # The body is also split into segments as it goes. An error report runs
+    # from the location, statement and caret lines directly before the error
+    # message up to the next blank line.
+
+    # Longer lines are parsed in pieces
+    _MAX_LINE = 64 * 1024
+
+    def __init__(self, max_output_bytes: int, header: bool = True):
+        self.max_output_bytes = max_output_bytes
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        self._header = header
+        self._state = "banner" if header else "body"
+        self._version: str | None = None
+        self._seed: int | None = None
+        self._time_sec: float | None = None
+        self._memory: str | None = None
+        self._blank_lines = 0
+        # The kept prefix of the body, and the length of all of it
+        self._body: list[str] = []
+        self._kept = 0
+        self._length = 0
+        self._memory_limit = False
+        self._error = False
+        self._segments: list[Segment] = []
+        # Byte offset in the whole body, and the start and line of the
+        # context lines that may precede an error message
+        self._offset = 0
+        self._context: tuple[int, int | None] | None = None
+
+    def feed(self, chunk: bytes) -> str:
+        return self.feed_text(self._decoder.decode(chunk))
+
+    def feed_text(self, text: str) -> str:
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        out = [self._line(line, eol=True) for line in lines]
+        if len(self._pending) > self._MAX_LINE:
+            if self._state == "body":
+                out.append(self._line(self._pending, eol=False))
+                self._pending = ""
+            else:
+                if self._state == "banner":
+                    self._banner(self._pending)
+                # Enough to still recognise the "quit." echo
+                self._pending = self._pending[-len("quit."):]
+        return "".join(out)
+
+    def close(self) -> str:
+        # Returns the rest of the visible body
+        self._pending += self._decoder.decode(b"", final=True)
+        text = ""
+        if self._state == "banner":
+            # Without a newline the "quit." echo does not count
+            self._banner(self._pending)
+        elif self._pending:
+            text = self._line(self._pending, eol=True)
+        self._pending = ""
+        return text
+
+    def result(self, truncated: bool = False) -> ParseResult:
+        # `truncated` means the executor already stopped reading the output
+        result = ParseResult(
+            version=self._version,
+            seed=self._seed,
+            time_sec=self._time_sec,
+            memory=self._memory,
+        )
+        if self._state == "banner":
+            return result
+        result.stdout = "".join(self._body)
+        if self._memory_limit:
+            result.warnings.append(
+                "The computation exceeded the memory limit and so was terminated prematurely."
+            )
+        if self._error:
+            result.warnings.append("An error occurred. See the output for details.")
+        if self._length > self.max_output_bytes or truncated:
+            result.truncated = True
+            result.warnings.append("The output is too long and has been truncated.")
+        kept = len(result.stdout.encode("utf-8"))
+        result.segments = [
+            replace(segment, end=min(segment.end, kept))
+            for segment in self._segments
+            if segment.start < kept
+        ]
         return result
 
-    banner = stdout[:quit_idx]
-    rest = stdout[quit_idx + len("quit.\n"):]
+    def _line(self, line: str, eol: bool) -> str:
+        if self._state == "banner":
+            self._banner(line)
+            if line.endswith("quit."):
+                self._state = "body"
+            return ""
+        if self._state == "footer":
+            self._footer(line)
+            return ""
 
-    _extract_banner(banner, result)
+        m = _RE_FOOTER_START.search(line) if self._header else None
+        if m:
+            self._state = "footer"
+            self._footer(line[m.start():])
+            line, eol = line[:m.start()], True
+        if not line:
+            if eol:
+                self._blank_lines += 1
+            return ""
 
-    footer_match = _RE_FOOTER_START.search(rest)
-    if footer_match:
-        body = rest[:footer_match.start()]
-        footer = rest[footer_match.start():]
-        _extract_footer(footer, result)
-    else:
-        body = rest
+        blanks = self._blank_lines
+        self._blank_lines = 0
+        text = "\n" * blanks + line
+        idx = text.find("Machine type: ")
+        if idx != -1:
+            # Dropped through the end of the line, newline included
+            text, eol = text[:idx], False
+        if eol:
+            text += "\n"
+        # Segments past the kept part of the body would be dropped anyway
+        if self._kept < self.max_output_bytes:
+            self._segment(text, blanks)
+        return self._body_text(text)
 
-    body = body.rstrip("\n")
-    if body:
-        body += "\n"
-    else:
-        body = ""
+    def _segment(self, text: str, blanks: int) -> None:
+        pos = self._offset
+        if blanks:
+            # Blank lines end an error report
+            self._context = None
+            self._extend("output", pos, pos + blanks)
+            pos += blanks
+        line = text[blanks:]
+        end = self._offset = pos + len(line.encode("utf-8"))
 
-    body = _RE_MACHINE_TYPE.sub("", body)
+        kind = _segment_type(line)
+        if kind is None:
+            if not _RE_ERROR_CONTEXT.match(line):
+                self._context = None
+            elif self._context is None:
+                self._context = (pos, _line_number(line))
+            self._extend(self._segments[-1].type if self._segments else "output", pos, end)
+            return
 
-    if "User memory limit" in body:
-        result.warnings.append(
-            "The computation exceeded the memory limit and so was terminated prematurely."
+        start, line_number = self._context or (pos, None)
+        self._context = None
+        if start < pos:
+            # The context lines belong to the error, not to what came before
+            last = self._segments[-1]
+            last.end = start
+            if last.start == last.end:
+                self._segments.pop()
+        self._segments.append(
+            Segment(kind, start, end, line_number or _line_number(line))
         )
 
-    for pattern in _ERROR_PATTERNS:
-        if pattern in body:
-            result.warnings.append("An error occurred. See the output for details.")
-            break
+    def _extend(self, kind: str, start: int, end: int) -> None:
+        if start == end:
+            return
+        last = self._segments[-1] if self._segments else None
+        if last is not None and last.type == kind and last.end == start:
+            last.end = end
+        else:
+            self._segments.append(Segment(kind, start, end))
+
+    def _body_text(self, text: str) -> str:
+        if not self._memory_limit and "User memory limit" in text:
+            self._memory_limit = True
+        if not self._error and any(pattern in text for pattern in _ERROR_PATTERNS):
+            self._error = True
+        self._length += len(text)
+        text = text[:max(self.max_output_bytes - self._kept, 0)]
+        if text:
+            self._body.append(text)
+            self._kept += len(text)
+        return text
 
-    if len(body) > max_output_bytes:
-        body = body[:max_output_bytes]
-        result.truncated = True
-        result.warnings.append("The output is too long and has been truncated.")
+    def _banner(self, text: str) -> None:
+        if self._version is None and (m := _RE_VERSION.search(text)):
+            self._version = m.group(1)
+        if self._seed is None and (m := _RE_SEED.search(text)):
+            self._seed = int(m.group(1))
 
-    result.stdout = body
-    return result
+    def _footer(self, text: str) -> None:
+        if self._time_sec is None and (m := _RE_TIME.search(text)):
+            self._time_sec = float(m.group(1))
+        if self._memory is None and (m := _RE_MEMORY.search(text)):
+            self._memory = m.group(1)
 
 
-def _extract_banner(text: str, result: ParseResult) -> None:
-    m = _RE_VERSION.search(text)
-    if m:
-        result.version = m.group(1)
-    m = _RE_SEED.search(text)
-    if m:
-        result.seed = int(m.group(1))
+def _segment_type(line: str) -> str | None:
+    # The type of segment an error message line starts, if any
+    if "User memory limit" in line:
+        return "memory_limit"
+    if "User error: " in line:
+        return "user_error"
+    if any(pattern in line for pattern in _ERROR_PATTERNS):
+        return "runtime_error"
+    return None
+
+
+def _line_number(line: str) -> int | None:
+    m = _RE_LINE_NUMBER.search(line)
+    return int(m.group(1)) if m else None
+
+
+def split_batch_output(stdout: str, marker: str) -> tuple[list[str], bool]:
+    # Splits batch output at the marker lines printed before each item (see
+    # app.executor.wrap_batch_code). Returns the raw output of every item that
+    # started and whether the closing marker was reached.
+    # A gap in the numbering means an item swallowed the markers after it
+    # (e.g. an unterminated string), so splitting stops there.
+    items = []
+    start = None
+    for m in re.finditer(re.escape(marker) + r" (\d+|end)\n", stdout):
+        if start is not None:
+            items.append(stdout[start:m.start()])
+        if m.group(1) == "end":
+            return items, True
+        if int(m.group(1)) != len(items):
+            start = None
+            break
+        start = m.end()
+    if start is not None:
+        items.append(stdout[start:])
+    return items, False
 
 
-def _extract_footer(text: str, result: ParseResult) -> None:
-    m = _RE_TIME.search(text)
-    if m:
-        result.time_sec = float(m.group(1))
-    m = _RE_MEMORY.search(text)
-    if m:
-        result.memory = m.group(1)
+def has_banner(stdout: str) -> bool:
+    # Magma prints its banner before anything else
+    return _RE_VERSION.search(stdout[:4096]) is not None
 
 
 def parse_stderr_warnings(stderr: str | None) -> list[str]:
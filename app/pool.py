@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import subprocess
+import time
+from collections import deque
+from collections.abc import Callable
+
+from app.cgroup import JobCgroup
+from app.config import Limits
+from app.executor import spawn_process
+from app.launcher import JailProcess
+
+Jail = tuple[JailProcess, JobCgroup | None]
+
+logger = logging.getLogger("calculator")
+
+
+class WarmPool:
+    # Jailed Magma processes started ahead of time; each is handed to exactly
+    # one execution and then discarded.
+
+    def __init__(
+        self,
+        cmd: list[str],
+        size: int,
+        max_age: int,
+        limits: Limits | None = None,
+        new_cgroup: Callable[[], JobCgroup | None] | None = None,
+    ):
+        self.cmd = cmd
+        self.size = size
+        self.max_age = max_age
+        # Limits the jails in `cmd` were started with
+        self.limits = limits
+        self.new_cgroup = new_cgroup or (lambda: None)
+
+        self.hits = 0
+        self.misses = 0
+        self.spawned = 0
+        self.expired = 0
+
+        # (start time, jail), oldest first
+        self._ready: deque[tuple[float, Jail]] = deque()
+        self._spawn_times: deque[float] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._reapers: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._ready:
+            _, jail = self._ready.popleft()
+            self._discard(jail)
+        if self._reapers:
+            await asyncio.gather(*self._reapers, return_exceptions=True)
+
+    def take(self) -> Jail | None:
+        self._expire()
+        self._wakeup.set()
+        if self._ready:
+            self.hits += 1
+            return self._ready.popleft()[1]
+        self.misses += 1
+        return None
+
+    def _expire(self) -> int:
+        now = time.monotonic()
+        dead = 0
+        fresh: deque[tuple[float, Jail]] = deque()
+        for started, jail in self._ready:
+            if jail[0].returncode is not None:
+                dead += 1
+                self._discard(jail)
+            elif now - started >= self.max_age:
+                self.expired += 1
+                self._discard(jail)
+            else:
+                fresh.append((started, jail))
+        self._ready = fresh
+        return dead
+
+    def _discard(self, jail: Jail) -> None:
+        proc, cgroup = jail
+        if proc.returncode is None:
+            proc.kill()
+
+        async def reap():
+            await proc.wait()
+            if cgroup is not None:
+                cgroup.kill()
+                await cgroup.remove()
+
+        task = asyncio.create_task(reap())
+        self._reapers.add(task)
+        task.add_done_callback(self._reapers.discard)
+
+    async def _refill_loop(self) -> None:
+        while True:
+            if self._expire():
+                # Processes dying while idle means the jail itself is failing;
+                # back off instead of respawning in a tight loop.
+                logger.warning("Warm pool process exited before use")
+                await asyncio.sleep(1)
+            while len(self._ready) < self.size:
+                try:
+                    cgroup = self.new_cgroup()
+                    proc = await spawn_process(self.cmd, cgroup)
+                except (OSError, subprocess.SubprocessError) as e:
+                    logger.warning("Cannot start warm pool process: %s", e)
+                    await asyncio.sleep(1)
+                    break
+                now = time.monotonic()
+                self._ready.append((now, (proc, cgroup)))
+                self._spawn_times.append(now)
+                self.spawned += 1
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=max(self.max_age / 4, 1)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        cutoff = time.monotonic() - 60
+        while self._spawn_times and self._spawn_times[0] < cutoff:
+            self._spawn_times.popleft()
+        return {
+            "size": self.size,
+            "ready": len(self._ready),
+            "hits": self.hits,
+            "misses": self.misses,
+            "spawned": self.spawned,
+            "expired": self.expired,
+            "refills_per_minute": len(self._spawn_times),
+        }
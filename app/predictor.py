@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import math
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger("calculator")
+
+_RE_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_RE_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+_RE_NUMBER = re.compile(r"\d+")
+_RE_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(code: str) -> str:
+    # Code that differs only in comments, layout, strings or the exact value
+    # of its numbers shares a fingerprint. The number of digits is kept, since
+    # it usually decides how long a computation takes.
+    text = _RE_COMMENT.sub(" ", code)
+    text = _RE_STRING.sub('""', text)
+    text = _RE_NUMBER.sub(lambda m: f"#{len(m.group())}", text)
+    text = _RE_SPACE.sub(" ", text).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class RuntimePredictor:
+    # Predicts the run time of code from earlier runs with the same
+    # fingerprint: an exponentially weighted average of the log run time, so
+    # one slow outlier moves the estimate by a factor, not by its size. The
+    # history keeps the most recently used fingerprints and is saved to `path`.
+
+    _ALPHA = 0.3
+
+    def __init__(self, max_entries: int, path: str = ""):
+        self.max_entries = max_entries
+        self._path = Path(path) if path else None
+        # fingerprint -> [mean log seconds, runs], least recently used first
+        self._history: OrderedDict[str, list] = OrderedDict()
+
+        self.predictions = 0
+        self.misses = 0
+        # Accuracy over runs that had a prediction
+        self.scored = 0
+        self._abs_error = 0.0
+        self._within_2x = 0
+
+        if self._path is not None and self._path.exists():
+            try:
+                for key, entry in json.loads(self._path.read_text()).items():
+                    self._history[key] = entry
+            except (OSError, ValueError):
+                logger.warning("Cannot read runtime history: %s", self._path)
+
+    def predict(self, key: str) -> float | None:
+        entry = self._history.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.predictions += 1
+        return round(math.exp(entry[0]), 3)
+
+    def record(self, key: str, seconds: float, predicted: float | None = None) -> None:
+        # Sub-millisecond runs would dominate the log scale
+        log_sec = math.log(max(seconds, 0.001))
+        entry = self._history.get(key)
+        if entry is None:
+            self._history[key] = [log_sec, 1]
+            if len(self._history) > self.max_entries:
+                self._history.popitem(last=False)
+        else:
+            entry[0] += self._ALPHA * (log_sec - entry[0])
+            entry[1] += 1
+            self._history.move_to_end(key)
+
+        if predicted is not None:
+            self.scored += 1
+            self._abs_error += abs(predicted - seconds)
+            if predicted / 2 <= seconds <= predicted * 2:
+                self._within_2x += 1
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._history))
+            tmp.replace(self._path)
+        except OSError:
+            logger.warning("Cannot write runtime history: %s", self._path)
+            self._path = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._history),
+            "predictions": self.predictions,
+            "misses": self.misses,
+            "scored": self.scored,
+            "mean_abs_error_sec": (
+                round(self._abs_error / self.scored, 3) if self.scored else None
+            ),
+            "within_2x": round(self._within_2x / self.scored, 3) if self.scored else None,
+        }
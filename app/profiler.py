@@ -0,0 +1,150 @@
+import re
+import uuid
+from dataclasses import dataclass
+
+# Comments, strings, words, `;`, whitespace, and runs of anything else
+_RE_TOKEN = re.compile(
+    r'//[^\n]*|/\*.*?(?:\*/|$)|"(?:[^"\\]|\\.)*"?|\w+|;|\s+|[^\w\s"/;]+|.', re.DOTALL
+)
+# Keywords that open a block closed by `end <keyword>` (or `until` for repeat)
+_BLOCK_OPENERS = {"function", "procedure", "for", "while", "if", "case", "repeat", "try"}
+
+# Beyond this, the remaining statements are timed together as the last one
+_MAX_STATEMENTS = 50
+_MAX_HOT = 10
+_MAX_CODE_CHARS = 80
+
+
+@dataclass
+class Statement:
+    line: int
+    code: str
+
+
+def split_statements(code: str) -> list[Statement]:
+    # Splits code into its top-level statements. Code whose blocks do not
+    # balance is returned as a single statement.
+    statements: list[Statement] = []
+    depth = 0
+    start = 0
+    first_line: int | None = None
+    line = 1
+    after_end = False
+    tokens = list(_RE_TOKEN.finditer(code))
+    for i, m in enumerate(tokens):
+        token = m.group()
+        if token.isspace() or token.startswith(("//", "/*")):
+            line += token.count("\n")
+            continue
+        if first_line is None:
+            first_line = line
+        line += token.count("\n")
+        if after_end:
+            # The keyword after `end` does not open a block
+            after_end = False
+        elif token == "end":
+            depth -= 1
+            after_end = True
+        elif token == "until":
+            depth -= 1
+        elif token in _BLOCK_OPENERS and not _is_case_expression(token, tokens, i):
+            depth += 1
+        elif token == ";" and depth == 0:
+            statements.append(Statement(first_line, code[start:m.end()]))
+            start = m.end()
+            first_line = None
+        if depth < 0:
+            break
+    if depth != 0:
+        return [Statement(1, code)]
+    if first_line is not None:
+        statements.append(Statement(first_line, code[start:]))
+    elif statements:
+        # Trailing whitespace and comments
+        statements[-1].code += code[start:]
+    if len(statements) > _MAX_STATEMENTS:
+        rest = statements[_MAX_STATEMENTS - 1:]
+        statements = statements[:_MAX_STATEMENTS - 1]
+        statements.append(Statement(rest[0].line, "".join(s.code for s in rest)))
+    return statements
+
+
+def _is_case_expression(token: str, tokens: list[re.Match], i: int) -> bool:
+    # `case<x | ...>` is an expression, not a block
+    if token != "case":
+        return False
+    for m in tokens[i + 1:]:
+        if not m.group().isspace():
+            return m.group().startswith("<")
+    return False
+
+
+class StatementProfiler:
+    # Times each top-level statement of the code: after every statement, a
+    # line with the statement's CPU and wall time and Magma's memory usage is
+    # printed behind a random marker. `collect` removes those lines from the
+    # output and turns them into a table of the slowest statements.
+
+    def __init__(self, code: str):
+        self.statements = split_statements(code)
+        self.marker = uuid.uuid4().hex[:16]
+        self._re_line = re.compile(
+            re.escape(self.marker) + r" (\d+) (\S+) (\S+) (\d+)\n"
+        )
+
+    @property
+    def code(self) -> str:
+        start = "profile_cpu__ := Cputime();\nprofile_real__ := Realtime();\n"
+        parts = [start]
+        for i, statement in enumerate(self.statements):
+            parts.append(
+                f"{statement.code}\n;\n"
+                f'printf "{self.marker} {i} %o %o %o\\n", Cputime(profile_cpu__), '
+                f"Realtime(profile_real__), GetMemoryUsage();\n"
+                f"{start}"
+            )
+        return "".join(parts)
+
+    def collect(self, stdout: str) -> tuple[str, dict]:
+        timings = {}
+        for m in self._re_line.finditer(stdout):
+            try:
+                timings[int(m.group(1))] = (
+                    float(m.group(2)), float(m.group(3)), int(m.group(4))
+                )
+            except ValueError:
+                continue
+        stdout = self._re_line.sub("", stdout)
+
+        rows = []
+        for i, statement in enumerate(self.statements):
+            row = {"line": statement.line, "code": _summary(statement.code)}
+            if i not in timings:
+                # Magma stopped in this statement (time or memory limit)
+                rows.append({
+                    **row, "cpu_sec": None, "wall_sec": None, "memory_bytes": None,
+                    "finished": False,
+                })
+                break
+            cpu_sec, wall_sec, memory_bytes = timings[i]
+            rows.append({
+                **row, "cpu_sec": cpu_sec, "wall_sec": wall_sec,
+                "memory_bytes": memory_bytes, "finished": True,
+            })
+        rows.sort(key=lambda row: (row["finished"], -(row["cpu_sec"] or 0)))
+        return stdout, {
+            "statements": len(self.statements),
+            "finished": len(timings),
+            "hot": rows[:_MAX_HOT],
+        }
+
+
+def _summary(code: str) -> str:
+    # The statement's first line of code, shortened
+    for line in code.splitlines():
+        line = line.strip()
+        if line and not line.startswith(("//", "/*")):
+            if len(line) > _MAX_CODE_CHARS:
+                return line[:_MAX_CODE_CHARS - 3] + "..."
+            return line
+    return ""
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+from app.admission import Ticket
+from app.cgroup import JobCgroup
+from app.executor import (
+    READ_CHUNK, STDERR_LIMIT, ExecutionResult, ResourceUsage, collect_usage, read_capped,
+)
+from app.launcher import JailProcess
+
+logger = logging.getLogger("calculator")
+
+_BANNER_LIMIT = 4096
+
+
+class Session:
+    # A long-lived jailed Magma process. Each call writes the code followed by
+    # a marker print and reads stdout up to the marker, so the output of one
+    # call is separated from the next without restarting Magma.
+
+    def __init__(
+        self,
+        client: str,
+        tier: str,
+        proc: JailProcess,
+        ticket: Ticket,
+        memory_budget: int,
+        cgroup: JobCgroup | None = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.tier = tier
+        self.proc = proc
+        # Execution slot held for the whole life of the session
+        self.ticket = ticket
+        self.memory_budget = memory_budget
+        self.cgroup = cgroup
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.calls = 0
+        self.closed = False
+        self.lock = asyncio.Lock()
+        self.banner = ""
+        self._marker = uuid.uuid4().hex
+        self._stderr = asyncio.create_task(read_capped(proc.stderr, STDERR_LIMIT))
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    def memory_used(self) -> int:
+        # Without a cgroup, the whole budget is assumed to be in use
+        used = self.cgroup.memory_bytes() if self.cgroup is not None else None
+        return used if used is not None else self.memory_budget
+
+    async def start(self, timeout: float) -> None:
+        # Everything before the first marker is Magma's banner
+        async with self.lock:
+            try:
+                output, complete = await self._send(
+                    "SetIgnorePrompt(true);", timeout, _BANNER_LIMIT
+                )
+            except asyncio.TimeoutError:
+                complete = False
+        if not complete:
+            await self.close()
+            raise OSError("Magma session did not start")
+        self.banner = output.decode("utf-8", errors="replace")
+
+    async def execute(self, code: str, timeout: float, max_output_bytes: int) -> ExecutionResult:
+        async with self.lock:
+            started = time.monotonic()
+            cpu_before = self.cgroup.cpu_sec() if self.cgroup is not None else None
+            try:
+                output, complete = await self._send(code, timeout, max_output_bytes)
+            except asyncio.TimeoutError:
+                # The interrupted computation leaves Magma in an unknown state
+                usage = await self._end(time.monotonic() - started)
+                return ExecutionResult("", "Killed", -1, usage=usage)
+            finally:
+                self.last_used = time.monotonic()
+
+            truncated = len(output) > max_output_bytes
+            stdout = output[:max_output_bytes].decode("utf-8", errors="replace")
+            if not complete:
+                # Magma exited: CPU budget, memory limit or a fatal error
+                usage = await self._end(time.monotonic() - started)
+                stderr, _ = await self._stderr
+                return ExecutionResult(
+                    stdout,
+                    stderr.decode("utf-8", errors="replace"),
+                    self.proc.returncode or -1,
+                    truncated=truncated,
+                    usage=usage,
+                )
+
+            usage = ResourceUsage(wall_sec=round(time.monotonic() - started, 3))
+            if cpu_before is not None and (cpu_after := self.cgroup.cpu_sec()) is not None:
+                usage.cpu_sec = round(cpu_after - cpu_before, 3)
+            return ExecutionResult(stdout, "", 0, truncated=truncated, usage=usage)
+
+    async def _send(self, code: str, timeout: float, limit: int) -> tuple[bytes, bool]:
+        self.calls += 1
+        end = f"{self._marker} {self.calls}\n".encode()
+        try:
+            self.proc.stdin.write(f'{code}\n;\nprint "{self._marker} {self.calls}";\n'.encode())
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            return b"", False
+        return await asyncio.wait_for(self._read_until(end, limit), timeout=timeout)
+
+    async def _read_until(self, end: bytes, limit: int) -> tuple[bytes, bool]:
+        # Output beyond `limit` is dropped, keeping just enough to spot `end`
+        buf = bytearray()
+        while chunk := await self.proc.stdout.read(READ_CHUNK):
+            buf += chunk
+            idx = buf.find(end)
+            if idx != -1:
+                return bytes(buf[:idx]), True
+            if len(buf) > limit + 1 + len(end):
+                del buf[limit + 1:len(buf) - len(end)]
+        return bytes(buf), False
+
+    async def _end(self, wall_sec: float) -> ResourceUsage:
+        cgroup, self.cgroup = self.cgroup, None
+        await self.close()
+        return await collect_usage(wall_sec, cgroup)
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.proc.returncode is None:
+            self.proc.kill()
+        await self.proc.wait()
+        await asyncio.gather(self._stderr, return_exceptions=True)
+        if self.cgroup is not None:
+            self.cgroup.kill()
+            await self.cgroup.remove()
+        self.ticket.release()
+
+
+class SessionManager:
+    # Open sessions in least recently used order. Sessions are closed after
+    # `idle_timeout` seconds without a call, and idle sessions are evicted
+    # oldest first while their memory use exceeds `memory_ceiling`.
+
+    def __init__(self, max_sessions: int, idle_timeout: int, memory_ceiling: int):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.memory_ceiling = memory_ceiling
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._task: asyncio.Task | None = None
+        self._reserved = 0
+
+        self.created = 0
+        self.closed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.died = 0
+
+    @property
+    def full(self) -> bool:
+        return len(self._sessions) + self._reserved >= self.max_sessions
+
+    def reserve(self) -> bool:
+        # A place for a session that is still starting; False when full
+        if self.full:
+            return False
+        self._reserved += 1
+        return True
+
+    def unreserve(self) -> None:
+        self._reserved -= 1
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
+
+    async def add(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self.created += 1
+        await self._enforce_memory_ceiling(keep=session)
+
+    def get(self, session_id: str) -> Session | None:
+        session = self._sessions.get(session_id)
+        if session is None or session.closed:
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def close(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.closed += 1
+        await session.close()
+        return True
+
+    async def sweep(self) -> None:
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            if session.closed:
+                self._sessions.pop(session.id, None)
+            elif not session.busy and session.proc.returncode is not None:
+                # Magma exited between calls (killed by the jail's time limit
+                # or from outside); give its slot back now
+                self._sessions.pop(session.id, None)
+                self.died += 1
+                await session.close()
+            elif not session.busy and now - session.last_used >= self.idle_timeout:
+                self._sessions.pop(session.id, None)
+                self.expired += 1
+                await session.close()
+        await self._enforce_memory_ceiling()
+
+    async def _enforce_memory_ceiling(self, keep: Session | None = None) -> None:
+        while self.memory_used() > self.memory_ceiling:
+            victim = next(
+                (s for s in self._sessions.values() if not s.busy and s is not keep), None
+            )
+            if victim is None:
+                return
+            logger.info("Evicting session %s to stay under the memory ceiling", victim.id)
+            self._sessions.pop(victim.id)
+            self.evicted += 1
+            await victim.close()
+
+    def memory_used(self) -> int:
+        return sum(s.memory_used() for s in self._sessions.values() if not s.closed)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(1, min(self.idle_timeout / 4, 30)))
+            await self.sweep()
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "memory_bytes": self.memory_used(),
+            "created": self.created,
+            "closed": self.closed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "died": self.died,
+        }
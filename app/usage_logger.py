@@ -20,9 +20,11 @@ class UsageLogger:
         self.total_elapsed_sec = 0.0
         self.successes = 0
         self.failures = 0
+        # Runs abandoned because the client disconnected
+        self.cancelled = 0
 
-        # Last-24h entries: (timestamp, elapsed_sec, success, client_ip)
-        self._recent: deque[tuple[float, float, bool, str]] = deque()
+        # Last-24h entries: (timestamp, elapsed_sec, success, client_ip, cancelled)
+        self._recent: deque[tuple[float, float, bool, str, bool]] = deque()
 
         try:
             self._path.parent.mkdir(parents=True, exist_ok=True)
@@ -47,12 +49,7 @@ class UsageLogger:
                 self._update_alltime(entry)
                 ts = self._parse_timestamp(entry.get("timestamp", ""))
                 if ts and ts >= cutoff:
-                    self._recent.append((
-                        ts,
-                        entry.get("elapsed_sec", 0.0),
-                        entry.get("success", False),
-                        entry.get("client_ip", ""),
-                    ))
+                    self._recent.append(self._recent_entry(ts, entry))
 
     @staticmethod
     def _parse_timestamp(ts_str: str) -> float | None:
@@ -61,13 +58,25 @@ class UsageLogger:
         except (ValueError, OverflowError):
             return None
 
+    @staticmethod
+    def _recent_entry(ts: float, entry: dict) -> tuple[float, float, bool, str, bool]:
+        return (
+            ts,
+            entry.get("elapsed_sec", 0.0),
+            entry.get("success", False),
+            entry.get("client_ip", ""),
+            entry.get("cancelled", False),
+        )
+
     def _update_alltime(self, entry: dict):
         self.total_requests += 1
         ip = entry.get("client_ip", "")
         if ip:
             self.unique_ips.add(ip)
         self.total_elapsed_sec += entry.get("elapsed_sec", 0.0)
-        if entry.get("success", False):
+        if entry.get("cancelled", False):
+            self.cancelled += 1
+        elif entry.get("success", False):
             self.successes += 1
         else:
             self.failures += 1
@@ -85,12 +94,7 @@ class UsageLogger:
             self._update_alltime(entry)
             ts = self._parse_timestamp(entry.get("timestamp", ""))
             if ts:
-                self._recent.append((
-                    ts,
-                    entry.get("elapsed_sec", 0.0),
-                    entry.get("success", False),
-                    entry.get("client_ip", ""),
-                ))
+                self._recent.append(self._recent_entry(ts, entry))
 
     def prune_24h(self):
         cutoff = time.time() - 86400
@@ -111,11 +115,14 @@ class UsageLogger:
             recent_elapsed = 0.0
             recent_successes = 0
             recent_failures = 0
-            for _, elapsed, success, ip in self._recent:
+            recent_cancelled = 0
+            for _, elapsed, success, ip, cancelled in self._recent:
                 if ip:
                     recent_ips.add(ip)
                 recent_elapsed += elapsed
-                if success:
+                if cancelled:
+                    recent_cancelled += 1
+                elif success:
                     recent_successes += 1
                 else:
                     recent_failures += 1
@@ -132,6 +139,7 @@ class UsageLogger:
                 "avg_elapsed_sec": all_avg,
                 "successes": self.successes,
                 "failures": self.failures,
+                "cancelled": self.cancelled,
             },
             "last_24h": {
                 "total_requests": recent_requests,
@@ -139,5 +147,6 @@ class UsageLogger:
                 "avg_elapsed_sec": recent_avg,
                 "successes": recent_successes,
                 "failures": recent_failures,
+                "cancelled": recent_cancelled,
             },
         }
@@ -0,0 +1,108 @@
+import hmac
+import logging
+from dataclasses import asdict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from app.breaker import CircuitBreaker, CircuitOpenError
+from app.config import Limits, Settings
+from app.disconnect import ClientDisconnected, cancel_on_disconnect
+from app.executor import execute_magma
+
+# Worker node: runs executions dispatched by an API node (see app.workers).
+# Start with `python -m app.worker`; it listens on WORKER_SOCKET if set,
+# otherwise on PORT, which requires WORKER_TOKEN.
+
+settings = Settings()
+# The most any of this node's tiers allows; larger requested limits are cut
+max_limits = Limits(
+    timeout=max(tier.limits.timeout for tier in settings.tiers.values()),
+    cpu_timeout=max(tier.limits.cpu_timeout for tier in settings.tiers.values()),
+    memory_mb=max(tier.limits.memory_mb for tier in settings.tiers.values()),
+    cpu_weight=max(tier.limits.cpu_weight for tier in settings.tiers.values()),
+)
+active = 0
+breaker = CircuitBreaker(
+    settings.breaker_threshold,
+    settings.breaker_probe_interval,
+    probe=lambda: execute_magma("print 1;", settings),
+)
+
+logger = logging.getLogger("calculator")
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+app = FastAPI(docs_url=None, redoc_url=None)
+
+
+class RunRequest(BaseModel):
+    code: str
+    seed: int | None = None
+    timeout: int
+    cpu_timeout: int
+    memory_mb: int
+    cpu_weight: int = 100
+
+
+@app.get("/health")
+async def health():
+    data = {"status": "ok", "active": active, "capacity": settings.max_concurrent}
+    # An open breaker takes this node out of rotation on the API node
+    if breaker.is_open:
+        return JSONResponse(status_code=503, content={**data, "status": "unavailable"})
+    return data
+
+
+@app.post("/run")
+async def run(req: RunRequest, request: Request):
+    global active
+
+    if settings.worker_token:
+        auth = request.headers.get("authorization", "")
+        if not hmac.compare_digest(auth, f"Bearer {settings.worker_token}"):
+            return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+    if active >= settings.max_concurrent:
+        # 429 rather than 503: the API node tries another worker without
+        # taking this one out of rotation
+        return JSONResponse(status_code=429, content={"error": "Worker busy"})
+    try:
+        breaker.check()
+    except CircuitOpenError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+
+    active += 1
+    try:
+        # The API node drops the connection when it no longer wants the
+        # result; the jail is killed instead of running to its time limit
+        result = await cancel_on_disconnect(request, execute_magma(
+            req.code,
+            settings,
+            seed=req.seed,
+            limits=Limits(
+                min(req.timeout, max_limits.timeout),
+                min(req.cpu_timeout, max_limits.cpu_timeout),
+                min(req.memory_mb, max_limits.memory_mb),
+                min(req.cpu_weight, max_limits.cpu_weight),
+            ),
+        ))
+    except OSError:
+        breaker.record_failure()
+        raise
+    except ClientDisconnected:
+        return Response(status_code=499)
+    finally:
+        active -= 1
+    breaker.record(result)
+    return asdict(result)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    if settings.worker_socket:
+        uvicorn.run("app.worker:app", uds=settings.worker_socket)
+    elif not settings.worker_token:
+        raise SystemExit("WORKER_TOKEN must be set unless the worker listens on WORKER_SOCKET")
+    else:
+        uvicorn.run("app.worker:app", host="0.0.0.0", port=settings.port)
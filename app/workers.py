@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+from collections.abc import Callable
+from dataclasses import asdict
+from urllib.parse import urlsplit
+
+from app.config import Limits, Settings
+from app.executor import ExecutionResult, ResourceUsage, execute_magma
+from app.pool import WarmPool
+
+logger = logging.getLogger("calculator")
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerBusy(WorkerError):
+    # The worker is healthy but has no free slot
+    pass
+
+
+class LocalWorker:
+    # Runs executions on this host, as without any workers configured
+    name = "local"
+
+    def __init__(self, settings: Settings, capacity: int, pool: WarmPool | None = None):
+        self.settings = settings
+        self.capacity = capacity
+        self.pool = pool
+        self.active = 0
+        self.healthy = True
+
+    async def check(self) -> None:
+        pass
+
+    async def execute(
+        self,
+        code: str,
+        limits: Limits,
+        seed: int | None = None,
+        on_stdout: Callable[[bytes], None] | None = None,
+    ) -> ExecutionResult:
+        return await execute_magma(
+            code, self.settings, pool=self.pool, on_stdout=on_stdout, seed=seed, limits=limits
+        )
+
+
+class RemoteWorker:
+    # A worker node (app.worker) reached over HTTP, either
+    # "http://host:port" or "unix:/path/to/socket"
+
+    def __init__(self, address: str, token: str = "", timeout_slack: int = 10):
+        self.name = address
+        self.address = address
+        self.token = token
+        self.timeout_slack = timeout_slack
+        # Updated from the worker's /health
+        self.capacity = 1
+        self.active = 0
+        self.healthy = True
+
+    async def check(self) -> None:
+        try:
+            status, body = await asyncio.wait_for(self._request("GET", "/health"), 5)
+            health = json.loads(body)
+            if status != 200:
+                raise WorkerError(f"status {status}")
+            self.capacity = max(int(health["capacity"]), 1)
+        except (asyncio.TimeoutError, WorkerError, ValueError, KeyError) as e:
+            if self.healthy:
+                logger.warning("Worker %s is unhealthy: %s", self.name, e)
+            self.healthy = False
+            return
+        if not self.healthy:
+            logger.info("Worker %s is healthy again", self.name)
+        self.healthy = True
+
+    async def execute(
+        self,
+        code: str,
+        limits: Limits,
+        seed: int | None = None,
+        on_stdout: Callable[[bytes], None] | None = None,
+    ) -> ExecutionResult:
+        payload = {"code": code, "seed": seed, **asdict(limits)}
+        try:
+            status, body = await asyncio.wait_for(
+                self._request("POST", "/run", json.dumps(payload).encode()),
+                timeout=limits.timeout + self.timeout_slack,
+            )
+        except asyncio.TimeoutError:
+            raise WorkerError(f"Worker {self.name} did not answer in time") from None
+        if status == 429:
+            raise WorkerBusy(f"Worker {self.name} is busy")
+        if status != 200:
+            raise WorkerError(f"Worker {self.name} returned status {status}")
+        try:
+            data = json.loads(body)
+            usage = data.pop("usage")
+            result = ExecutionResult(
+                **data, usage=ResourceUsage(**usage) if usage is not None else None
+            )
+        except (ValueError, TypeError, KeyError) as e:
+            raise WorkerError(f"Invalid response from worker {self.name}: {e}") from None
+        # Remote output arrives in one piece
+        if on_stdout is not None and result.stdout:
+            on_stdout(result.stdout.encode("utf-8"))
+        return result
+
+    async def _request(self, method: str, path: str, body: bytes = b"") -> tuple[int, bytes]:
+        # Minimal HTTP/1.1 client: one request per connection
+        try:
+            if self.address.startswith("unix:"):
+                reader, writer = await asyncio.open_unix_connection(self.address[5:])
+                host = "localhost"
+            else:
+                url = urlsplit(self.address)
+                reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                host = url.netloc
+                path = url.path.rstrip("/") + path
+        except OSError as e:
+            raise WorkerError(f"Cannot connect to worker {self.name}: {e}") from None
+
+        headers = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {host}",
+            "Connection: close",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+        ]
+        if self.token:
+            headers.append(f"Authorization: Bearer {self.token}")
+        try:
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+            length = None
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            data = await reader.readexactly(length) if length is not None else await reader.read()
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+            # Includes the worker dying mid-request
+            raise WorkerError(f"Worker {self.name} failed: {e!r}") from None
+        finally:
+            writer.close()
+        return status, data
+
+
+class WorkerPool:
+    # Dispatches each execution to the healthy worker with the lowest load,
+    # retrying on the next one when a worker fails or is busy. Only failures
+    # take a worker out of rotation until its next health check.
+
+    def __init__(self, workers: list["LocalWorker | RemoteWorker"], health_interval: int = 10):
+        self.workers = workers
+        self.health_interval = health_interval
+        self.dispatched = 0
+        self.retried = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._health_loop())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def check(self) -> None:
+        await asyncio.gather(*(worker.check() for worker in self.workers))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.health_interval)
+
+    def _pick(self, exclude: list) -> "LocalWorker | RemoteWorker | None":
+        candidates = [w for w in self.workers if w.healthy and w not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda w: w.active / w.capacity)
+
+    async def execute(
+        self,
+        code: str,
+        limits: Limits,
+        seed: int | None = None,
+        on_stdout: Callable[[bytes], None] | None = None,
+    ) -> ExecutionResult:
+        tried = []
+        while (worker := self._pick(tried)) is not None:
+            tried.append(worker)
+            worker.active += 1
+            self.dispatched += 1
+            try:
+                return await worker.execute(code, limits, seed, on_stdout)
+            except WorkerBusy:
+                self.retried += 1
+            except WorkerError as e:
+                logger.warning("%s, retrying on another worker", e)
+                worker.healthy = False
+                self.retried += 1
+            finally:
+                worker.active -= 1
+        raise WorkerError("No worker available")
+
+    def stats(self) -> dict:
+        return {
+            "dispatched": self.dispatched,
+            "retried": self.retried,
+            "workers": [
+                {
+                    "name": w.name,
+                    "healthy": w.healthy,
+                    "active": w.active,
+                    "capacity": w.capacity,
+                }
+                for w in self.workers
+            ],
+        }
@@ -1,4 +1,3 @@
-import asyncio
 import shutil
 import sys
 from pathlib import Path
@@ -7,7 +6,7 @@ from unittest.mock import patch
 import pytest
 
 from app.config import Settings
-from app.executor import ExecutionResult, wrap_magma_code
+from app.executor import ExecutionResult, run_process, spawn_process, wrap_magma_code
 
 FAKE_MAGMA = str(Path(__file__).parent / "fake_magma.py")
 
@@ -15,32 +14,14 @@ FAKE_MAGMA = str(Path(__file__).parent / "fake_magma.py")
 HAS_MAGMA = shutil.which("magma") is not None
 
 
-async def _execute_with_fake_magma(code: str, settings: Settings) -> ExecutionResult:
+async def _execute_with_fake_magma(
+    code: str, settings: Settings, on_stdout=None, seed=None, limits=None, **kwargs
+) -> ExecutionResult:
     """Run code through fake_magma.py instead of nsjail + real Magma."""
-    wrapped = wrap_magma_code(code, settings.magma_timeout)
-
-    proc = await asyncio.create_subprocess_exec(
-        sys.executable, FAKE_MAGMA,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-
-    try:
-        stdout_bytes, stderr_bytes = await asyncio.wait_for(
-            proc.communicate(input=wrapped.encode("utf-8")),
-            timeout=settings.magma_timeout + 2,
-        )
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.wait()
-        return ExecutionResult(stdout="", stderr="Killed", exit_code=-1)
-
-    return ExecutionResult(
-        stdout=stdout_bytes.decode("utf-8", errors="replace"),
-        stderr=stderr_bytes.decode("utf-8", errors="replace"),
-        exit_code=proc.returncode or 0,
-    )
+    limits = limits or settings.default_limits
+    wrapped = wrap_magma_code(code, limits.timeout, seed)
+    proc = await spawn_process([sys.executable, FAKE_MAGMA])
+    return await run_process(proc, wrapped, settings, on_stdout, limits)
 
 
 @pytest.fixture
@@ -52,32 +33,14 @@ def fake_magma():
         yield TestClient(app)
 
 
-async def _execute_with_real_magma(code: str, settings: Settings) -> ExecutionResult:
+async def _execute_with_real_magma(
+    code: str, settings: Settings, on_stdout=None, seed=None, limits=None, **kwargs
+) -> ExecutionResult:
     """Run code through real Magma binary (without nsjail)."""
-    wrapped = wrap_magma_code(code, settings.magma_timeout)
-
-    proc = await asyncio.create_subprocess_exec(
-        "magma", "-w", "-n",
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-
-    try:
-        stdout_bytes, stderr_bytes = await asyncio.wait_for(
-            proc.communicate(input=wrapped.encode("utf-8")),
-            timeout=settings.magma_timeout + 2,
-        )
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.wait()
-        return ExecutionResult(stdout="", stderr="Killed", exit_code=-1)
-
-    return ExecutionResult(
-        stdout=stdout_bytes.decode("utf-8", errors="replace"),
-        stderr=stderr_bytes.decode("utf-8", errors="replace"),
-        exit_code=proc.returncode or 0,
-    )
+    limits = limits or settings.default_limits
+    wrapped = wrap_magma_code(code, limits.timeout, seed)
+    proc = await spawn_process(["magma", "-w", "-n"])
+    return await run_process(proc, wrapped, settings, on_stdout, limits)
 
 
 @pytest.fixture
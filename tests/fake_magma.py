@@ -9,8 +9,10 @@ Mimics Magma's I/O behavior when run with piped stdin and -n flag:
 NOTE: Uses eval() intentionally — this is a test-only script that simulates
 a computer algebra system. It is never exposed to untrusted input.
 """
+import os
 import random
 import re
+import signal
 import sys
 import time
 from datetime import datetime
@@ -19,6 +21,8 @@ from datetime import datetime
 SEED = random.randint(1, 2**32 - 1)
 VERSION = random.choice(["2.28-1", "2.29-3", "2.29-5"])
 HOSTNAME = random.choice(["fake", "test", "mock"])
+# Print output as soon as it is produced, as Magma does in a live session
+INTERACTIVE = "--interactive" in sys.argv
 
 
 def make_banner() -> str:
@@ -29,7 +33,8 @@ def make_banner() -> str:
 def make_footer(elapsed: float, memory_mb: float) -> str:
     return f"Total time: {elapsed:.3f} seconds, Total memory usage: {memory_mb:.2f}MB"
 
-_RE_ALARM = re.compile(r"^Alarm\(\d+\);$")
+_RE_ALARM = re.compile(r"^Alarm\((\d+)\);$")
+_RE_SET_SEED = re.compile(r"^SetSeed\((\d+)\);$")
 _RE_ASSIGN = re.compile(r"^(\w+)\s*:=\s*(.+);$")
 _RE_PRINT = re.compile(r"^print\s+(.+);$")
 
@@ -48,7 +53,23 @@ def main() -> None:
     output_lines: list[str] = []
     start_time = time.time()
 
-    print(make_banner())
+    def on_alarm(signum, frame):
+        # Like Magma's Alarm(): output so far is kept, then the process dies
+        for out in output_lines:
+            print(out)
+        sys.stdout.flush()
+        sys.stderr.write("Alarm clock\n")
+        os._exit(142)
+
+    signal.signal(signal.SIGALRM, on_alarm)
+
+    def emit(out: str) -> None:
+        if INTERACTIVE:
+            print(out, flush=True)
+        else:
+            output_lines.append(out)
+
+    print(make_banner(), flush=INTERACTIVE)
 
     for line in sys.stdin:
         line = line.strip()
@@ -56,12 +77,19 @@ def main() -> None:
         if not line or line == ";":
             continue
 
-        if _RE_ALARM.match(line):
+        m = _RE_ALARM.match(line)
+        if m:
+            signal.alarm(int(m.group(1)))
             continue
 
         if line == "SetIgnorePrompt(true);":
             continue
 
+        m = _RE_SET_SEED.match(line)
+        if m:
+            random.seed(int(m.group(1)))
+            continue
+
         if line == "quit;":
             elapsed = time.time() - start_time
             memory_mb = random.uniform(10.0, 50.0)
@@ -81,24 +109,24 @@ def main() -> None:
             try:
                 env[name] = evaluate(expr)
             except Exception as e:
-                output_lines.append(f"User error: {e}")
+                emit(f"User error: {e}")
             continue
 
         m = _RE_PRINT.match(line)
         if m:
             expr = m.group(1)
             try:
-                output_lines.append(str(evaluate(expr)))
+                emit(str(evaluate(expr)))
             except Exception as e:
-                output_lines.append(f"User error: {e}")
+                emit(f"User error: {e}")
             continue
 
         # Unrecognized line — try to evaluate
         try:
             result = evaluate(line.rstrip(";"))
-            output_lines.append(str(result))
+            emit(str(result))
         except Exception as e:
-            output_lines.append(f"User error: {e}")
+            emit(f"User error: {e}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+import asyncio
+from collections import deque
+
+from app.adaptive import AdaptiveLimiter, read_mem_available, read_pressure
+from app.admission import AdmissionQueue
+
+MB = 1024 * 1024
+
+
+def _host(tmp_path, cpu=0.0, memory=0.0, available_mb=8000):
+    pressure = tmp_path / "pressure"
+    pressure.mkdir(exist_ok=True)
+    (pressure / "cpu").write_text(
+        f"some avg10={cpu:.2f} avg60=0.00 avg300=0.00 total=0\n"
+        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+    )
+    (pressure / "memory").write_text(
+        f"some avg10={memory:.2f} avg60=0.00 avg300=0.00 total=0\n"
+        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+    )
+    (tmp_path / "meminfo").write_text(
+        f"MemTotal:       16000000 kB\nMemAvailable:   {available_mb * 1024} kB\n"
+    )
+
+
+def _limiter(tmp_path, queue, max_limit=8):
+    return AdaptiveLimiter(
+        queue,
+        min_limit=2,
+        max_limit=max_limit,
+        cpu_pressure=40,
+        memory_pressure=10,
+        memory_reserve=1024 * MB,
+        pressure_dir=str(tmp_path / "pressure"),
+        meminfo=str(tmp_path / "meminfo"),
+    )
+
+
+def test_read_host_signals(tmp_path):
+    _host(tmp_path, cpu=12.5, available_mb=2048)
+    assert read_pressure(str(tmp_path / "pressure" / "cpu")) == 12.5
+    assert read_mem_available(str(tmp_path / "meminfo")) == 2048 * MB
+    assert read_pressure(str(tmp_path / "missing")) is None
+
+
+def test_cpu_pressure_cuts_limit(tmp_path):
+    _host(tmp_path, cpu=75)
+    queue = AdmissionQueue(8, max_queue=4, max_per_client=4, max_wait=1)
+    limiter = _limiter(tmp_path, queue)
+    limiter.tick()
+    assert limiter.limit == 6
+    assert queue.stats()["limit"] == 6
+    # Cuts are spaced out so PSI can react
+    limiter.tick()
+    assert limiter.limit == 6
+    limiter._last_decrease -= 10
+    limiter.tick()
+    assert limiter.limit == 4
+    assert [h["reason"] for h in limiter.stats()["history"]] == ["cpu pressure"] * 2
+
+
+def test_low_memory_cuts_limit_to_minimum(tmp_path):
+    _host(tmp_path, available_mb=500)
+    limiter = _limiter(tmp_path, AdmissionQueue(2, 4, 4, 1), max_limit=2)
+    limiter.tick()
+    assert limiter.limit == 2
+    assert limiter.stats()["signals"]["mem_available_mb"] == 500
+
+
+def test_limit_grows_back_under_demand(tmp_path):
+    async def run():
+        _host(tmp_path, cpu=90)
+        queue = AdmissionQueue(8, max_queue=4, max_per_client=4, max_wait=1)
+        limiter = _limiter(tmp_path, queue)
+        limiter.tick()
+        limiter._last_decrease -= 10
+        limiter.tick()
+        assert limiter.limit == 4
+
+        tickets = [await queue.acquire(f"c{i}") for i in range(4)]
+        waiter = asyncio.create_task(queue.acquire("c4"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        # Pressure gone and a request waiting: one more slot
+        _host(tmp_path, cpu=1)
+        limiter.tick()
+        ticket = await asyncio.wait_for(waiter, 1)
+        for t in tickets + [ticket]:
+            t.release()
+        # No demand, no growth
+        limiter.tick()
+        return limiter.limit
+
+    assert asyncio.run(run()) == 5
+
+
+def test_latency_is_judged_against_each_jobs_prediction(tmp_path):
+    _host(tmp_path)
+    queue = AdmissionQueue(8, max_queue=4, max_per_client=4, max_wait=1)
+    limiter = _limiter(tmp_path, queue)
+    # Many short jobs and then a long one, each taking its usual time
+    for _ in range(50):
+        limiter.observe(0.1, 0.1)
+    limiter.observe(60, 58)
+    limiter.tick()
+    assert limiter.limit == 8
+    assert limiter.stats()["signals"]["latency_ratio"] < 1.1
+
+    # Jobs taking three times as long as they usually do
+    for _ in range(100):
+        limiter.observe(30, 10)
+    limiter.tick()
+    assert limiter.limit == 6
+    assert limiter.stats()["history"][-1]["reason"] == "latency"
+
+    # Old runs drop out of the window
+    limiter._slowdowns = deque((t - 61, s) for t, s in limiter._slowdowns)
+    limiter.tick()
+    assert limiter.stats()["signals"]["latency_ratio"] is None
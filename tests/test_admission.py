@@ -0,0 +1,338 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionError, AdmissionQueue, MemoryBudgetError
+
+
+def _queue(slots=1, max_queue=4, max_per_client=2, max_wait=5.0):
+    return AdmissionQueue(slots, max_queue, max_per_client, max_wait)
+
+
+def test_admits_up_to_slot_count():
+    async def run():
+        queue = _queue(slots=2)
+        first = await queue.acquire("a")
+        second = await queue.acquire("b")
+        assert queue.stats()["active"] == 2
+        first.release()
+        first.release()  # idempotent
+        second.release()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+
+
+def test_rejects_when_queue_full():
+    async def run():
+        queue = _queue(slots=1, max_queue=1)
+        ticket = await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionError) as exc:
+            await queue.acquire("c")
+        assert exc.value.retry_after >= 1
+        ticket.release()
+        (await waiter).release()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["rejected"] == 1
+    assert stats["admitted"] == 2
+
+
+def test_per_client_queue_cap():
+    async def run():
+        queue = _queue(slots=1, max_queue=10, max_per_client=1)
+        ticket = await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionError):
+            await queue.acquire("b")
+        other = asyncio.create_task(queue.acquire("c"))
+        await asyncio.sleep(0)
+        assert queue.stats()["queued"] == 2
+        ticket.release()
+        (await waiter).release()
+        (await other).release()
+
+    asyncio.run(run())
+
+
+def test_round_robin_between_clients():
+    async def run():
+        queue = _queue(slots=1, max_queue=10, max_per_client=5)
+        ticket = await queue.acquire("x")
+        order = []
+
+        async def request(client, tag):
+            async with queue.slot(client):
+                order.append(tag)
+                await asyncio.sleep(0)
+
+        tasks = [
+            asyncio.create_task(request("a", "a1")),
+            asyncio.create_task(request("a", "a2")),
+            asyncio.create_task(request("a", "a3")),
+            asyncio.create_task(request("b", "b1")),
+            asyncio.create_task(request("b", "b2")),
+        ]
+        await asyncio.sleep(0)
+        ticket.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_waiter_dropped_after_deadline():
+    async def run():
+        queue = _queue(slots=1, max_wait=0.05)
+        ticket = await queue.acquire("a")
+        with pytest.raises(AdmissionError):
+            await queue.acquire("b")
+        stats = queue.stats()
+        ticket.release()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["expired"] == 1
+    assert stats["queued"] == 0
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def run():
+        queue = _queue(slots=1)
+        ticket = await queue.acquire("a")
+        waiter = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        ticket.release()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["queued"] == 0
+
+
+def test_retry_after_from_service_time():
+    async def run():
+        queue = _queue(slots=2)
+        assert queue.retry_after() == 1
+        ticket = await queue.acquire("a")
+        ticket.started -= 8
+        ticket.release()
+        return queue.retry_after()
+
+    # One queued position ahead on two slots of ~8s each
+    assert asyncio.run(run()) == 5
+
+
+def _tiered(borrow=None):
+    return AdmissionQueue(
+        {"short": 1, "long": 1}, max_queue=10, max_per_client=5, max_wait=5.0,
+        borrow=borrow,
+    )
+
+
+def test_tiers_have_separate_pools():
+    async def run():
+        queue = _tiered()
+        short = await queue.acquire("a", "short")
+        long = await queue.acquire("b", "long")
+        with pytest.raises(AdmissionError):
+            queue.max_wait = 0.01
+            await queue.acquire("c", "short")
+        assert short.pool == "short" and long.pool == "long"
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["tiers"]["short"]["active"] == 1
+    assert stats["tiers"]["long"]["active"] == 1
+
+
+def test_tier_borrows_idle_slot():
+    async def run():
+        queue = _tiered(borrow={"short": ("long",)})
+        first = await queue.acquire("a", "short")
+        second = await queue.acquire("b", "short")
+        assert second.pool == "long"
+        # The lending tier's own requests wait for the borrowed slot
+        waiter = asyncio.create_task(queue.acquire("c", "long"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        second.release()
+        third = await waiter
+        assert third.pool == "long"
+        first.release()
+        third.release()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["borrowed"] == 1
+    assert stats["active"] == 0
+
+
+def test_no_borrowing_without_rule():
+    async def run():
+        queue = _tiered(borrow={"short": ("long",)})
+        queue.max_wait = 0.01
+        await queue.acquire("a", "long")
+        with pytest.raises(AdmissionError):
+            await queue.acquire("b", "long")
+
+    asyncio.run(run())
+
+
+def test_memory_budget_packs_small_jobs():
+    async def run():
+        queue = AdmissionQueue(8, max_queue=4, max_per_client=4, max_wait=5, memory_budget=1000)
+        large = await queue.acquire("a", memory_mb=600)
+        small = [await queue.acquire("b", memory_mb=200) for _ in range(2)]
+        assert queue.stats()["memory_committed_mb"] == 1000
+
+        # A slot is free but the memory is not
+        waiter = asyncio.create_task(queue.acquire("c", memory_mb=100))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        small[0].release()
+        await asyncio.wait_for(waiter, 1)
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 3
+    assert stats["memory_committed_mb"] == 900
+
+
+def test_memory_budget_stops_backfill_for_starving_job():
+    async def run():
+        queue = AdmissionQueue(8, max_queue=4, max_per_client=4, max_wait=5, memory_budget=1000)
+        running = [await queue.acquire("a", memory_mb=400) for _ in range(2)]
+        large = asyncio.create_task(queue.acquire("b", memory_mb=800))
+        await asyncio.sleep(0)
+
+        # Small jobs may overtake the large one at first
+        small = await asyncio.wait_for(queue.acquire("c", memory_mb=100), 1)
+        small.release()
+
+        queue._queues["b"][0].queued_at -= 6
+        late = asyncio.create_task(queue.acquire("d", memory_mb=100))
+        await asyncio.sleep(0)
+        assert not late.done()
+
+        for ticket in running:
+            ticket.release()
+        await asyncio.wait_for(large, 1)
+        await asyncio.sleep(0)
+        return late.done(), queue.stats()
+
+    late_done, stats = asyncio.run(run())
+    assert late_done is True
+    assert stats["memory_committed_mb"] == 900
+
+
+def test_memory_request_over_budget_rejected():
+    async def run():
+        queue = AdmissionQueue(2, max_queue=4, max_per_client=4, max_wait=5, memory_budget=500)
+        with pytest.raises(MemoryBudgetError):
+            await queue.acquire("a", memory_mb=600)
+        assert queue.fits_budget(500) and not queue.fits_budget(600)
+
+    asyncio.run(run())
+
+
+def test_shortest_declared_job_first():
+    async def run():
+        queue = AdmissionQueue(1, max_queue=10, max_per_client=5, max_wait=5)
+        ticket = await queue.acquire("x")
+        order = []
+
+        async def request(client, expected):
+            async with queue.slot(client, expected_sec=expected):
+                order.append(client)
+                await asyncio.sleep(0)
+
+        tasks = [
+            asyncio.create_task(request("long", 120)),
+            asyncio.create_task(request("medium", 30)),
+            asyncio.create_task(request("short", 1)),
+        ]
+        await asyncio.sleep(0)
+        ticket.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["short", "medium", "long"]
+
+
+def test_waiting_ages_long_jobs():
+    async def run():
+        queue = AdmissionQueue(1, max_queue=10, max_per_client=5, max_wait=60)
+        ticket = await queue.acquire("x")
+        order = []
+
+        async def request(client, expected):
+            async with queue.slot(client, expected_sec=expected):
+                order.append(client)
+                await asyncio.sleep(0)
+
+        long = asyncio.create_task(request("long", 120))
+        await asyncio.sleep(0)
+        # 30 seconds of waiting outweigh 120 declared seconds
+        queue._queues["long"][0].queued_at -= 30
+        short = asyncio.create_task(request("short", 1))
+        await asyncio.sleep(0)
+        ticket.release()
+        await asyncio.gather(long, short)
+        return order
+
+    assert asyncio.run(run()) == ["long", "short"]
+
+
+def test_try_acquire_only_takes_idle_slots():
+    async def run():
+        queue = _queue(slots=2)
+        first = queue.try_acquire()
+        second = queue.try_acquire()
+        assert first is not None and second is not None
+        assert queue.try_acquire() is None
+        # A free slot goes to the waiter, not to try_acquire
+        waiter = asyncio.create_task(queue.acquire("a"))
+        await asyncio.sleep(0)
+        first.release()
+        assert queue.try_acquire() is None
+        (await waiter).release()
+        second.release()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 3
+
+
+def test_equal_declared_times_keep_round_robin():
+    async def run():
+        queue = AdmissionQueue(1, max_queue=10, max_per_client=5, max_wait=60)
+        ticket = await queue.acquire("x")
+        order = []
+
+        async def request(client):
+            async with queue.slot(client, expected_sec=120):
+                order.append(client)
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.create_task(request("a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        for waiter in queue._queues["a"]:
+            waiter.queued_at -= 1.5
+        tasks.append(asyncio.create_task(request("b")))
+        await asyncio.sleep(0)
+        ticket.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["a", "b", "a", "a"]
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.breaker import CircuitBreaker, CircuitOpenError, startup_failed
+from app.executor import ExecutionResult, ResourceUsage
+
+GOOD = ExecutionResult(
+    stdout="Magma V2.29-4     Fri Jan 31 2026 [Seed = 42]\nquit.\n2\n", stderr="", exit_code=0
+)
+BROKEN = ExecutionResult(stdout="", stderr="magma: cannot open licence file\n", exit_code=1)
+
+
+def test_startup_failed():
+    assert startup_failed(GOOD) is False
+    assert startup_failed(BROKEN) is True
+    # nsjail cannot create the namespaces
+    assert startup_failed(ExecutionResult(
+        stdout="", stderr="[E][2026-01-31T00:00:00+0000] clone(flags=...) failed\n", exit_code=255
+    )) is True
+    # Limits hit before the banner was flushed are not startup failures
+    assert startup_failed(ExecutionResult(stdout="", stderr="Killed", exit_code=-1)) is False
+    assert startup_failed(ExecutionResult(
+        stdout="", stderr="", exit_code=137, usage=ResourceUsage(1.0, oom_killed=True)
+    )) is False
+
+
+def test_breaker_opens_and_probe_closes():
+    probe_results = [BROKEN, GOOD]
+
+    async def probe():
+        return probe_results.pop(0)
+
+    async def run():
+        breaker = CircuitBreaker(threshold=3, probe_interval=0.01, probe=probe)
+        breaker.record(BROKEN)
+        breaker.record(BROKEN)
+        breaker.record(GOOD)
+        assert not breaker.is_open
+
+        for _ in range(3):
+            breaker.record(BROKEN)
+        assert breaker.is_open
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+
+        for _ in range(100):
+            if not breaker.is_open:
+                break
+            await asyncio.sleep(0.01)
+        breaker.check()
+        return breaker.stats()
+
+    stats = asyncio.run(run())
+    assert stats["open"] is False
+    assert stats["trips"] == 1
+    assert stats["probes"] == 2
+
+
+def test_breaker_disabled():
+    async def run():
+        breaker = CircuitBreaker(threshold=0, probe_interval=1, probe=None)
+        for _ in range(10):
+            breaker.record(BROKEN)
+        return breaker.is_open
+
+    assert asyncio.run(run()) is False
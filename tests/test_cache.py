@@ -0,0 +1,108 @@
+import json
+import os
+import time
+
+from app.cache import ResultCache, is_cacheable
+
+LIMITS = (120, 120, 400, 20)
+
+
+def _response(stdout="2\n", version="2.29-4", success=True):
+    return {
+        "success": success,
+        "stdout": stdout,
+        "exit_code": 0,
+        "truncated": False,
+        "magma": {"version": version, "seed": 1, "time_sec": 0.01, "memory": "1.00MB"},
+        "warnings": [],
+    }
+
+
+def test_is_cacheable():
+    assert is_cacheable("print 1+1;", None) is True
+    assert is_cacheable("print Random(10);", None) is False
+    assert is_cacheable("print RandomPrime(10);", None) is False
+    assert is_cacheable("print random{1..6};", None) is False
+    assert is_cacheable("print random(S);", None) is False
+    assert is_cacheable("print random{1..6};", 7) is True
+    assert is_cacheable("print Random(10);", 42) is True
+
+
+def test_hit_after_put():
+    cache = ResultCache(1024 * 1024, ttl=60)
+    assert cache.get("print 1+1;", None, LIMITS) is None
+    cache.put("print 1+1;", None, LIMITS, _response())
+    assert cache.get("print 1+1;", None, LIMITS) == _response()
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_key_includes_limits_and_seed():
+    cache = ResultCache(1024 * 1024, ttl=60)
+    cache.put("print 1;", 5, LIMITS, _response())
+    assert cache.get("print 1;", 5, LIMITS) is not None
+    assert cache.get("print 1;", 6, LIMITS) is None
+    assert cache.get("print 1;", 5, (60, 60, 400, 20)) is None
+
+
+def test_failed_and_seed_dependent_runs_not_stored():
+    cache = ResultCache(1024 * 1024, ttl=60)
+    cache.put("print x;", None, LIMITS, _response(success=False))
+    cache.put("print Random(5);", None, LIMITS, _response())
+    assert cache.stats()["stores"] == 0
+    assert cache.get("print Random(5);", None, LIMITS) is None
+    assert cache.stats()["skipped"] == 1
+
+
+def test_version_change_invalidates():
+    cache = ResultCache(1024 * 1024, ttl=60)
+    cache.put("print 1;", None, LIMITS, _response(version="2.28-1"))
+    assert cache.get("print 1;", None, LIMITS) is not None
+    cache.put("print 2;", None, LIMITS, _response(version="2.29-4"))
+    assert cache.get("print 1;", None, LIMITS) is None
+
+
+def test_lru_eviction_by_size():
+    size = len(json.dumps(_response("a" * 100)))
+    cache = ResultCache(2 * size, ttl=60)
+    cache.put("a;", None, LIMITS, _response("a" * 100))
+    cache.put("b;", None, LIMITS, _response("b" * 100))
+    cache.get("a;", None, LIMITS)
+    cache.put("c;", None, LIMITS, _response("c" * 100))
+    assert cache.get("b;", None, LIMITS) is None
+    assert cache.get("a;", None, LIMITS) is not None
+    assert cache.get("c;", None, LIMITS) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry():
+    cache = ResultCache(1024 * 1024, ttl=60)
+    cache.put("print 1;", None, LIMITS, _response())
+    key = next(iter(cache._entries))
+    stored_at, data = cache._entries[key]
+    cache._entries[key] = (stored_at - 61, data)
+    assert cache.get("print 1;", None, LIMITS) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = ResultCache(1024 * 1024, ttl=60, directory=str(tmp_path))
+    cache.put("print 1;", None, LIMITS, _response())
+
+    restarted = ResultCache(1024 * 1024, ttl=60, directory=str(tmp_path))
+    assert restarted.version == "2.29-4"
+    assert restarted.get("print 1;", None, LIMITS) == _response()
+    assert restarted.stats()["disk_hits"] == 1
+    # Promoted to memory
+    assert restarted.get("print 1;", None, LIMITS) is not None
+    assert restarted.stats()["hits"] == 1
+
+
+def test_prune_removes_expired_disk_entries(tmp_path):
+    cache = ResultCache(1024 * 1024, ttl=60, directory=str(tmp_path))
+    cache.put("print 1;", None, LIMITS, _response())
+    (path,) = tmp_path.glob("*.json")
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    cache.prune()
+    assert not path.exists()
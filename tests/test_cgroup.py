@@ -0,0 +1,134 @@
+import asyncio
+import sys
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.cgroup import CpuAllocator, JobCgroup, parse_cpus
+from app.executor import collect_usage, spawn_process
+
+
+def test_job_cgroup_sets_limits(tmp_path):
+    cgroup = JobCgroup(str(tmp_path), 400 * 1024 * 1024)
+    assert cgroup.path.parent == tmp_path
+    assert (cgroup.path / "memory.max").read_text() == str(400 * 1024 * 1024)
+    assert (cgroup.path / "memory.swap.max").read_text() == "0"
+    assert (cgroup.path / "memory.oom.group").read_text() == "1"
+
+
+def test_job_cgroup_reads_usage(tmp_path):
+    cgroup = JobCgroup(str(tmp_path), 1024)
+    (cgroup.path / "cpu.stat").write_text(
+        "usage_usec 1250000\nuser_usec 1000000\nsystem_usec 250000\n"
+    )
+    (cgroup.path / "memory.peak").write_text("35651584\n")
+    (cgroup.path / "memory.events").write_text(
+        "low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\noom_group_kill 1\n"
+    )
+    assert cgroup.cpu_sec() == 1.25
+    assert cgroup.peak_memory_bytes() == 35651584
+    assert cgroup.oom_killed() is True
+
+
+def test_job_cgroup_missing_files(tmp_path):
+    # Older kernels have no memory.peak
+    cgroup = JobCgroup(str(tmp_path), 1024)
+    assert cgroup.cpu_sec() is None
+    assert cgroup.peak_memory_bytes() is None
+    assert cgroup.oom_killed() is False
+
+
+def test_collect_usage_kills_and_removes_cgroup(tmp_path):
+    cgroup = JobCgroup(str(tmp_path), 1024)
+    (cgroup.path / "cpu.stat").write_text("usage_usec 500000\n")
+    (cgroup.path / "memory.peak").write_text("2048\n")
+
+    with patch.object(JobCgroup, "remove", new_callable=AsyncMock) as remove:
+        usage = asyncio.run(collect_usage(2.5, cgroup))
+
+    assert usage.wall_sec == 2.5
+    assert usage.cpu_sec == 0.5
+    assert usage.peak_memory_bytes == 2048
+    assert usage.oom_killed is False
+    assert (cgroup.path / "cgroup.kill").read_text() == "1"
+    remove.assert_awaited_once()
+
+
+def test_job_cgroup_remove(tmp_path):
+    cgroup = JobCgroup(str(tmp_path), 1024)
+    # The kernel removes a cgroup's interface files together with the directory
+    for path in cgroup.path.iterdir():
+        path.unlink()
+    asyncio.run(cgroup.remove())
+    assert not cgroup.path.exists()
+
+
+def test_collect_usage_without_cgroup():
+    usage = asyncio.run(collect_usage(1.23456, None))
+    assert usage.wall_sec == 1.235
+    assert usage.cpu_sec is None
+    assert usage.peak_memory_bytes is None
+
+
+def test_spawn_process_joins_cgroup(tmp_path):
+    cgroup = JobCgroup(str(tmp_path), 1024)
+
+    async def run():
+        proc = await spawn_process([sys.executable, "-c", "pass"], cgroup)
+        await proc.communicate()
+
+    asyncio.run(run())
+    assert (cgroup.path / "cgroup.procs").read_text() == "0"
+
+
+def test_parse_cpus():
+    assert parse_cpus("0-3,6") == [0, 1, 2, 3, 6]
+    assert parse_cpus("5") == [5]
+    with pytest.raises(ValueError):
+        parse_cpus("")
+
+
+def test_cpu_allocator_spreads_jobs(tmp_path):
+    cpus = CpuAllocator([2, 3])
+    first = JobCgroup(str(tmp_path), 1024, cpus=cpus)
+    second = JobCgroup(str(tmp_path), 1024, cpus=cpus)
+    assert {first.cpu, second.cpu} == {2, 3}
+    assert (first.path / "cpuset.cpus").read_text() == str(first.cpu)
+
+    # With every CPU taken, jobs share the least loaded one
+    third = JobCgroup(str(tmp_path), 1024, cpus=cpus)
+    assert sorted(cpus.active.values()) == [1, 2]
+    assert third.cpu in (2, 3)
+
+    # The files a real cgroup would not let us remove
+    for path in first.path.iterdir():
+        path.unlink()
+    cpu = first.cpu
+    with patch.object(JobCgroup, "cpu_sec", return_value=2.0):
+        asyncio.run(first.remove())
+    assert not first.path.exists()
+    stats = {s["cpu"]: s for s in cpus.stats()}
+    assert stats[cpu]["cpu_sec"] == 2.0
+    assert stats[cpu]["efficiency"] is not None
+    assert sum(s["active"] for s in stats.values()) == 2
+
+
+def test_job_cgroup_pins_on_demand(tmp_path):
+    cpus = CpuAllocator([2, 3])
+    idle = JobCgroup(str(tmp_path), 1024, cpus=cpus, pin=False)
+    assert idle.cpu is None
+    assert not (idle.path / "cpuset.cpus").exists()
+    assert sum(cpus.active.values()) == 0
+
+    idle.pin()
+    idle.pin()
+    assert (idle.path / "cpuset.cpus").read_text() == str(idle.cpu)
+    assert sum(cpus.active.values()) == 1
+
+
+def test_job_cgroup_cpu_weight(tmp_path):
+    cgroup = JobCgroup(str(tmp_path), 1024, cpu_weight=400)
+    assert (cgroup.path / "cpu.weight").read_text() == "400"
+    # The default weight is left to the kernel
+    cgroup = JobCgroup(str(tmp_path), 1024)
+    assert not (cgroup.path / "cpu.weight").exists()
@@ -1,7 +1,9 @@
 import re
 from pathlib import Path
 
-from app.config import Settings
+import pytest
+
+from app.config import Limits, Settings
 
 ROOT = Path(__file__).resolve().parent.parent
 
@@ -94,3 +96,33 @@ def test_allowed_origins_list_custom(monkeypatch):
     origins = settings.allowed_origins_list
     assert "https://magma-maths.org" in origins
     assert "http://localhost" in origins
+
+
+def test_default_tier_from_settings():
+    tiers = Settings().tiers
+    assert list(tiers) == ["default"]
+    tier = tiers["default"]
+    assert tier.slots == 4
+    assert tier.limits == Limits(timeout=120, cpu_timeout=120, memory_mb=400)
+
+
+def test_execution_tiers_parsing(monkeypatch):
+    monkeypatch.setenv(
+        "EXECUTION_TIERS",
+        "short:timeout=30,slots=3,borrow=long;long:timeout=600,memory=2000,cpu_weight=50,slots=1",
+    )
+    tiers = Settings().tiers
+    assert list(tiers) == ["short", "long"]
+    assert tiers["short"].limits == Limits(timeout=30, cpu_timeout=30, memory_mb=400)
+    assert tiers["short"].slots == 3
+    assert tiers["short"].borrow == ("long",)
+    assert tiers["long"].limits == Limits(
+        timeout=600, cpu_timeout=600, memory_mb=2000, cpu_weight=50
+    )
+    assert tiers["long"].borrow == ()
+
+
+def test_execution_tiers_invalid():
+    for spec in ("short:bogus=1", "short:borrow=missing", ":slots=1"):
+        with pytest.raises(ValueError):
+            Settings(execution_tiers=spec).tiers
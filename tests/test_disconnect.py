@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from app.disconnect import ClientDisconnected, cancel_on_disconnect
+
+
+class FakeRequest:
+    def __init__(self, disconnect_after: float):
+        self.disconnect_after = disconnect_after
+
+    async def receive(self) -> dict:
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+
+def test_returns_result_while_connected():
+    async def work():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(cancel_on_disconnect(FakeRequest(10), work())) == "done"
+
+
+def test_cancels_work_on_disconnect():
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(ClientDisconnected):
+        asyncio.run(cancel_on_disconnect(FakeRequest(0.01), work()))
+    assert cancelled == [True]
+
+
+def test_errors_propagate():
+    async def work():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        asyncio.run(cancel_on_disconnect(FakeRequest(10), work()))
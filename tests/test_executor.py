@@ -1,5 +1,14 @@
-from app.executor import wrap_magma_code, ExecutionResult
-from app.config import Settings
+import asyncio
+import sys
+
+import pytest
+
+from app.executor import (
+    build_nsjail_command, execute_batch, run_process, spawn_process, wrap_batch_code,
+    wrap_magma_code, ExecutionResult, _fits_pool,
+)
+from app.config import Limits, Settings
+from tests.conftest import FAKE_MAGMA
 
 
 def test_wrap_magma_code():
@@ -16,6 +25,11 @@ def test_wrap_magma_code_custom_timeout():
     assert "Alarm(299);" in wrapped
 
 
+def test_wrap_magma_code_shortest_timeout():
+    wrapped = wrap_magma_code("x := 5;", 1)
+    assert "Alarm(1);" in wrapped
+
+
 def test_execution_result_dataclass():
     result = ExecutionResult(
         stdout="output",
@@ -24,3 +38,150 @@ def test_execution_result_dataclass():
     )
     assert result.stdout == "output"
     assert result.exit_code == 0
+
+
+def test_build_nsjail_command_idle_timeout():
+    settings = Settings()
+    cmd = build_nsjail_command(settings)
+    assert cmd[cmd.index("--time_limit") + 1] == "121"
+    cmd = build_nsjail_command(settings, idle_timeout=300)
+    assert cmd[cmd.index("--time_limit") + 1] == "421"
+    assert cmd[cmd.index("--cgroup_mem_max") + 1] == str(400 * 1024 * 1024)
+
+
+def test_run_process_kills_runaway_output():
+    settings = Settings(magma_output_kb=1)
+    endless = "import sys\nwhile True:\n    sys.stdout.write('x' * 1000)\n"
+
+    async def run():
+        proc = await spawn_process([sys.executable, "-c", endless])
+        return await run_process(proc, "", settings)
+
+    result = asyncio.run(run())
+    assert result.truncated is True
+    assert result.exit_code != 0
+    assert len(result.stdout) <= settings.magma_output_bytes + 4096
+
+
+def test_run_process_small_output_not_truncated():
+    async def run():
+        proc = await spawn_process([sys.executable, "-c", "print(input())"])
+        return await run_process(proc, "hello\n", Settings())
+
+    result = asyncio.run(run())
+    assert result.truncated is False
+    assert result.stdout == "hello\n"
+    assert result.exit_code == 0
+
+
+def test_wrap_magma_code_pinned_seed():
+    wrapped = wrap_magma_code("print Random(10);", 120, seed=42)
+    assert "SetSeed(42);\nprint Random(10);" in wrapped
+    assert "SetSeed" not in wrap_magma_code("print 1;", 120)
+
+
+def test_build_nsjail_command_with_cgroup_root():
+    # The job cgroup enforces the memory limit instead of nsjail
+    cmd = build_nsjail_command(Settings(cgroup_root="/sys/fs/cgroup/jobs"))
+    assert "--cgroup_mem_max" not in cmd
+    assert cmd[cmd.index("--rlimit_cpu") + 1] == "120"
+
+
+def test_run_process_reports_wall_time():
+    async def run():
+        proc = await spawn_process([sys.executable, "-c", "print(input())"])
+        return await run_process(proc, "hello\n", Settings())
+
+    result = asyncio.run(run())
+    assert result.usage is not None
+    assert result.usage.wall_sec > 0
+    assert result.usage.cpu_sec is None
+
+
+def test_wrap_batch_code():
+    wrapped = wrap_batch_code(["print 1;", "print 2;"], "m", 10, seed=7)
+    assert wrapped.startswith("SetIgnorePrompt(true);\n")
+    assert 'print "m 0";\nAlarm(10);\nSetSeed(7);\nprint 1;\n;\n' in wrapped
+    assert 'print "m 1";\nAlarm(10);\nSetSeed(7);\nprint 2;\n;\n' in wrapped
+    assert wrapped.endswith('print "m end";\nquit;\n')
+
+
+def test_wrap_batch_code_preamble():
+    wrapped = wrap_batch_code(["print y;"], "m", 10, preamble="y := 3;")
+    assert wrapped.startswith('SetIgnorePrompt(true);\nAlarm(10);\ny := 3;\n;\nprint "m 0";\n')
+
+
+def test_execute_batch_single_run():
+    result = asyncio.run(
+        execute_batch(["print 1+1;", "x := 5;", "print x*2;"], Settings(), 10,
+                      cmd=[sys.executable, FAKE_MAGMA])
+    )
+    assert len(result.runs) == 1
+    assert [item.stdout for item in result.items] == ["2\n", "", "10\n"]
+    assert all(item.exit_code == 0 for item in result.items)
+
+
+def test_execute_batch_restarts_after_timeout():
+    result = asyncio.run(
+        execute_batch(["print 1;", "while true do end while;", "print 3;"], Settings(), 1,
+                      cmd=[sys.executable, FAKE_MAGMA])
+    )
+    assert len(result.runs) == 2
+    first, stuck, last = result.items
+    assert first.stdout == "1\n" and first.exit_code == 0
+    assert stuck.exit_code != 0
+    assert "Alarm clock" in stuck.stderr
+    assert last.stdout == "3\n" and last.exit_code == 0
+
+
+def test_execute_batch_reruns_preamble_after_restart():
+    result = asyncio.run(
+        execute_batch(["print y;", "while true do end while;", "print y+1;"], Settings(), 1,
+                      cmd=[sys.executable, FAKE_MAGMA], preamble="y := 3;")
+    )
+    assert len(result.runs) == 2
+    assert [item.stdout for item in result.items] == ["3\n", "", "4\n"]
+
+
+def test_execute_batch_stops_at_tier_timeout():
+    # Each stuck item takes its 1s Alarm; the tier's 2s leave no room for a third run
+    result = asyncio.run(
+        execute_batch(["while true do end while;"] * 3, Settings(), 1,
+                      limits=Limits(timeout=2, cpu_timeout=2, memory_mb=512),
+                      cmd=[sys.executable, FAKE_MAGMA])
+    )
+    assert 1 <= len(result.items) < 3
+    assert len(result.runs) == len(result.items)
+    assert all(item.exit_code != 0 for item in result.items)
+
+
+def test_execute_batch_one_second_limit_runs():
+    result = asyncio.run(
+        execute_batch(["print 1;", "print 2;"], Settings(), 1,
+                      limits=Limits(timeout=1, cpu_timeout=1, memory_mb=512),
+                      cmd=[sys.executable, FAKE_MAGMA])
+    )
+    assert len(result.runs) == 1
+    assert [item.stdout for item in result.items] == ["1\n", "2\n"]
+
+
+def test_run_process_cancel_kills_process():
+    async def run():
+        proc = await spawn_process([sys.executable, "-c", "import time; time.sleep(60)"])
+        task = asyncio.create_task(run_process(proc, "", Settings()))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(proc.wait(), 2)
+        return proc.returncode
+
+    assert asyncio.run(run()) == -9
+
+
+def test_shorter_timeout_fits_warm_pool():
+    pool_limits = Limits(timeout=120, cpu_timeout=120, memory_mb=400)
+    assert _fits_pool(Limits(5, 5, 400), pool_limits)
+    assert _fits_pool(pool_limits, pool_limits)
+    assert not _fits_pool(Limits(5, 5, 100), pool_limits)
+    assert not _fits_pool(Limits(600, 600, 400), pool_limits)
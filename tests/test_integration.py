@@ -4,6 +4,7 @@ These exercise the full pipeline: FastAPI → executor → subprocess → parser
 - fake_magma tests use fake_magma.py (always runs)
 - real_magma tests use the real Magma binary (skipped if not available)
 """
+import json
 
 
 def test_simple_arithmetic(fake_magma):
@@ -71,6 +72,22 @@ def test_empty_code(fake_magma):
     assert data["stdout"] == ""
 
 
+def test_stream_chunks_match_result(fake_magma):
+    resp = fake_magma.post("/execute/stream", json={"code": "print 1;\nprint 2;"})
+    assert resp.status_code == 200
+    streamed = ""
+    result = None
+    for block in resp.text.strip().split("\n\n"):
+        event, data = (line.split(": ", 1)[1] for line in block.splitlines())
+        if event == "stdout":
+            streamed += json.loads(data)["text"]
+        else:
+            assert event == "result"
+            result = json.loads(data)
+    assert result["success"] is True
+    assert streamed == result["stdout"] == "1\n2\n"
+
+
 # --- Real Magma tests (skipped if Magma not installed) ---
 
 
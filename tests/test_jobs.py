@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+import time
+
+from app.jobs import JobRunner, JobStore
+
+
+def test_store_lifecycle(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+    job = store.create("print 1;", None, "1.2.3.4")
+    assert job["status"] == "queued"
+    assert job["queued_at"] is not None
+    assert job["started_at"] is None
+
+    store.mark_running(job["id"])
+    assert store.get(job["id"])["status"] == "running"
+
+    store.finish(job["id"], {"success": True, "stdout": "1\n"})
+    finished = store.get(job["id"])
+    assert finished["status"] == "finished"
+    assert finished["result"] == {"success": True, "stdout": "1\n"}
+    assert finished["queued_at"] <= finished["started_at"] <= finished["finished_at"]
+    assert store.counts() == {"queued": 0, "running": 0, "finished": 1}
+
+
+def test_store_adds_missing_columns(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+        "client_ip TEXT NOT NULL, code TEXT NOT NULL, seed INTEGER, queued_at REAL NOT NULL, "
+        "started_at REAL, finished_at REAL, result TEXT)"
+    )
+    db.execute(
+        "INSERT INTO jobs (id, status, client_ip, code, queued_at) "
+        "VALUES ('old', 'queued', '1.2.3.4', 'print 1;', 0)"
+    )
+    db.commit()
+    db.close()
+
+    store = JobStore(path, ttl=60)
+    old = store.get("old")
+    assert old["tier"] == "default"
+    assert old["memory_mb"] is None and old["time_limit"] is None
+    assert old["profile"] == 0 and old["segments"] == 0
+    job = store.create("print 2;", None, "1.2.3.4", tier="long", segments=True)
+    assert job["tier"] == "long" and job["segments"] == 1
+
+
+def test_store_requeues_interrupted_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(path, ttl=60)
+    running = store.create("print 1;", None, "1.2.3.4")
+    queued = store.create("print 2;", 5, "1.2.3.4")
+    store.mark_running(running["id"])
+
+    restarted = JobStore(path, ttl=60)
+    assert restarted.queued() == [running["id"], queued["id"]]
+    assert restarted.get(queued["id"])["seed"] == 5
+
+
+def test_store_cleanup_removes_expired(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+    old = store.create("print 1;", None, "1.2.3.4")
+    store.finish(old["id"], {"success": True})
+    store._db.execute(
+        "UPDATE jobs SET finished_at = ? WHERE id = ?", (time.time() - 120, old["id"])
+    )
+    fresh = store.create("print 2;", None, "1.2.3.4")
+    assert store.cleanup() == 1
+    assert store.get(old["id"]) is None
+    assert store.get(fresh["id"]) is not None
+
+
+def test_runner_runs_jobs_and_long_polls(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+
+    async def run(job, on_start):
+        on_start()
+        await asyncio.sleep(0.01)
+        return {"success": True, "code": job["code"]}
+
+    async def main():
+        runner = JobRunner(store, run, workers=1)
+        runner.start()
+        try:
+            job = runner.submit("print 1;", None, "1.2.3.4")
+            return await runner.wait(job["id"], timeout=5)
+        finally:
+            runner.stop()
+
+    job = asyncio.run(main())
+    assert job["status"] == "finished"
+    assert job["result"] == {"success": True, "code": "print 1;"}
+
+
+def test_runner_resumes_queued_jobs_on_start(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+    job = store.create("print 1;", None, "1.2.3.4")
+
+    async def run(job, on_start):
+        on_start()
+        return {"success": True}
+
+    async def main():
+        runner = JobRunner(store, run, workers=1)
+        runner.start()
+        try:
+            return await runner.wait(job["id"], timeout=5)
+        finally:
+            runner.stop()
+
+    assert asyncio.run(main())["status"] == "finished"
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from app import launcher
+from app.launcher import launch
+
+
+def test_launch_pipes_and_exit_code():
+    async def run():
+        proc = await launch([sys.executable, "-c", "import sys; print(input()); sys.exit(3)"])
+        return await proc.communicate(b"hello\n"), proc.returncode
+
+    (stdout, stderr), returncode = asyncio.run(run())
+    assert stdout == b"hello\n"
+    assert stderr == b""
+    assert returncode == 3
+
+
+def test_exit_noticed_without_wait():
+    async def run():
+        proc = await launch([sys.executable, "-c", "pass"])
+        for _ in range(100):
+            if proc.returncode is not None:
+                break
+            await asyncio.sleep(0.02)
+        return proc.returncode
+
+    assert asyncio.run(run()) == 0
+
+
+def test_kill_reaches_process_group(tmp_path):
+    # The jail's own children die with it
+    pid_file = tmp_path / "child.pid"
+    script = f"sleep 60 & echo $! > {pid_file}; wait"
+
+    async def run():
+        proc = await launch(["/bin/sh", "-c", script])
+        for _ in range(100):
+            if pid_file.exists() and pid_file.read_text().strip():
+                break
+            await asyncio.sleep(0.02)
+        reaped = launcher.reap_ms.count
+        proc.kill()
+        await proc.wait()
+        return proc.returncode, launcher.reap_ms.count - reaped
+
+    returncode, reaps = asyncio.run(run())
+    assert returncode == -9
+    assert reaps == 1
+    child = int(pid_file.read_text())
+    for _ in range(100):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        # Zombies of the killed group are reaped by init
+        with open(f"/proc/{child}/stat") as f:
+            if f.read().split(") ")[1].startswith("Z"):
+                break
+        time.sleep(0.02)
+    else:
+        raise AssertionError("child outlived the jail")
+
+
+def test_launch_missing_binary_raises():
+    async def run():
+        await launch(["/nonexistent/magma"])
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(run())
@@ -1,13 +1,20 @@
+import json
+import sys
+
 import pytest
 from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
 
-from app.executor import ExecutionResult
+from app.executor import BatchResult, ExecutionResult, ResourceUsage
+from app.predictor import fingerprint
+from app.warmup import Warmup
 
 
 @pytest.fixture
 def client():
-    from app.main import app
+    from app.main import app, rate_limiter
+    # Each test starts with a fresh rate limit
+    rate_limiter._requests.clear()
     return TestClient(app)
 
 
@@ -79,6 +86,7 @@ def test_stats_endpoint(client):
     for key in ("total_requests", "unique_ips", "avg_elapsed_sec", "successes", "failures"):
         assert key in data["all_time"]
         assert key in data["last_24h"]
+    assert data["coalescing"]["in_flight"] == 0
 
 
 def test_cors_preflight_allows_any_origin(client):
@@ -105,3 +113,589 @@ def test_cors_response_allows_all(mock_exec, client):
     )
     assert resp.status_code == 200
     assert resp.headers.get("access-control-allow-origin") == "*"
+
+
+def _parse_sse(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_stream_final_event(mock_exec, client):
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0,
+    )
+    resp = client.post("/execute/stream", json={"code": "print 1+1;"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(resp.text)
+    name, data = events[-1]
+    assert name == "result"
+    assert data["success"] is True
+    assert data["stdout"] == "2\n"
+    assert data["magma"]["version"] == "2.29-4"
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_profile(mock_exec, client):
+    import re
+
+    async def run(code, *args, **kwargs):
+        marker = re.search(r'printf "(\w+) 0 ', code).group(1)
+        return ExecutionResult(
+            stdout=MOCK_MAGMA_STDOUT.replace("2\n", f"2\n{marker} 0 0.500 0.510 2048\n"),
+            stderr="",
+            exit_code=0,
+        )
+
+    mock_exec.side_effect = run
+    resp = client.post("/execute", json={"code": "print 1+1;", "profile": True})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["stdout"] == "2\n"
+    assert data["profile"] == {
+        "statements": 1,
+        "finished": 1,
+        "hot": [{
+            "line": 1, "code": "print 1+1;", "cpu_sec": 0.5, "wall_sec": 0.51,
+            "memory_bytes": 2048, "finished": True,
+        }],
+    }
+
+    resp = client.post("/execute/stream", json={"code": "print 1+1;", "profile": True})
+    assert resp.status_code == 400
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_stream_parses_as_output_arrives(mock_exec, client):
+    async def run(code, settings, on_stdout=None, **kwargs):
+        data = MOCK_MAGMA_STDOUT.encode()
+        for i in range(0, len(data), 10):
+            on_stdout(data[i:i + 10])
+        return ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)
+
+    mock_exec.side_effect = run
+    with patch("app.main.parse_magma_output") as mock_parse:
+        resp = client.post("/execute/stream", json={"code": "print 1+1;"})
+    # The result comes from the streaming parser, without a second pass
+    mock_parse.assert_not_called()
+    events = _parse_sse(resp.text)
+    assert "".join(data["text"] for name, data in events if name == "stdout") == "2\n"
+    name, data = events[-1]
+    assert name == "result"
+    assert data["stdout"] == "2\n"
+    assert data["magma"]["time_sec"] == 0.05
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_segments(mock_exec, client):
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT.replace("2\n", "2\n>> x;\n   ^\nUser error: bad\n"),
+        stderr="",
+        exit_code=0,
+    )
+    resp = client.post("/execute", json={"code": "print 1+1; x;"})
+    assert "segments" not in resp.json()
+    resp = client.post("/execute", json={"code": "print 1+1; x;", "segments": True})
+    assert resp.json()["segments"] == [
+        {"type": "output", "start": 0, "end": 2, "line": None},
+        {"type": "user_error", "start": 2, "end": 29, "line": None},
+    ]
+
+
+def test_execute_stream_input_too_large(client):
+    resp = client.post("/execute/stream", json={"code": "x" * (50 * 1024 + 1)})
+    assert resp.status_code == 413
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_uses_result_cache(mock_exec, client):
+    from app.cache import ResultCache
+
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0,
+    )
+    with patch("app.main.result_cache", ResultCache(1024 * 1024, ttl=60)):
+        first = client.post("/execute", json={"code": "print 1+1;"}).json()
+        second = client.post("/execute", json={"code": "print 1+1;"}).json()
+        stats = client.get("/stats").json()
+    assert mock_exec.call_count == 1
+    assert "cached" not in first
+    assert first["runtime"] is not None
+    assert second == {**first, "cached": True, "resources": None, "runtime": None}
+    assert stats["cache"]["hits"] == 1
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_pinned_seed(mock_exec, client):
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0,
+    )
+    resp = client.post("/execute", json={"code": "print Random(10);", "seed": 7})
+    assert resp.json()["magma"]["seed"] == 7
+    assert mock_exec.call_args.kwargs["seed"] == 7
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_busy_returns_retry_after(mock_exec, client):
+    from app.admission import AdmissionQueue
+
+    with patch("app.main.admission", AdmissionQueue(0, 0, 1, 1)):
+        resp = client.post("/execute", json={"code": "print 1;"})
+    assert resp.status_code == 503
+    assert resp.json() == {"error": "All execution slots busy"}
+    assert int(resp.headers["retry-after"]) >= 1
+    mock_exec.assert_not_called()
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_job_api(mock_exec, tmp_path):
+    from app import main
+    from app.jobs import JobRunner, JobStore
+
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0,
+    )
+    runner = JobRunner(JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60), main._run_job, 1)
+    with patch("app.main.job_runner", runner), TestClient(main.app) as client:
+        resp = client.post("/jobs", json={"code": "print 1+1;"})
+        assert resp.status_code == 202
+        job_id = resp.json()["job_id"]
+        assert resp.json()["status"] == "queued"
+
+        status = client.get(f"/jobs/{job_id}", params={"wait": 5}).json()
+        assert status["status"] == "finished"
+        assert status["started_at"] is not None
+        assert status["finished_at"] is not None
+
+        result = client.get(f"/jobs/{job_id}/result").json()
+        assert result["success"] is True
+        assert result["stdout"] == "2\n"
+
+        assert client.get("/jobs/unknown").status_code == 404
+        assert client.get("/jobs/unknown/result").status_code == 404
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_rejects_memory_over_budget(mock_exec, client):
+    from app.admission import AdmissionQueue
+
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0,
+    )
+    queue = AdmissionQueue(4, 16, 2, 30, memory_budget=300)
+    with patch("app.main.admission", queue):
+        resp = client.post("/execute", json={"code": "print 1;"})
+        small = client.post("/execute", json={"code": "print 1;", "memory_mb": 200})
+    assert resp.status_code == 400
+    assert resp.json() == {"error": "The memory limit exceeds the memory budget"}
+    assert small.status_code == 200
+    assert queue.rejected == 0
+
+
+def test_session_rejects_memory_over_budget(client):
+    from app.admission import AdmissionQueue
+    from app.main import settings
+
+    queue = AdmissionQueue(4, 16, 2, 30, memory_budget=300)
+    with patch("app.main.admission", queue), patch.object(settings, "session_max", 2):
+        resp = client.post("/sessions", json={})
+    assert resp.status_code == 400
+    assert queue.stats()["active"] == 0
+
+
+def test_job_over_memory_budget_finishes_with_error(tmp_path):
+    import asyncio
+    from app import main
+    from app.admission import AdmissionQueue
+
+    job = {
+        "id": "j", "client_ip": "1.2.3.4", "code": "print 1;", "seed": None,
+        "tier": "default", "memory_mb": None, "time_limit": None, "profile": 0, "segments": 0,
+    }
+    queue = AdmissionQueue(4, 16, 2, 30, memory_budget=300)
+    with patch("app.main.admission", queue):
+        result = asyncio.run(asyncio.wait_for(main._run_job(job, lambda: None), 5))
+    assert result["success"] is False
+    assert result["error"] == "Memory limit exceeds the memory budget"
+    assert result["stdout"] == "" and result["warnings"] == [result["error"]]
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_failed_job_has_execute_shaped_result(mock_exec, tmp_path):
+    from app import main
+    from app.jobs import JobRunner, JobStore
+
+    mock_exec.side_effect = RuntimeError("boom")
+    runner = JobRunner(
+        JobStore(str(tmp_path / "jobs.sqlite3"), ttl=60), main._run_job, 1,
+        error_result=main.job_runner._error_result,
+    )
+    with patch("app.main.job_runner", runner), TestClient(main.app) as client:
+        job_id = client.post("/jobs", json={"code": "print 1;", "seed": 3}).json()["job_id"]
+        assert client.get(f"/jobs/{job_id}", params={"wait": 5}).json()["status"] == "finished"
+        result = client.get(f"/jobs/{job_id}/result").json()
+    assert result["success"] is False
+    assert result["error"] == "Internal error"
+    assert result["stdout"] == "" and result["truncated"] is False
+    assert result["warnings"] == ["Internal error"]
+    assert result["magma"]["seed"] == 3
+
+
+def test_execute_unknown_tier(client):
+    resp = client.post("/execute", json={"code": "print 1;", "tier": "nope"})
+    assert resp.status_code == 400
+    assert resp.json() == {"error": "Unknown tier"}
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_uses_tier_limits(mock_exec, client):
+    from app.admission import AdmissionQueue
+    from app.config import Limits, Tier
+
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0,
+    )
+    long = Tier("long", Limits(timeout=600, cpu_timeout=600, memory_mb=2000), slots=1)
+    tiers = {"default": Tier("default", Limits(120, 120, 400), slots=4), "long": long}
+    queue = AdmissionQueue({"default": 4, "long": 1}, 16, 2, 30)
+    with patch("app.main.tiers", tiers), patch("app.main.admission", queue):
+        resp = client.post("/execute", json={"code": "print 1;", "tier": "long"})
+    assert resp.status_code == 200
+    assert mock_exec.call_args.kwargs["limits"] == long.limits
+    assert queue.stats()["tiers"]["long"]["active"] == 0
+    assert queue.admitted == 1
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_reports_resources(mock_exec, client):
+    # Killed by the kernel OOM killer: no footer, no Magma warning
+    mock_exec.return_value = ExecutionResult(
+        stdout="Magma V2.29-4 [Seed = 1]\nquit.\n",
+        stderr="",
+        exit_code=137,
+        usage=ResourceUsage(
+            wall_sec=3.2, cpu_sec=2.9, peak_memory_bytes=400 * 1024 * 1024, oom_killed=True
+        ),
+    )
+    resp = client.post("/execute", json={"code": "x := [1..10^9];"})
+    data = resp.json()
+    assert data["success"] is False
+    assert data["magma"]["memory"] is None
+    assert data["resources"] == {
+        "wall_sec": 3.2,
+        "cpu_sec": 2.9,
+        "peak_memory_bytes": 400 * 1024 * 1024,
+        "oom_killed": True,
+    }
+    assert "memory limit" in data["error"]
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_batch_splits_results(mock_batch, client):
+    mock_batch.return_value = BatchResult(
+        items=[
+            ExecutionResult(stdout="2\n", stderr="", exit_code=0),
+            ExecutionResult(stdout="User error: bad\n", stderr="", exit_code=0),
+            ExecutionResult(stdout="", stderr="Alarm clock\n", exit_code=-1),
+        ],
+        runs=[ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)] * 2,
+    )
+    resp = client.post("/batch", json={"items": ["print 1+1;", "bad;", "while true do end while;"]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["success"] is False
+    assert data["runs"] == 2
+    assert data["magma"] == {"version": "2.29-4", "seed": 42}
+    ok, error, timeout = data["items"]
+    assert ok == {"success": True, "stdout": "2\n", "truncated": False, "warnings": []}
+    assert error["error"] == "An error occurred. See the output for details."
+    assert "time limit" in timeout["error"]
+    assert mock_batch.call_args.kwargs["item_timeout"] == 10
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_batch_reports_items_not_run(mock_batch, client):
+    mock_batch.return_value = BatchResult(
+        items=[ExecutionResult(stdout="", stderr="Alarm clock\n", exit_code=-1)],
+        runs=[ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=-1)],
+    )
+    resp = client.post("/batch", json={"items": ["while true do end while;", "print 2;"]})
+    data = resp.json()
+    assert data["success"] is False
+    stuck, not_run = data["items"]
+    assert "time limit" in stuck["error"]
+    assert not_run["error"] == "The batch reached its time limit before this item ran."
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_batch_without_runs(mock_batch, client):
+    mock_batch.return_value = BatchResult(items=[], runs=[])
+    resp = client.post("/batch", json={"items": ["print 1;"]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["runs"] == 0
+    assert data["items"][0]["error"] == "The batch reached its time limit before this item ran."
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_batch_spawn_failure(mock_batch, client):
+    from app.main import breaker
+
+    mock_batch.side_effect = OSError("nsjail not found")
+    failures = breaker.failures
+    resp = client.post("/batch", json={"items": ["print 1;"]})
+    assert resp.status_code == 503
+    assert resp.json() == {"error": "Magma could not be started"}
+    assert breaker.failures == failures + 1
+    breaker.failures = 0
+
+
+def test_batch_too_many_items(client):
+    resp = client.post("/batch", json={"items": ["print 1;"] * 101})
+    assert resp.status_code == 400
+    resp = client.post("/batch", json={"items": []})
+    assert resp.status_code == 400
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_map_merges_chunks_in_order(mock_batch, client):
+    from app.main import settings
+
+    async def run_chunk(codes, *args, **kwargs):
+        return BatchResult(
+            items=[ExecutionResult(stdout=f"{code}\n", stderr="", exit_code=0) for code in codes],
+            runs=[ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)],
+        )
+
+    mock_batch.side_effect = run_chunk
+    with patch.object(settings, "map_chunk_size", 2):
+        resp = client.post("/map", json={
+            "preamble": "R<t> := PolynomialRing(Integers());",
+            "function": "return x^2;",
+            "inputs": ["1", "2", "3", "4", "5"],
+        })
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["success"] is True
+    assert data["complete"] is True
+    assert data["chunks"] == 3
+    assert data["runs"] == 3
+    assert [item["stdout"] for item in data["items"]] == [
+        f"print map_function({x});\n" for x in range(1, 6)
+    ]
+    preamble = mock_batch.call_args.kwargs["preamble"]
+    assert preamble.startswith("R<t> := PolynomialRing(Integers());\n")
+    assert "map_function := function(x)\nreturn x^2;\nend function;" in preamble
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_map_returns_partial_results_on_timeout(mock_batch, client):
+    import asyncio
+    from app.main import admission, settings
+
+    async def run_chunk(codes, *args, **kwargs):
+        if "print map_function(slow);" in codes:
+            await asyncio.sleep(60)
+        return BatchResult(
+            items=[ExecutionResult(stdout="1\n", stderr="", exit_code=0) for _ in codes],
+            runs=[ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)],
+        )
+
+    mock_batch.side_effect = run_chunk
+    with patch.object(settings, "map_chunk_size", 1), patch.object(settings, "map_timeout", 1):
+        resp = client.post("/map", json={"function": "return x;", "inputs": ["1", "slow", "3"]})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["success"] is False
+    assert data["complete"] is False
+    first, slow, last = data["items"]
+    assert first["success"] is True and last["success"] is True
+    assert slow["error"] == "The map ran out of time before this input ran."
+    assert admission.stats()["active"] == 0
+
+
+@patch("app.main.execute_batch", new_callable=AsyncMock)
+def test_map_reports_failed_chunks(mock_batch, client):
+    from app.main import settings
+
+    async def run_chunk(codes, *args, **kwargs):
+        if "print map_function(2);" in codes:
+            raise OSError("nsjail not found")
+        return BatchResult(
+            items=[ExecutionResult(stdout="1\n", stderr="", exit_code=0) for _ in codes],
+            runs=[ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)],
+        )
+
+    mock_batch.side_effect = run_chunk
+    with patch.object(settings, "map_chunk_size", 1):
+        resp = client.post("/map", json={"function": "return x;", "inputs": ["1", "2"]})
+    data = resp.json()
+    assert data["complete"] is False
+    ok, failed = data["items"]
+    assert ok["success"] is True
+    assert failed["error"] == "Magma could not be started for this input."
+
+
+def test_map_uses_slot_freed_during_the_map():
+    import asyncio
+    from app import main
+    from app.admission import AdmissionQueue
+
+    running = 0
+    peak = 0
+
+    async def run_chunk(codes, *args, **kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.5)
+        running -= 1
+        return BatchResult(
+            items=[ExecutionResult(stdout="1\n", stderr="", exit_code=0) for _ in codes],
+            runs=[ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)],
+        )
+
+    async def run():
+        queue = AdmissionQueue(2, 4, 2, 30)
+        own = await queue.acquire("a")
+        other = await queue.acquire("b")
+        with patch("app.main.admission", queue), \
+                patch("app.main.execute_batch", side_effect=run_chunk):
+            req = main.MapRequest(function="return x;", inputs=["1", "2", "3"])
+            task = asyncio.create_task(main._map_chunks(req, [["1"], ["2"], ["3"]], own))
+            await asyncio.sleep(0.1)
+            # The other request finishes while the map's first chunk runs
+            other.release()
+            results = await task
+        own.release()
+        return results, queue.stats()["active"]
+
+    results, active = asyncio.run(run())
+    assert all(result is not None for result in results)
+    assert peak == 2
+    assert active == 0
+
+
+def test_map_input_count(client):
+    resp = client.post("/map", json={"function": "return x;", "inputs": []})
+    assert resp.status_code == 400
+    resp = client.post("/map", json={"function": "return x;", "inputs": ["1"] * 1001})
+    assert resp.status_code == 400
+
+
+def test_sessions_disabled_by_default(client):
+    resp = client.post("/sessions", json={})
+    assert resp.status_code == 404
+
+
+def test_session_api():
+    from app.main import app, session_manager, settings
+    from tests.conftest import FAKE_MAGMA
+
+    fake_cmd = [sys.executable, FAKE_MAGMA, "--interactive"]
+    # One event loop for the whole test, since sessions outlive a request
+    with patch.object(settings, "session_max", 1), \
+            patch.object(session_manager, "max_sessions", 1), \
+            patch("app.main.build_nsjail_command", return_value=fake_cmd), \
+            TestClient(app) as client:
+        resp = client.post("/sessions", json={})
+        assert resp.status_code == 201
+        session_id = resp.json()["session_id"]
+        assert resp.json()["magma"]["version"] is not None
+        assert client.post("/sessions", json={}).status_code == 503
+
+        client.post(f"/sessions/{session_id}/execute", json={"code": "x := 21;"})
+        resp = client.post(f"/sessions/{session_id}/execute", json={"code": "print x*2;"})
+        data = resp.json()
+        assert data["success"] is True
+        assert data["stdout"] == "42\n"
+        assert data["session_open"] is True
+
+        assert client.delete(f"/sessions/{session_id}").status_code == 204
+        resp = client.post(f"/sessions/{session_id}/execute", json={"code": "print x;"})
+        assert resp.status_code == 404
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_smaller_memory_limit(mock_exec, client):
+    mock_exec.return_value = ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)
+    resp = client.post("/execute", json={"code": "print 1+1;", "memory_mb": 100})
+    assert resp.status_code == 200
+    assert mock_exec.call_args.kwargs["limits"].memory_mb == 100
+
+    resp = client.post("/execute", json={"code": "print 1+1;", "memory_mb": 401})
+    assert resp.status_code == 400
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_fails_fast_while_breaker_open(mock_exec, client):
+    from app.main import breaker
+
+    with patch.object(breaker, "opened_at", 1.0):
+        resp = client.post("/execute", json={"code": "print 1+1;"})
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(breaker.probe_interval)
+    mock_exec.assert_not_called()
+
+
+def test_health_not_ready_during_warmup(client):
+    warmup = Warmup([], 0, 0, probe=AsyncMock())
+    with patch("app.main.warmup", warmup):
+        resp = client.get("/health")
+        assert resp.status_code == 503
+        assert resp.json() == {"status": "warming up"}
+        warmup.ready = True
+        assert client.get("/health").status_code == 200
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_declared_time_limit(mock_exec, client):
+    mock_exec.return_value = ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)
+    resp = client.post("/execute", json={"code": "print 1+1;", "time_limit": 5})
+    assert resp.status_code == 200
+    limits = mock_exec.call_args.kwargs["limits"]
+    assert (limits.timeout, limits.cpu_timeout) == (5, 5)
+
+    resp = client.post("/execute", json={"code": "print 1+1;", "time_limit": 121})
+    assert resp.status_code == 400
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_execute_reports_predicted_runtime(mock_exec, client):
+    from app.main import predictor
+
+    mock_exec.return_value = ExecutionResult(
+        stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0, usage=ResourceUsage(wall_sec=1.5)
+    )
+    code = "x := 2^12345;\nprint 1;"
+    first = client.post("/execute", json={"code": code}).json()
+    assert first["runtime"] == {"predicted_sec": None, "actual_sec": 1.5}
+
+    second = client.post("/execute", json={"code": "x := 2^54321;\nprint 1;"}).json()
+    assert second["runtime"] == {"predicted_sec": 1.5, "actual_sec": 1.5}
+    assert predictor.stats()["scored"] >= 1
+
+
+@patch("app.main.execute_magma", new_callable=AsyncMock)
+def test_predicted_long_run_goes_to_long_tier(mock_exec, client):
+    from app.config import Limits, Tier
+    from app.main import admission, predictor, settings
+
+    mock_exec.return_value = ExecutionResult(stdout=MOCK_MAGMA_STDOUT, stderr="", exit_code=0)
+    long_tier = Tier("long", Limits(600, 600, 400), slots=1)
+    code = "while true do x := 1; end while;"
+    predictor.record(fingerprint(code), 100.0)
+    with (
+        patch.dict("app.main.tiers", {"long": long_tier}),
+        patch.dict(admission.slots, {"long": 1}),
+        patch.dict(admission.active, {"long": 0}),
+        patch.dict(admission._queued_by_tier, {"long": 0}),
+        patch.object(settings, "long_tier", "long"),
+    ):
+        resp = client.post("/execute", json={"code": code})
+    assert resp.status_code == 200
+    assert mock_exec.call_args.kwargs["limits"].timeout == 600
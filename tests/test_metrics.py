@@ -0,0 +1,21 @@
+from app.metrics import Histogram
+
+
+def test_histogram_buckets_and_quantiles():
+    hist = Histogram(bounds=(1, 10, 100))
+    for ms in (0.5, 0.7, 5, 50, 500):
+        hist.observe(ms)
+    stats = hist.stats()
+    assert stats["count"] == 5
+    assert stats["buckets"] == {"1": 2, "10": 1, "100": 1, "+Inf": 1}
+    assert stats["p50_ms"] == 10
+    assert stats["p99_ms"] == 500
+    assert stats["max_ms"] == 500
+    assert stats["mean_ms"] == 111.24
+
+
+def test_histogram_empty():
+    stats = Histogram().stats()
+    assert stats["count"] == 0
+    assert stats["p50_ms"] is None
+    assert stats["mean_ms"] is None
@@ -1,4 +1,4 @@
-from app.parser import parse_magma_output
+from app.parser import parse_body, parse_magma_output, split_batch_output
 
 
 SAMPLE_BANNER = "Magma V2.29-4     Fri Jan 31 2026 12:00:00 on linux   [Seed = 1234567890]\n"
@@ -148,3 +148,155 @@ def test_stderr_unknown():
     """Unknown stderr content is ignored (not passed to user)."""
     warnings = parse_stderr_warnings("some random debug output\n")
     assert warnings == []
+
+
+def test_parse_marks_output_cut_by_executor():
+    stdout = SAMPLE_BANNER + SAMPLE_QUIT + "partial"
+    result = parse_magma_output(stdout, max_output_bytes=20480, truncated=True)
+    assert result.stdout == "partial\n"
+    assert result.truncated is True
+    assert "The output is too long and has been truncated." in result.warnings
+
+
+from app.parser import StreamParser
+
+
+def _stream_body(stdout: str, max_output_bytes: int = 20480, step: int = 1) -> str:
+    data = stdout.encode("utf-8")
+    stream = StreamParser(max_output_bytes)
+    out = [stream.feed(data[i:i + step]) for i in range(0, len(data), step)]
+    out.append(stream.close())
+    return "".join(out)
+
+
+def test_stream_parser_matches_parser():
+    samples = [
+        SAMPLE_BANNER + SAMPLE_QUIT + SAMPLE_BODY + SAMPLE_FOOTER,
+        SAMPLE_BANNER + SAMPLE_QUIT + "line1\n\nline3\n\n\n" + SAMPLE_FOOTER,
+        SAMPLE_BANNER + SAMPLE_QUIT + "Machine type: X86_64-linux\nresult\n" + SAMPLE_FOOTER,
+        SAMPLE_BANNER + SAMPLE_QUIT + "partial output",
+        SAMPLE_BANNER + SAMPLE_QUIT + "héllo wörld\n" + SAMPLE_FOOTER,
+        SAMPLE_BANNER + SAMPLE_QUIT + SAMPLE_FOOTER,
+        SAMPLE_BANNER,
+    ]
+    for stdout in samples:
+        expected = parse_magma_output(stdout, max_output_bytes=20480).stdout
+        assert _stream_body(stdout) == expected
+        assert _stream_body(stdout, step=7) == expected
+
+
+def test_stream_parser_truncates():
+    body = "x" * 100 + "\n"
+    stdout = SAMPLE_BANNER + SAMPLE_QUIT + body + SAMPLE_FOOTER
+    assert _stream_body(stdout, max_output_bytes=50) == "x" * 50
+
+
+def test_stream_parser_result():
+    stdout = (
+        SAMPLE_BANNER + SAMPLE_QUIT + "x" * 30 + "\nUser error: bad\n" + SAMPLE_FOOTER
+    ).encode("utf-8")
+    stream = StreamParser(20)
+    for i in range(0, len(stdout), 5):
+        stream.feed(stdout[i:i + 5])
+    stream.close()
+    result = stream.result()
+    assert result == parse_magma_output(stdout.decode("utf-8"), max_output_bytes=20)
+    assert result.stdout == "x" * 20
+    # Classified from the whole body, not just the part that was kept
+    assert result.warnings == [
+        "An error occurred. See the output for details.",
+        "The output is too long and has been truncated.",
+    ]
+    assert result.time_sec is not None
+
+
+def test_stream_parser_long_line_in_pieces():
+    stream = StreamParser(100)
+    text = stream.feed(SAMPLE_BANNER.encode() + SAMPLE_QUIT.encode() + b"y" * 200_000)
+    # Parsed before the line ended, and only the kept prefix is held
+    assert text == "y" * 100
+    assert stream.close() == ""
+    assert stream.result().truncated is True
+
+
+def test_parse_body_classifies_errors():
+    result = parse_body("\n>> x;\n   ^\nUser error: Identifier 'x' has not been declared\n\n", 1000)
+    assert result.stdout.startswith("\n>> x;")
+    assert result.stdout.endswith("declared\n")
+    assert result.warnings == ["An error occurred. See the output for details."]
+
+
+def test_split_batch_output():
+    stdout = (
+        "Magma V2.28-1 [Seed = 1]\nquit.\n"
+        "m 0\n2\nm 1\nm 2\nUser error: bad\nm end\n"
+        "Total time: 0.010 seconds, Total memory usage: 5.00MB\n"
+    )
+    items, finished = split_batch_output(stdout, "m")
+    assert items == ["2\n", "", "User error: bad\n"]
+    assert finished is True
+
+
+def test_split_batch_output_interrupted():
+    items, finished = split_batch_output("quit.\nm 0\n1\nm 1\npartial\n", "m")
+    assert items == ["1\n", "partial\n"]
+    assert finished is False
+
+
+def test_split_batch_output_stops_at_gap():
+    # Item 1 swallowed the marker for item 2
+    items, finished = split_batch_output("m 0\n1\nm 1\nx\nm 3\n4\nm end\n", "m")
+    assert items == ["1\n", "x\n"]
+    assert finished is False
+
+
+def test_segments_split_errors_from_output():
+    body = (
+        "1\n"
+        "\n"
+        ">> print y;\n"
+        "         ^\n"
+        "User error: Identifier 'y' has not been declared or assigned\n"
+        "\n"
+        "h\u00e9llo\n"
+        'In file "f.m", line 4, column 13:\n'
+        ">>     return Factorization(z);\n"
+        "              ^\n"
+        "Runtime error in 'Factorization': Bad argument types\n"
+        "\n"
+        "System error: User memory limit has been reached\n"
+    )
+    result = parse_magma_output(SAMPLE_BANNER + SAMPLE_QUIT + body + SAMPLE_FOOTER, 20480)
+    data = result.stdout.encode("utf-8")
+    segments = [
+        (s.type, data[s.start:s.end].decode("utf-8"), s.line) for s in result.segments
+    ]
+    assert segments == [
+        ("output", "1\n\n", None),
+        ("user_error", ">> print y;\n         ^\n"
+         "User error: Identifier 'y' has not been declared or assigned\n", None),
+        ("output", "\nh\u00e9llo\n", None),
+        ("runtime_error", 'In file "f.m", line 4, column 13:\n'
+         ">>     return Factorization(z);\n              ^\n"
+         "Runtime error in 'Factorization': Bad argument types\n", 4),
+        ("output", "\n", None),
+        ("memory_limit", "System error: User memory limit has been reached\n", None),
+    ]
+
+
+def test_segments_stop_at_truncation():
+    body = "x" * 10 + "\nUser error: bad\n" + "y" * 100 + "\n"
+    result = parse_body(body, 20)
+    assert [(s.type, s.start, s.end) for s in result.segments] == [
+        ("output", 0, 11),
+        ("user_error", 11, 20),
+    ]
+
+
+def test_segments_context_is_only_the_lines_before_the_error():
+    body = "In total we have 5\n3\n4\n5\n>> foo;\n   ^\nUser error: bad\n"
+    result = parse_body(body, 1000)
+    assert [(s.type, s.start, s.end) for s in result.segments] == [
+        ("output", 0, 25),
+        ("user_error", 25, len(body)),
+    ]
@@ -0,0 +1,73 @@
+import asyncio
+import sys
+
+from app.config import Settings
+from app.executor import run_process, wrap_magma_code
+from app.pool import WarmPool
+from tests.conftest import FAKE_MAGMA
+
+
+async def _wait_ready(pool: WarmPool, count: int) -> None:
+    for _ in range(200):
+        if pool.stats()["ready"] >= count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("warm pool did not fill")
+
+
+def test_pool_fills_and_serves_hits():
+    async def run():
+        pool = WarmPool([sys.executable, FAKE_MAGMA], size=2, max_age=60)
+        pool.start()
+        try:
+            await _wait_ready(pool, 2)
+            jail = pool.take()
+            assert jail is not None
+            proc, cgroup = jail
+            assert cgroup is None
+            result = await run_process(proc, wrap_magma_code("print 1+1;", 120), Settings())
+            assert "quit.\n2\n" in result.stdout
+            assert result.exit_code == 0
+            # The taken process is replaced in the background
+            await _wait_ready(pool, 2)
+            return pool.stats()
+        finally:
+            await pool.stop()
+
+    stats = asyncio.run(run())
+    assert stats["hits"] == 1
+    assert stats["misses"] == 0
+    assert stats["spawned"] == 3
+    assert stats["refills_per_minute"] == 3
+
+
+def test_pool_miss_when_empty():
+    async def run():
+        pool = WarmPool([sys.executable, FAKE_MAGMA], size=1, max_age=60)
+        assert pool.take() is None
+        return pool.stats()
+
+    stats = asyncio.run(run())
+    assert stats["misses"] == 1
+    assert stats["hits"] == 0
+    assert stats["ready"] == 0
+
+
+def test_pool_expires_old_processes():
+    async def run():
+        pool = WarmPool([sys.executable, FAKE_MAGMA], size=1, max_age=60)
+        pool.start()
+        try:
+            await _wait_ready(pool, 1)
+            started, (proc, cgroup) = pool._ready[0]
+            pool._ready[0] = (started - 61, (proc, cgroup))
+            assert pool.take() is None
+            await proc.wait()
+            assert proc.returncode is not None
+            return pool.stats()
+        finally:
+            await pool.stop()
+
+    stats = asyncio.run(run())
+    assert stats["expired"] == 1
+    assert stats["misses"] == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from app.predictor import RuntimePredictor, fingerprint
+
+
+def test_fingerprint_ignores_layout_comments_and_values():
+    a = fingerprint("x := Factorization(123456);  // factor it\nprint x;")
+    b = fingerprint("x := Factorization(654321);\n/* other */ print   x;")
+    assert a == b
+    # The size of a number changes the fingerprint
+    assert fingerprint("x := Factorization(12);\nprint x;") != a
+    assert fingerprint('print "a";') == fingerprint('print "bcd";')
+
+
+def test_predicts_from_history():
+    predictor = RuntimePredictor(max_entries=10)
+    assert predictor.predict("k") is None
+    predictor.record("k", 2.0)
+    assert predictor.predict("k") == 2.0
+    predictor.record("k", 8.0, predicted=2.0)
+    # Moves towards 8 on a log scale
+    assert 2.0 < predictor.predict("k") < 8.0
+
+    stats = predictor.stats()
+    assert stats["entries"] == 1
+    assert stats["misses"] == 1
+    assert stats["scored"] == 1
+    assert stats["mean_abs_error_sec"] == 6.0
+    assert stats["within_2x"] == 0.0
+
+
+def test_history_is_bounded():
+    predictor = RuntimePredictor(max_entries=2)
+    for key in ("a", "b", "c"):
+        predictor.record(key, 1.0)
+    assert predictor.predict("a") is None
+    assert predictor.predict("c") == 1.0
+
+
+def test_history_survives_restart(tmp_path):
+    path = tmp_path / "runtimes.json"
+    predictor = RuntimePredictor(max_entries=10, path=str(path))
+    predictor.record("k", 3.0)
+    predictor.save()
+    assert RuntimePredictor(max_entries=10, path=str(path)).predict("k") == pytest.approx(3.0)
@@ -0,0 +1,57 @@
+from app.profiler import StatementProfiler, split_statements
+
+
+def test_split_statements_keeps_blocks_together():
+    code = (
+        "// setup\n"
+        "x := 5;\n"
+        "f := function(n)\n"
+        "  if n le 1 then return 1; end if;\n"
+        "  return n * $$(n - 1);\n"
+        "end function;\n"
+        'for i in [1..3] do print f(i); end for; s := "a;b";\n'
+        "y := case<x | 5: 1, default: 2>;\n"
+        "repeat x -:= 1; until x eq 0;\n"
+        "print x"
+    )
+    statements = split_statements(code)
+    assert [s.line for s in statements] == [2, 3, 7, 7, 8, 9, 10]
+    assert statements[1].code.strip().endswith("end function;")
+    assert statements[3].code.strip() == 's := "a;b";'
+    assert "".join(s.code for s in statements) == code
+
+
+def test_split_statements_unbalanced_code_is_one_statement():
+    code = "for i in [1..3] do print i;\nprint 2;"
+    assert [(s.line, s.code) for s in split_statements(code)] == [(1, code)]
+
+
+def test_split_statements_caps_count():
+    statements = split_statements("x := 1;\n" * 80)
+    assert len(statements) == 50
+    assert statements[-1].line == 50
+    assert statements[-1].code.count(";") == 31
+
+
+def test_collect_builds_table_and_strips_markers():
+    profiler = StatementProfiler("x := 1;\ny := Factorial(10^5);\nprint x;\nz := 2;")
+    assert profiler.code.count(profiler.marker) == 4
+    m = profiler.marker
+    stdout = (
+        "banner\nquit.\n"
+        f"{m} 0 0.000 0.001 1000\n"
+        f"{m} 1 2.500 2.600 5000\n"
+        f"1\n{m} 2 0.010 0.010 5000\n"
+    )
+    stdout, profile = profiler.collect(stdout)
+    assert stdout == "banner\nquit.\n1\n"
+    assert profile["statements"] == 4
+    assert profile["finished"] == 3
+    stopped, slow, *rest = profile["hot"]
+    # Magma stopped in the last statement, e.g. at the time limit
+    assert stopped == {
+        "line": 4, "code": "z := 2;", "cpu_sec": None, "wall_sec": None,
+        "memory_bytes": None, "finished": False,
+    }
+    assert slow["line"] == 2 and slow["cpu_sec"] == 2.5 and slow["memory_bytes"] == 5000
+    assert [row["line"] for row in rest] == [3, 1]
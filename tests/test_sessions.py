@@ -0,0 +1,144 @@
+import asyncio
+import sys
+
+from app.admission import AdmissionQueue
+from app.executor import spawn_process
+from app.sessions import Session, SessionManager
+from tests.conftest import FAKE_MAGMA
+
+MB = 1024 * 1024
+
+
+async def _open(queue: AdmissionQueue, memory_budget: int = 100 * MB) -> Session:
+    ticket = await queue.acquire("1.2.3.4")
+    proc = await spawn_process([sys.executable, FAKE_MAGMA, "--interactive"])
+    session = Session("1.2.3.4", "default", proc, ticket, memory_budget)
+    await session.start(timeout=5)
+    return session
+
+
+def _queue() -> AdmissionQueue:
+    return AdmissionQueue(4, max_queue=0, max_per_client=0, max_wait=0)
+
+
+def test_session_keeps_state():
+    async def run():
+        queue = _queue()
+        session = await _open(queue)
+        try:
+            first = await session.execute("x := 5;", 5, 1000)
+            second = await session.execute("print x*2;", 5, 1000)
+            return session.banner, first, second, queue.stats()["active"]
+        finally:
+            await session.close()
+
+    banner, first, second, active = asyncio.run(run())
+    assert banner.startswith("Magma V")
+    assert first.stdout == "" and first.exit_code == 0
+    assert second.stdout == "10\n" and second.exit_code == 0
+    assert second.usage.wall_sec >= 0
+    # The session holds its slot until it is closed
+    assert active == 1
+
+
+def test_session_timeout_ends_session():
+    async def run():
+        queue = _queue()
+        session = await _open(queue)
+        result = await session.execute("while true do end while;", 0.5, 1000)
+        return session, result, queue.stats()["active"]
+
+    session, result, active = asyncio.run(run())
+    assert result.exit_code == -1
+    assert result.stderr == "Killed"
+    assert session.closed
+    assert active == 0
+
+
+def test_session_truncates_output():
+    async def run():
+        session = await _open(_queue())
+        try:
+            big = await session.execute("print 'x' * 5000;", 5, 100)
+            after = await session.execute("print 1;", 5, 100)
+            return big, after
+        finally:
+            await session.close()
+
+    big, after = asyncio.run(run())
+    assert big.truncated is True
+    assert big.stdout == "x" * 100
+    # Output is drained up to the marker, so the session stays usable
+    assert after.stdout == "1\n"
+
+
+def test_manager_expires_idle_sessions():
+    async def run():
+        queue = _queue()
+        manager = SessionManager(max_sessions=2, idle_timeout=60, memory_ceiling=1000 * MB)
+        idle = await _open(queue)
+        fresh = await _open(queue)
+        await manager.add(idle)
+        await manager.add(fresh)
+        idle.last_used -= 61
+        await manager.sweep()
+        result = manager.get(idle.id), manager.get(fresh.id), manager.stats()
+        await manager.stop()
+        return result, queue.stats()["active"]
+
+    (idle, fresh, stats), active = asyncio.run(run())
+    assert idle is None
+    assert fresh is not None
+    assert stats["expired"] == 1
+    assert stats["open"] == 1
+    assert active == 0
+
+
+def test_manager_closes_dead_sessions():
+    async def run():
+        manager = SessionManager(max_sessions=3, idle_timeout=600, memory_ceiling=250 * MB)
+        queue = _queue()
+        session = await _open(queue)
+        await manager.add(session)
+        session.proc.kill()
+        await session.proc.wait()
+        await manager.sweep()
+        return session, manager.stats(), queue.stats()["active"]
+
+    session, stats, active = asyncio.run(run())
+    assert session.closed
+    assert stats["open"] == 0
+    assert stats["died"] == 1
+    assert active == 0
+
+
+def test_manager_evicts_least_recently_used():
+    async def run():
+        manager = SessionManager(max_sessions=3, idle_timeout=600, memory_ceiling=250 * MB)
+        queue = _queue()
+        first = await _open(queue)
+        second = await _open(queue)
+        await manager.add(first)
+        await manager.add(second)
+        # Using the first session makes the second the least recently used
+        assert manager.get(first.id) is first
+        third = await _open(queue)
+        await manager.add(third)
+        result = [manager.get(s.id) is not None for s in (first, second, third)]
+        stats = manager.stats()
+        await manager.stop()
+        return result, stats
+
+    alive, stats = asyncio.run(run())
+    assert alive == [True, False, True]
+    assert stats["evicted"] == 1
+    assert stats["memory_bytes"] == 200 * MB
+
+
+def test_manager_reservations_count_against_max():
+    manager = SessionManager(max_sessions=2, idle_timeout=600, memory_ceiling=250 * MB)
+    assert manager.reserve() and manager.reserve()
+    assert manager.full
+    assert not manager.reserve()
+    manager.unreserve()
+    assert manager.reserve()
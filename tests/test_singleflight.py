@@ -0,0 +1,119 @@
+import asyncio
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert calls == 1
+    assert results == ["result"] * 5
+    assert flight.stats() == {
+        "executions": 1, "coalesced": 4, "cancelled": 0, "in_flight": 0, "waiting": 0
+    }
+
+
+def test_different_keys_run_separately():
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, result=1)),
+            flight.do("b", lambda: asyncio.sleep(0.01, result=2)),
+        )
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert results == [1, 2]
+    assert flight.stats()["executions"] == 2
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_sequential_calls_are_not_coalesced():
+    async def run():
+        flight = SingleFlight()
+        await flight.do("k", lambda: asyncio.sleep(0, result=1))
+        await flight.do("k", lambda: asyncio.sleep(0, result=1))
+        return flight
+
+    flight = asyncio.run(run())
+    assert flight.stats()["executions"] == 2
+
+
+def test_waiters_visible_while_in_flight():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 1
+
+        tasks = [asyncio.create_task(flight.do("k", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        during = flight.stats()
+        assert flight.in_flight("k")
+        release.set()
+        await asyncio.gather(*tasks)
+        return during
+
+    during = asyncio.run(run())
+    assert during["in_flight"] == 1
+    assert during["waiting"] == 3
+    assert during["coalesced"] == 2
+
+
+def test_errors_propagate_to_all_waiters():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(
+            flight.do("k", fail), flight.do("k", fail), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_when_every_waiter_is_gone():
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("k", work))
+        second = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+
+        # One caller leaving does not stop the others' execution
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+
+        second.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return flight.stats()
+
+    stats = asyncio.run(run())
+    assert stats["cancelled"] == 1
+    assert stats["in_flight"] == 0
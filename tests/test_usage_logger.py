@@ -95,3 +95,17 @@ def test_empty_file(tmp_path):
     ul = UsageLogger(str(path))
     s = ul.stats()
     assert s["all_time"]["total_requests"] == 0
+
+
+def test_cancelled_counted_separately(tmp_path):
+    ul = UsageLogger(str(tmp_path / "usage.jsonl"))
+    ul.log(_make_entry(success=True))
+    ul.log({**_make_entry(success=False), "cancelled": True})
+
+    s = ul.stats()
+    assert s["all_time"]["cancelled"] == 1
+    assert s["all_time"]["failures"] == 0
+    assert s["last_24h"]["cancelled"] == 1
+
+    # Survives a restart
+    assert UsageLogger(str(tmp_path / "usage.jsonl")).stats()["all_time"]["cancelled"] == 1
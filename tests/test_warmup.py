@@ -0,0 +1,55 @@
+import asyncio
+
+from app.executor import ExecutionResult
+from app.warmup import Warmup, preload
+from app.workers import WorkerError
+
+BANNER = "Magma V2.29-4     Fri Jan 31 2026 [Seed = 42]\nquit.\n1\n"
+
+
+def test_preload_respects_cap(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "magma").write_bytes(b"x" * 100)
+    (tmp_path / "lib" / "a.so").write_bytes(b"x" * 100)
+    assert preload([str(tmp_path)], 1000) == (2, 200)
+    assert preload([str(tmp_path)], 150) == (1, 100)
+    assert preload([str(tmp_path / "missing")], 1000) == (0, 0)
+
+
+def test_warmup_becomes_ready_and_records_timings(tmp_path):
+    (tmp_path / "magma").write_bytes(b"x" * 10)
+    calls = []
+
+    async def probe():
+        calls.append(1)
+        return ExecutionResult(stdout=BANNER, stderr="", exit_code=0)
+
+    async def run():
+        warmup = Warmup([str(tmp_path)], 1024, 0, probe)
+        assert not warmup.ready
+        await warmup.run()
+        assert warmup.ready
+        await warmup.run()
+        return warmup.stats()
+
+    stats = asyncio.run(run())
+    assert len(calls) == 2
+    assert stats["ready"] is True
+    assert stats["cold_probe_sec"] is not None
+    assert stats["warm_probe_sec"] is not None
+    assert [r["ok"] for r in stats["runs"]] == [True, True]
+    assert stats["runs"][0]["files"] == 1
+
+
+def test_warmup_survives_unavailable_workers(tmp_path):
+    async def probe():
+        raise WorkerError("No worker available")
+
+    async def run():
+        warmup = Warmup([str(tmp_path)], 1024, 0, probe)
+        await warmup.run()
+        return warmup.stats()
+
+    stats = asyncio.run(run())
+    assert stats["ready"] is True
+    assert stats["runs"][0]["ok"] is False
@@ -0,0 +1,192 @@
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+import uvicorn
+
+from app.config import Limits
+from app.executor import ExecutionResult
+from app.worker import app as worker_app
+from app.workers import RemoteWorker, WorkerBusy, WorkerError, WorkerPool
+from tests.conftest import _execute_with_fake_magma
+
+LIMITS = Limits(timeout=10, cpu_timeout=10, memory_mb=400)
+
+
+@asynccontextmanager
+async def _worker_node(socket_path: str):
+    # A real worker node on a Unix socket, running fake_magma.py
+    config = uvicorn.Config(worker_app, uds=socket_path, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    with patch("app.worker.execute_magma", side_effect=_execute_with_fake_magma) as mock_exec:
+        task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        try:
+            yield mock_exec
+        finally:
+            server.should_exit = True
+            await task
+
+
+def test_remote_worker_executes(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+
+    async def run():
+        async with _worker_node(socket_path):
+            worker = RemoteWorker(f"unix:{socket_path}")
+            await worker.check()
+            result = await worker.execute("print 1+1;", LIMITS, seed=5)
+            return worker, result
+
+    worker, result = asyncio.run(run())
+    assert worker.healthy
+    assert worker.capacity == 4
+    assert "quit.\n2\n" in result.stdout
+    assert result.exit_code == 0
+    assert result.usage.wall_sec > 0
+
+
+def test_remote_worker_requires_token(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+
+    async def run():
+        async with _worker_node(socket_path):
+            with patch("app.worker.settings.worker_token", "secret"):
+                try:
+                    await RemoteWorker(f"unix:{socket_path}").execute("print 1;", LIMITS)
+                except WorkerError as e:
+                    rejected = e
+                result = await RemoteWorker(f"unix:{socket_path}", "secret").execute(
+                    "print 1;", LIMITS
+                )
+            return rejected, result
+
+    rejected, result = asyncio.run(run())
+    assert "401" in str(rejected)
+    assert "quit.\n1\n" in result.stdout
+
+
+def test_worker_cuts_limits_to_its_own(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+
+    async def run():
+        async with _worker_node(socket_path) as mock_exec:
+            await RemoteWorker(f"unix:{socket_path}").execute(
+                "print 1;", Limits(timeout=10**6, cpu_timeout=5, memory_mb=10**6)
+            )
+            return mock_exec.call_args.kwargs["limits"]
+
+    limits = asyncio.run(run())
+    assert limits == Limits(timeout=120, cpu_timeout=5, memory_mb=400)
+
+
+def test_busy_worker_answers_429(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+
+    async def run():
+        async with _worker_node(socket_path):
+            with patch("app.worker.active", 4):
+                try:
+                    await RemoteWorker(f"unix:{socket_path}").execute("print 1;", LIMITS)
+                except WorkerBusy as e:
+                    return e
+
+    assert "busy" in str(asyncio.run(run()))
+
+
+def test_worker_kills_run_when_api_node_goes_away(tmp_path):
+    from app import worker
+
+    socket_path = str(tmp_path / "worker.sock")
+
+    async def run():
+        async with _worker_node(socket_path):
+            task = asyncio.create_task(
+                RemoteWorker(f"unix:{socket_path}").execute("while true do end while;", LIMITS)
+            )
+            while worker.active == 0:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            # Well before the 10s time limit
+            for _ in range(200):
+                if worker.active == 0:
+                    return True
+                await asyncio.sleep(0.01)
+            return False
+
+    assert asyncio.run(run())
+
+
+def test_pool_retries_on_another_worker(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+
+    async def run():
+        async with _worker_node(socket_path):
+            dead = RemoteWorker(f"unix:{tmp_path / 'missing.sock'}")
+            live = RemoteWorker(f"unix:{socket_path}")
+            # The dead worker looks less loaded, so it is tried first
+            live.active = 1
+            live.capacity = 2
+            pool = WorkerPool([dead, live])
+            result = await pool.execute("print 3;", LIMITS)
+            return dead, pool.stats(), result
+
+    dead, stats, result = asyncio.run(run())
+    assert "quit.\n3\n" in result.stdout
+    assert dead.healthy is False
+    assert stats["dispatched"] == 2
+    assert stats["retried"] == 1
+
+
+def test_health_check_marks_unreachable_worker(tmp_path):
+    worker = RemoteWorker(f"unix:{tmp_path / 'missing.sock'}")
+    asyncio.run(WorkerPool([worker]).check())
+    assert worker.healthy is False
+
+
+class _StubWorker:
+    def __init__(self, name: str, active: int, capacity: int, busy: bool = False):
+        self.name = name
+        self.active = active
+        self.capacity = capacity
+        self.healthy = True
+        self.busy = busy
+
+    async def execute(self, code, limits, seed=None, on_stdout=None):
+        if self.busy:
+            raise WorkerBusy(f"Worker {self.name} is busy")
+        return ExecutionResult(stdout=self.name, stderr="", exit_code=0)
+
+
+def test_pool_picks_least_loaded_healthy_worker():
+    busy = _StubWorker("busy", active=3, capacity=4)
+    idle = _StubWorker("idle", active=1, capacity=4)
+    down = _StubWorker("down", active=0, capacity=4)
+    down.healthy = False
+    pool = WorkerPool([busy, idle, down])
+    result = asyncio.run(pool.execute("print 1;", LIMITS))
+    assert result.stdout == "idle"
+
+
+def test_pool_without_healthy_workers():
+    down = _StubWorker("down", active=0, capacity=1)
+    down.healthy = False
+
+    async def run():
+        try:
+            await WorkerPool([down]).execute("print 1;", LIMITS)
+        except WorkerError as e:
+            return e
+
+    assert "No worker available" in str(asyncio.run(run()))
+
+
+def test_pool_retries_busy_worker_without_marking_it():
+    busy = _StubWorker("busy", active=0, capacity=4, busy=True)
+    other = _StubWorker("other", active=3, capacity=4)
+    pool = WorkerPool([busy, other])
+    result = asyncio.run(pool.execute("print 1;", LIMITS))
+    assert result.stdout == "other"
+    assert busy.healthy is True
+    assert pool.retried == 1